@@ -4,13 +4,15 @@ Generate XYZ data with corresponding energies from some chosen PES:
 - Lennard Jones
 - Stillinger Weber etc.
 """
-from symmetry_transform import symmetryTransform, symmetryTransformBehler
+from symmetry_transform import symmetryTransform, symmetryTransformBehler, symmetryTransformBehlerBatch
+from descriptor_plan import load_descriptor_plan
 from timeit import default_timer as timer # Best timer indep. of system
 from math import pi,sqrt,exp,cos,isnan,sin
 from file_management import loadFromFile, readXYZ_Files
 from warnings import filterwarnings
 import tensorflow as tf
 import numpy as np
+import precision
 import glob
 # import time
 import sys
@@ -286,7 +288,7 @@ def createTrainDataDump(size, neighbours, PES, filename, only_concatenate=False,
             sys.stdout.write('\rSaving all training data to file.')
             sys.stdout.flush()
         np.random.shuffle(prev_data) # Shuffle the rows of the data i.e. the symmetry vectors
-        np.savetxt(filename, prev_data, delimiter=',')
+        np.savetxt(filename, prev_data, delimiter=',', fmt=precision.savetxt_fmt())
         if verbose:
             sys.stdout.write('\r' + ' '*80) # White out line
             sys.stdout.write('\rSaving all training data to file. Done!\n')
@@ -307,18 +309,10 @@ def createTrainDataDump(size, neighbours, PES, filename, only_concatenate=False,
                 sys.stdout.write('\rComputing potential energy. Done!\n')
                 sys.stdout.flush()
 
-            G_funcs, nmbr_G = generate_symmfunc_input_Si_Behler()
-            xTrain          = np.zeros((size, nmbr_G))
-
-            for i in range(size):
-                xyz_i       = xyz_N_train[:,:,i]
-                # xTrain[i,:] = symmetryTransform(G_funcs, xyz_i)
-                xTrain[i,:] = symmetryTransformBehler(G_funcs, xyz_i)
-                if verbose and (i+1)%10 == 0:
-                    sys.stdout.write('\r' + ' '*80) # White out line
-                    percent = round(float(i+1)/size*100., 2)
-                    sys.stdout.write('\rTransforming xyz with symmetry functions. %.2f %% complete' %(percent))
-                    sys.stdout.flush()
+            plan   = load_descriptor_plan()
+            nmbr_G = plan.n_descriptors
+            # All samples at once: (neighbours x 3 x size) --> (size x neighbours x 3)
+            xTrain = symmetryTransformBehlerBatch(plan, xyz_N_train.transpose(2,0,1), verbose=verbose)
         elif PES == PES_Lennard_Jones:
             sigma       = 1.0
             r_low       = 0.9 * sigma
@@ -352,13 +346,13 @@ def createTrainDataDump(size, neighbours, PES, filename, only_concatenate=False,
             sys.stdout.write('\n\r' + ' '*80) # White out line
             sys.stdout.write('\rSaving all training data to file.')
             sys.stdout.flush()
-        dump_data = np.zeros((size, nmbr_G + 1))
+        dump_data = np.zeros((size, nmbr_G + 1), dtype=precision.dtype)
         dump_data[:,0]  = Ep
         dump_data[:,1:] = xTrain
         if filesLoadedBool:
             dump_data = np.concatenate((dump_data, prev_data), axis=0) # Add loaded files
         np.random.shuffle(dump_data) # Shuffle the rows of the data i.e. the symmetry vectors
-        np.savetxt(filename, dump_data, delimiter=',')
+        np.savetxt(filename, dump_data, delimiter=',', fmt=precision.savetxt_fmt())
         if verbose:
             sys.stdout.write('\r' + ' '*80) # White out line
             sys.stdout.write('\rSaving all training data to file. Done!\n')
@@ -374,67 +368,24 @@ def createDataDumpBehlerSi():
 
         xyz_N_train    = createXYZ_uni2(r_low, r_high, size, neighbours, verbose=True)
         Ep             = potentialEnergyGenerator(xyz_N_train, PES)
-        params, nmbr_G = generate_symmfunc_input_Si_Behler()
-        xTrain         = np.zeros((size, nmbr_G))
-
-        for i in range(size):
-            xyz_i       = xyz_N_train[:,:,i]
-            xTrain[i,:] = symmetryTransformBehler(params, xyz_i)
+        plan           = load_descriptor_plan()
+        nmbr_G         = plan.n_descriptors
+        xTrain         = symmetryTransformBehlerBatch(plan, xyz_N_train.transpose(2,0,1), verbose=True)
 
-        dump_data = np.zeros((size, nmbr_G + 1))
+        dump_data = np.zeros((size, nmbr_G + 1), dtype=precision.dtype)
         dump_data[:,0]  = Ep
         dump_data[:,1:] = xTrain
         np.random.shuffle(dump_data) # Shuffle the rows of the data i.e. the symmetry vectors
-        np.savetxt("SW_Behler_200000_n10.txt", dump_data, delimiter=',')
+        np.savetxt("SW_Behler_200000_n10.txt", dump_data, delimiter=',', fmt=precision.savetxt_fmt())
 
 def generate_symmfunc_input_Si_Behler():
-    # Rescale to a lower cutoff, i.e. 3.77118
-    scale_to_SW_cut = False         # NOTICE ME SENPAI
-    if scale_to_SW_cut:
-        print "!!NB!! USING SCALED BEHLER SYMMETRY FUNCTIONS"
-    SW_cut          = 3.77118
-    scale_fac       = (SW_cut / 6.0) * 0.99999999999999 # Make damn sure floats stay below cut
-    # Behlers Si-values
-    paramsForSymm = []
-    with open("Important_data/behler_Si_symm_funcs.txt", "r") as open_file:
-        row = -1
-        for line in open_file:
-            row += 1
-            if row == 0:
-                continue
-            line = line.replace(",", " ")
-            linesplit = line.split()
-            if row == 1:
-                tot_nmbr_symm = int(linesplit[0])
-                continue
-            if linesplit[0] == "G2":
-                """
-                'G2', 2.0, 6.0, 0.0 # eta, cut, Rs
-                """
-                G2_params = np.array(linesplit[1:4], dtype=float)
-                if scale_to_SW_cut:
-                    G2_params[1:] *= scale_fac # cut AND Rs
-                paramsForSymm.append([2] + list(G2_params))
-            elif linesplit[0] == "G4":
-                """
-                'G4', 0.01 , 6.0, 1, 1  # eta, cut, zeta, lambda
-                """
-                G4_params = np.array(linesplit[1:5], dtype=float)
-                if scale_to_SW_cut:
-                    G4_params[1] *= scale_fac # ONLY cut
-                paramsForSymm.append([4] + list(G4_params))
-            elif linesplit[0] == "G5":
-                """
-                'G5', 0.01 , 6.0, 1, 1  # eta, cut, zeta, lambda
-                """
-                G5_params = np.array(linesplit[1:5], dtype=float)
-                if scale_to_SW_cut:
-                    G4_params[1] *= scale_fac # ONLY cut
-                paramsForSymm.append([5] + list(G5_params))
-            else:
-                print linesplit[0], "not understood. Should be 'G2', 'G4' or 'G5'..."
-    assert tot_nmbr_symm == len(paramsForSymm)
-    return paramsForSymm, tot_nmbr_symm
+    """
+    Behlers Si-values. The file is only parsed once, see load_descriptor_plan
+    (use the plan directly to get the parameters as numpy arrays).
+    """
+    scale_to_SW_cut = False         # NOTICE ME SENPAI (Rescale to a lower cutoff, i.e. 3.77118)
+    plan = load_descriptor_plan(scale_to_SW_cut=scale_to_SW_cut)
+    return plan.params_list, plan.n_descriptors
 
 def generate_symmfunc_input_Si_v1():
     sigma   = 2.0951
@@ -539,8 +490,10 @@ def NeighListDataToSymmToFile(open_filename, save_filename, size):
         x1 y1 z1 r1^2 x2 y2 z2 r2^2 ... xN yN zN rN^2 Ep
         """
         # G_funcs, nmbr_G = generate_symmfunc_input_Si_v1()   # Bad, don't use :)
-        G_funcs, nmbr_G = generate_symmfunc_input_Si_Behler() # Read from file, cleaner
-        xTrain          = np.zeros((size, nmbr_G))
+        plan            = load_descriptor_plan() # Read from file, cleaner
+        nmbr_G          = plan.n_descriptors
+        all_xyz         = [] # Ragged: all neighbours of all samples, see pad_environments
+        offsets         = [0]
         for i,row in enumerate(lammps_file):
             if i >= size:
                 continue # Skip to the next row
@@ -550,18 +503,21 @@ def NeighListDataToSymmToFile(open_filename, save_filename, size):
             xyzr_i = xyzr_i[:-1].reshape(n_elem,4)
             xyz_i  = xyzr_i[:,:-1]
             Ep.append(potentialEnergyGenerator(xyz_i, PES=PES_Stillinger_Weber))
-            xTrain[i,:] = symmetryTransformBehler(G_funcs, xyz_i)
+            all_xyz.append(xyz_i)
+            offsets.append(offsets[-1] + n_elem)
             if (i+1)%10 == 0:
                 sys.stdout.write('\r' + ' '*80) # White out line
                 percent = round(float(i+1)/size*100., 2)
-                sys.stdout.write('\rTransforming xyz with symmetry functions. %.2f %% complete' %(percent))
+                sys.stdout.write('\rComputing potential energy. %.2f %% complete' %(percent))
                 sys.stdout.flush()
+    print " "
+    xTrain = symmetryTransformBehlerBatch(plan, np.concatenate(all_xyz), offsets=offsets, verbose=True)
     print "\nNmbr of lines in file", i+1, ", length Ep:", len(Ep), ", size --> file:", size
-    dump_data = np.zeros((size, nmbr_G + 1))
+    dump_data = np.zeros((size, nmbr_G + 1), dtype=precision.dtype)
     dump_data[:,0]  = Ep
     dump_data[:,1:] = xTrain
     np.random.shuffle(dump_data) # Shuffle the rows of the data i.e. the symmetry vectors
-    np.savetxt(save_filename, dump_data, delimiter=',')
+    np.savetxt(save_filename, dump_data, delimiter=',', fmt=precision.savetxt_fmt())
     print "Saved symmetry vector training data to file:"
     print '"%s"\n' %save_filename
 
@@ -653,9 +609,10 @@ if __name__ == '__main__':
         cutoff         = 3.77118 # Stillinger-Weber
         samples_per_dt = 10       # Integer value or "all" (dont use "all" for very small systems!)
         test_boundary  = True   # Just use atoms wherever they are
+        box            = None   # Box vectors of periodic frames, None: 'Lattice=' in XYZ header (if any)
         file_path = "Important_data/Test_nn/enfil_sw_%sp%s.xyz" %(n_atoms,other_info)
         save_file = "Important_data/neigh_list_from_xyz_%sp%s.txt" %(n_atoms,other_info)
-        readXYZ_Files(file_path, save_file, samples_per_dt, cutoff, test_boundary)
+        readXYZ_Files(file_path, save_file, samples_per_dt, cutoff, test_boundary, box=box)
 
     if dumpXYZ_file:
         """
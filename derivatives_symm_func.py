@@ -1,38 +1,50 @@
-from symmetry_functions import cutoff_cos
-from create_train_data import generate_symmfunc_input_Si_Behler
+from symmetry_functions import cutoff_cos, register_backend, get_kernel, load_backend, _backends, _optional_backends
+import symmetry_functions
+from symmetry_transform import symmetryTransformBehlerGrad, symmetryTransformBehlerGradBatch, symmetryTransformBehler
+from descriptor_plan import load_descriptor_plan, as_descriptor_plan
+from neighbour_list import build_neighbour_list
 from math import * # Much quicker for _single_ floats than numpy equvivalent
 import numpy as np
 import sys
 
-def create_neighbour_list(all_atoms, selfindex, return_self=True):
+def create_neighbour_list(all_atoms, selfindex, return_self=True, cutoff=3.77118, box=None):
     """
-    Puts atom with index 'selfindex' in origo (0,0,0).
+    Puts atom with index 'selfindex' in origo (0,0,0) and returns
+    the neighbours inside 'cutoff' only (see neighbour_list).
 
     Method:
-    Subtracts x0,y0,z0 if selfindex is 0 from the rest of the atoms
-    castersian coordinates.
+    Subtracts x0,y0,z0 if selfindex is 0 from the neighbours
+    castersian coordinates. Atoms outside the cutoff are left out.
 
-    Below is illustration if selfindex = 1:
+    Below is illustration if selfindex = 1 (and a large cutoff):
     BEFORE          -->  AFTER
-    [[ 0,  1,  2],  -->  [[-3, -3, -1],
-     [ 3,  4,  5],  -->   [ 0,  0,  0],
+    [[ 0,  1,  2],  -->  [[ 0,  0,  0],  <-- self (if return_self)
+     [ 3,  4,  5],  -->   [-3, -3, -3],
      [ 6,  7,  8]]  -->   [ 3,  3,  3]]
     """
-    xyz  = np.copy(all_atoms) # Dont change all_atoms array!
-    xyz -= xyz[selfindex,:]
-    # Remove atoms outside SW cutoff! ...by moving them far away
-    for i, pos in enumerate(xyz):
-        if i == selfindex:
-            continue
-        else:
-            if np.linalg.norm(pos) > 3.77118:
-                xyz[i] = np.array([100.,100.,100.]) # Should be far enough away ;)
-    if not return_self:
-        # Delete row including self atom
-        xyz = np.delete(xyz, (selfindex), axis=0)
+    xyz = build_neighbour_list(all_atoms, cutoff, centers=[selfindex], box=box).displacements
+    if return_self:
+        # Self atom first, in origo
+        xyz = np.concatenate((np.zeros((1,3)), xyz))
     return xyz
 
-def force_calculation(dNNdG_matrix, all_atoms):
+def scatter_forces(dNNdG_matrix, dG, neigh_list):
+    """
+    Forces from the Jacobians dG (total_neighbours x nmbr_G x 3) of all
+    environments in neigh_list (all atoms are centers), see
+    symmetryTransformBehlerGradBatch (ragged input):
+        F_j = - sum_i dE_i/dG_i * dG_i/dx_j, where dG_i/dx_i = - sum_j dG_i/dx_ij
+    """
+    tot_atoms    = len(neigh_list)
+    centers      = neigh_list.center_of_rows()
+    dEi_dxj      = np.einsum('tg,tgc->tc', dNNdG_matrix[centers], dG)
+    total_forces = np.zeros((tot_atoms, 3)) # Fx, Fy, Fz on all atoms
+    for c in range(3):
+        total_forces[:,c] = np.bincount(centers, dEi_dxj[:,c], minlength=tot_atoms) \
+                          - np.bincount(neigh_list.indices, dEi_dxj[:,c], minlength=tot_atoms) # Minus sign since F = -d/dx V
+    return total_forces
+
+def force_calculation(dNNdG_matrix, all_atoms, plan=None, cutoff=3.77118, chunk_size=200, box=None):
     """
     Inputs: dNNdg, all_atoms
     - dNNdG_matrix is the matrix composed of vectors of same length as the symmetry vectors.
@@ -40,58 +52,68 @@ def force_calculation(dNNdG_matrix, all_atoms):
     the symmetry vector of atom i.
     - all_atoms is a matrix (numpy array) where atom i is:
     x,y,z = all_atoms[i,:]
+    - plan is the DescriptorPlan used to make the symmetry vectors (default: Behler Si)
+    - cutoff is the neighbour cutoff (SW cutoff)
+    - box are the box vectors of a periodic frame (see neighbour_list.as_box)
 
     This function further differentiates the symmetry
     vector with respect to actual atomic coordinates in order to find
-    analytic forces.
+    analytic forces. One neighbour list is built per frame and each Jacobian
+    is computed once, so the cost is O(N * neighbours).
 
     Returns:
     Numpy array with total forces on all particles in all xyz-directions.
     """
-    def i2xyz(i):
-        """ For easy reading of error checks """
-        if i == 0:
-            return "x"
-        elif i == 1:
-            return "y"
-        else:
-            return "z"
-    tot_atoms   = all_atoms.shape[0]
-    all_indices = range(tot_atoms)
+    if plan is None:
+        plan = load_descriptor_plan()
+    neigh_list = build_neighbour_list(all_atoms, cutoff, box=box)
+    _, dG      = symmetryTransformBehlerGradBatch(plan, neigh_list.displacements,
+                                                  offsets=neigh_list.offsets, chunk_size=chunk_size)
+    return scatter_forces(dNNdG_matrix, dG, neigh_list)
 
-    # Loop over all atoms
+def force_calculation_per_atom(dNNdG_matrix, all_atoms, plan=None, cutoff=3.77118, box=None):
+    """
+    Same as force_calculation, with one neighbour list and one Jacobian
+    per atom. Slow, i.e. only use for checking.
+    """
+    if plan is None:
+        plan = load_descriptor_plan()
+    tot_atoms    = all_atoms.shape[0]
     total_forces = np.zeros((tot_atoms, 3)) # Fx, Fy, Fz on all atoms
-    for selfindex, atom in enumerate(all_atoms):
-        selfneighborpositions = create_neighbour_list(all_atoms, selfindex)
-        selfneighborindices   = [ind for ind in all_indices if ind != selfindex]
-        self_dNNdG            = dNNdG_matrix[selfindex,:]
-
-        # Loop over directions X,Y,Z: (0 = x, 1 = y, 2 = z)
-        for i in range(3):
-            # Calculating derivative of fingerprints of self atom w.r.t. coordinates of itself.
-            sym_f_der = symmetry_func_derivative(selfindex, selfneighborindices, selfneighborpositions, selfindex, i)
-            total_forces[selfindex, i] += -np.dot(sym_f_der, self_dNNdG) # Minus sign since F = -d/dx V
-            # if selfindex == 0:
-            #     print i2xyz(i),-np.dot(sym_f_der, self_dNNdG)
-
-            # Calculating derivative of fingerprints of neighbor atom w.r.t. coordinates of self atom.
-            for neigh_index in selfneighborindices:
-                # for calculating forces, summation runs over neighbor atoms
-                neighborpositions = create_neighbour_list(all_atoms, neigh_index)
-                nneighborindices  = [ind for ind in all_indices if ind != neigh_index]
-                neigh_dNNdG       = dNNdG_matrix[neigh_index,:]
-
-                # for calculating derivatives of fingerprints, summation runs over neighboring atoms
-                sym_f_der = symmetry_func_derivative(neigh_index, nneighborindices, neighborpositions, selfindex, i)
-                total_forces[selfindex, i] += -np.dot(sym_f_der, neigh_dNNdG)
-                if selfindex == 0:
-                    print i2xyz(i),-np.dot(sym_f_der, neigh_dNNdG)
-        # print "F sum: X,Y,Z:", total_forces[selfindex]
-        # raw_input("one atom done!")
+    for selfindex in range(tot_atoms):
+        neigh_list  = build_neighbour_list(all_atoms, cutoff, centers=[selfindex], box=box)
+        _, dG       = symmetryTransformBehlerGrad(plan, neigh_list.displacements) # (nmbr_G x neighbours x 3)
+        dEi_dxj     = np.tensordot(dNNdG_matrix[selfindex,:], dG, axes=1) # Neighbours j
+        np.subtract.at(total_forces, neigh_list.indices, dEi_dxj) # Minus sign since F = -d/dx V
+        total_forces[selfindex] += np.sum(dEi_dxj, axis=0)  # x_ij = x_j - x_i
     return total_forces
 
+def nn_energy_and_forces(neural_network, all_atoms, cutoff=3.77118, chunk_size=200, box=None, neigh_list=None):
+    """
+    Potential energy of every atom and the forces on all atoms for one frame,
+    symmetry vectors and their Jacobians come from the same pass.
+    box: Box vectors if the frame is periodic.
+    neigh_list: NeighbourList of the frame, i.e. from a VerletList (default: new list)
+    """
+    if neigh_list is None:
+        neigh_list = build_neighbour_list(all_atoms, cutoff, box=box)
+    G, dG            = symmetryTransformBehlerGradBatch(neural_network.plan, neigh_list.displacements,
+                                                        offsets=neigh_list.offsets, chunk_size=chunk_size)
+    Ep, dNNdG_matrix = neural_network.engine()(G) # Evaluates the NN (work arrays of the engine)
+    return np.array(Ep), scatter_forces(dNNdG_matrix, dG, neigh_list)
+
+def diamond_lattice(unit_cells, a=5.431, noise=0.0):
+    """
+    Atoms of unit_cells^3 diamond unit cells (8 atoms each), lattice constant a,
+    as in Important_data/Test_nn/nnp.in. 'noise' is the std.dev. of random displacements.
+    """
+    basis  = np.array([[0,0,0],[.5,.5,0],[.5,0,.5],[0,.5,.5],
+                       [.25,.25,.25],[.75,.75,.25],[.75,.25,.75],[.25,.75,.75]])
+    cells  = np.array([(x,y,z) for x in range(unit_cells) for y in range(unit_cells) for z in range(unit_cells)])
+    atoms  = (cells[:,np.newaxis,:] + basis[np.newaxis,:,:]).reshape(-1,3) * a
+    return atoms + np.random.normal(0, noise, atoms.shape)
 
-def symmetry_func_derivative(index, neighborindices, neighborpositions, m, l):
+def symmetry_func_derivative(index, neighborindices, neighborpositions, m, l, plan=None):
     """
     Returns the value of the derivative of G for atom with index 'index',
     with respect to coordinate x_l of atom index m.
@@ -108,9 +130,19 @@ def symmetry_func_derivative(index, neighborindices, neighborpositions, m, l):
         Index of the pair atom.
     l : int
         Direction of the derivative; is an integer 0, 1, 2
+    plan : DescriptorPlan
+        Symmetry functions to differentiate (default: Behler Si, parsed only once)
     """
-    G_funcs, nmbr_G = generate_symmfunc_input_Si_Behler()
+    if plan is None:
+        plan = load_descriptor_plan()
+    plan            = as_descriptor_plan(plan)
+    if symmetry_functions.active_backend == "numpy":
+        # All rows at once from the Jacobian of the whole symmetry vector
+        return ddx_from_jacobian(plan, neighborindices, neighborpositions, index, m, l)
+    G_funcs         = plan.params_list
+    nmbr_G          = plan.n_descriptors
     ddx_symm_vec    = np.zeros(nmbr_G)
+    ddx_G2, ddx_G4, ddx_G5 = [get_kernel(kernel) for kernel in ["ddx_G2", "ddx_G4", "ddx_G5"]] # Active backend
 
     # Loop over all values of the symmetry vector
     for i in range(nmbr_G):
@@ -118,18 +150,34 @@ def symmetry_func_derivative(index, neighborindices, neighborpositions, m, l):
         if which_symm == 2:
             _, eta, rc, rs  = G_funcs[i]
             eta, rc, rs     = float(eta), float(rc), float(rs)
-            ddx_symm_vec[i] = calculate_ddx_G2(neighborindices, neighborpositions, eta, rc, rs, index, m, l)
+            ddx_symm_vec[i] = ddx_G2(neighborindices, neighborpositions, eta, rc, rs, index, m, l)
         elif which_symm == 4:
             _, eta, rc, zeta, lamb = G_funcs[i]
             eta, rc, zeta, lamb    = float(eta), float(rc), float(zeta), float(lamb)
-            ddx_symm_vec[i]        = calculate_ddx_G4(neighborindices, neighborpositions, lamb, zeta, eta, rc, index, m, l)
-            # ddx_symm_vec[i]   = calculate_ddx_G4(neighborindices, neighborpositions, lamb, zeta, eta, rc, index, m, l)
-            # raw_input("skip ahead!")
+            ddx_symm_vec[i]        = ddx_G4(neighborindices, neighborpositions, lamb, zeta, eta, rc, index, m, l)
+        elif which_symm == 5:
+            _, eta, rc, zeta, lamb = G_funcs[i]
+            eta, rc, zeta, lamb    = float(eta), float(rc), float(zeta), float(lamb)
+            ddx_symm_vec[i]        = ddx_G5(neighborindices, neighborpositions, lamb, zeta, eta, rc, index, m, l)
         else:
-            print "Only use symmetry functions G2 or G4! Exiting!"
+            print "Only use symmetry functions G2, G4 or G5! Exiting!"
             sys.exit(0)
     return ddx_symm_vec
 
+def ddx_from_jacobian(params, neighborindices, neighborpositions, i, m, l):
+    """
+    Derivative of the symmetry functions 'params' (DescriptorPlan or list of lists)
+    of atom i w.r.t. coordinate x_l of atom m, for any number of neighbours.
+    """
+    neighborindices   = list(neighborindices)
+    neighborpositions = np.asarray(neighborpositions, dtype=float)
+    xyz_ij            = neighborpositions[neighborindices] - neighborpositions[i]
+    _, dG             = symmetryTransformBehlerGrad(params, xyz_ij) # (nmbr_G x neighbours x 3)
+    if m == i:
+        return -np.sum(dG[:,:,l], axis=1) # x_ij = x_j - x_i
+    if m in neighborindices:
+        return dG[:,neighborindices.index(m),l]
+    return np.zeros(dG.shape[0])
 
 def calculate_ddx_G2(neighborindices, neighborpositions, eta, Rc, Rs, i, m, l):
     """
@@ -141,83 +189,24 @@ def calculate_ddx_G2(neighborindices, neighborpositions, eta, Rc, Rs, i, m, l):
     ---------
     neighborindices : list of int
         List of int of neighboring atoms.
-    neighborsymbols : list of str
-        List of symbols of neighboring atoms.
     neighborpositions : list of list of float
         List of Cartesian atomic positions of neighboring atoms.
     """
-    Ri    = neighborpositions[i] # This also contains xyz of the atom we are inspecting
-    value = 0.0                  # Single value of the symmetry vector derivative
-    cutoff_func     = cutoff_cos
-    ddx_cutoff_func = ddx_cutoff_cos
-    num_neighbors   = len(neighborindices)
-    if np.sum(np.abs(Ri)) > 1E-15: # Make sure we have the right atom in center
-        print "You may have wrong atom in center, pos:", Ri, ". Exiting"
-        sys.exit(0)
-    for j in neighborindices:    # Loop over everyone EXCEPT atom with position Ri
-        Rj       = neighborpositions[j,:] # x,y,z of atom j
-        dRijdRml = dRij_dRml(i, j, Ri, Rj, m, l)
-        if dRijdRml != 0:
-            Rij    = np.linalg.norm(Rj - Ri) # Ri = 0,0,0, but still written for clarity
-            term   = -2.0*eta*(Rij-Rs) * cutoff_func(Rij, Rc) + ddx_cutoff_func(Rij, Rc)
-            value += exp(-eta*(Rij-Rs)**2) * term * dRijdRml
-    return value
+    return ddx_from_jacobian([[2, eta, Rc, Rs]], neighborindices, neighborpositions, i, m, l)[0]
 
 def calculate_ddx_G4(neighborindices, neighborpositions, lamb, zeta, eta, rc, index, m, l):
     """
-    Derivative of symmetry function G4 w.r.t xij, yij, zij.
-    """
-    # xyz, eta, rc, zeta, lamb
-    xyz = np.array([neighborpositions[ind] for ind in neighborindices])
-    # Vectors of x,y,z-coordinates for neighbours
-    if len(xyz[:,0]) != 2:
-        # print "Warning: dG4 d x,y,z only works on single unique triplet"
-        return np.zeros(3)
-    r = np.linalg.norm(xyz, axis=1) # Neighbour distances
-    xij = xyz[0,0]; yij = xyz[0,1]; zij = xyz[0,2]
-    xik = xyz[1,0]; yik = xyz[1,1]; zik = xyz[1,2]
-    rij = r[0]    ; rik = r[1]    ; rjk = np.linalg.norm(xyz[0,:]-xyz[1,:])
-    cosTheta = (xij*xik + yij*yik + zij*zik) / (rij*rik)
-
-    # ...and finally the derivaties from sympy: (hold on to something!!)
-    dG4_dxij = -2**(-zeta)*(cos(pi*rik/rc) + 1)*(cos(pi*rjk/rc) + 1)\
-               *(0.5*eta*rc*rij**2*rik*xij*(cosTheta*lamb + 1)**(zeta + 1)\
-               *(cos(pi*rij/rc) + 1) + 0.25*lamb*rc*zeta*(cosTheta*lamb + 1)**zeta\
-               *(cosTheta*rik*xij - rij*xik)*(cos(pi*rij/rc) + 1) + 0.25*pi*rij*rik*xij\
-               *(cosTheta*lamb + 1)**(zeta + 1)*sin(pi*rij/rc))*exp(-eta*(rij**2 + rik**2 + rjk**2))\
-               /(rc*rij**2*rik*(cosTheta*lamb + 1))
-    dG4_dyij = -2**(-zeta)*(cos(pi*rik/rc) + 1)*(cos(pi*rjk/rc) + 1)\
-               *(0.5*eta*rc*rij**2*rik*yij*(cosTheta*lamb + 1)**(zeta + 1)\
-               *(cos(pi*rij/rc) + 1) + 0.25*lamb*rc*zeta*(cosTheta*lamb + 1)**zeta\
-               *(cosTheta*rik*yij - rij*yik)*(cos(pi*rij/rc) + 1) + 0.25*pi*rij*rik*yij\
-               *(cosTheta*lamb + 1)**(zeta + 1)*sin(pi*rij/rc))*exp(-eta*(rij**2 + rik**2 + rjk**2))\
-               /(rc*rij**2*rik*(cosTheta*lamb + 1))
-    dG4_dzij = -2**(-zeta)*(cos(pi*rik/rc) + 1)*(cos(pi*rjk/rc) + 1)\
-               *(0.5*eta*rc*rij**2*rik*zij*(cosTheta*lamb + 1)**(zeta + 1)\
-               *(cos(pi*rij/rc) + 1) + 0.25*lamb*rc*zeta*(cosTheta*lamb + 1)**zeta\
-               *(cosTheta*rik*zij - rij*zik)*(cos(pi*rij/rc) + 1) + 0.25*pi*rij*rik*zij\
-               *(cosTheta*lamb + 1)**(zeta + 1)*sin(pi*rij/rc))*exp(-eta*(rij**2 + rik**2 + rjk**2))\
-               /(rc*rij**2*rik*(cosTheta*lamb + 1))
-    dG4_dxik = -2**(-zeta)*(cos(pi*rij/rc) + 1)*(cos(pi*rjk/rc) + 1)\
-               *(0.5*eta*rc*rij*rik**2*xik*(cosTheta*lamb + 1)**(zeta + 1)\
-               *(cos(pi*rik/rc) + 1) + 0.25*lamb*rc*zeta*(cosTheta*lamb + 1)**zeta\
-               *(cosTheta*rij*xik - rik*xij)*(cos(pi*rik/rc) + 1) + 0.25*pi*rij*rik*xik\
-               *(cosTheta*lamb + 1)**(zeta + 1)*sin(pi*rik/rc))*exp(-eta*(rij**2 + rik**2 + rjk**2))\
-               /(rc*rij*rik**2*(cosTheta*lamb + 1))
-    dG4_dyik = -2**(-zeta)*(cos(pi*rij/rc) + 1)*(cos(pi*rjk/rc) + 1)\
-               *(0.5*eta*rc*rij*rik**2*yik*(cosTheta*lamb + 1)**(zeta + 1)\
-               *(cos(pi*rik/rc) + 1) + 0.25*lamb*rc*zeta*(cosTheta*lamb + 1)**zeta\
-               *(cosTheta*rij*yik - rik*yij)*(cos(pi*rik/rc) + 1) + 0.25*pi*rij*rik*yik\
-               *(cosTheta*lamb + 1)**(zeta + 1)*sin(pi*rik/rc))*exp(-eta*(rij**2 + rik**2 + rjk**2))\
-               /(rc*rij*rik**2*(cosTheta*lamb + 1))
-    dG4_dzik = -2**(-zeta)*(cos(pi*rij/rc) + 1)*(cos(pi*rjk/rc) + 1)\
-               *(0.5*eta*rc*rij*rik**2*zik*(cosTheta*lamb + 1)**(zeta + 1)\
-               *(cos(pi*rik/rc) + 1) + 0.25*lamb*rc*zeta*(cosTheta*lamb + 1)**zeta\
-               *(cosTheta*rij*zik - rik*zij)*(cos(pi*rik/rc) + 1) + 0.25*pi*rij*rik*zik\
-               *(cosTheta*lamb + 1)**(zeta + 1)*sin(pi*rik/rc))*exp(-eta*(rij**2 + rik**2 + rjk**2))\
-               /(rc*rij*rik**2*(cosTheta*lamb + 1))
-    tot_force = -1.0*np.array([dG4_dxij+dG4_dxik, dG4_dyij+dG4_dyik, dG4_dzij+dG4_dzik])[l] # Minus sign comes from F = -d/dx V
-    return tot_force
+    Derivative of symmetry function G4 for atom 'index' w.r.t. coordinate x_l of atom m
+    (any number of neighbours)
+    """
+    return ddx_from_jacobian([[4, eta, rc, zeta, lamb]], neighborindices, neighborpositions, index, m, l)[0]
+
+def calculate_ddx_G5(neighborindices, neighborpositions, lamb, zeta, eta, rc, index, m, l):
+    """
+    Derivative of symmetry function G5 for atom 'index' w.r.t. coordinate x_l of atom m
+    (any number of neighbours)
+    """
+    return ddx_from_jacobian([[5, eta, rc, zeta, lamb]], neighborindices, neighborpositions, index, m, l)[0]
 
 def ddx_cutoff_cos(Rij, Rc):
     """
@@ -229,8 +218,143 @@ def ddx_cutoff_cos(Rij, Rc):
         return (-0.5 * pi / Rc) * sin(pi * Rij / Rc)
 
 
+register_backend("numpy", {"ddx_G2": calculate_ddx_G2, "ddx_G4": calculate_ddx_G4, "ddx_G5": calculate_ddx_G5})
+
+def check_derivative_backends(n_atoms=[2,5,12], tolerance=1E-12):
+    """
+    Checks that the derivative kernels of every available backend agree
+    with the numpy (reference) backend within 'tolerance' (relative),
+    for all atoms m and directions l. Returns True if all agree.
+    """
+    plan   = load_descriptor_plan()
+    all_ok = True
+    for name in sorted(set(_backends) | set(_optional_backends)):
+        if name == "numpy" or not load_backend(name):
+            continue
+        for kernel in sorted(_backends[name]):
+            if kernel == "ddx_G2":
+                rows, params = plan.G2_rows, [plan.eta, plan.rc, plan.rs]
+            elif kernel in ["ddx_G4", "ddx_G5"]:
+                rows   = np.append(plan.G4_rows, plan.G5_rows) # Same parameters for both kernels
+                params = [plan.lambd, plan.zeta, plan.eta, plan.rc]
+            else:
+                continue # Not a derivative kernel, see symmetry_functions.check_backends
+            max_diff = 0.0
+            for N in n_atoms:
+                all_atoms = np.random.uniform(-2.5, 2.5, (N, 3))
+                positions = create_neighbour_list(all_atoms, 0)
+                indices   = range(1, len(positions))
+                for row in rows:
+                    for m in range(len(positions)):
+                        for l in range(3):
+                            args     = [indices, positions] + [float(p[row]) for p in params] + [0, m, l]
+                            ref      = get_kernel(kernel, "numpy")(*args)
+                            value    = get_kernel(kernel, name)(*args)
+                            max_diff = max(max_diff, abs(value - ref) / max(abs(ref), 1.0))
+            ok     = max_diff <= tolerance
+            all_ok = all_ok and ok
+            print "Backend %-6s %-7s max rel.diff: %g %s" %(name, kernel, max_diff, "OK" if ok else "FAILED")
+    return all_ok
+
+def check_derivatives(n_atoms=[2,3,8,20], h=1E-6, tolerance=1E-6):
+    """
+    Analytic derivatives (G2, G4 and G5 for any number of neighbours) and
+    forces vs. central differences, on random clusters. The energy used for the
+    forces is linear in the symmetry vectors, E = sum_i c.G_i, so dNNdG = c.
+    Differences are relative to max(|analytic|, 1). Returns True if all are
+    within 'tolerance'.
+    """
+    plan = load_descriptor_plan()
+    G4_plan = as_descriptor_plan([[4] + list(p[1:]) for p in plan.params_list if p[0] == 5]) # G4 on the G5 parameters
+    all_ok = True
+    print "Atoms | Max abs.diff dG/dx (G2,G5) | Max abs.diff dG/dx (G4) | Max abs.diff forces | Max |F|"
+    for N in n_atoms:
+        all_atoms = np.random.uniform(0, 1.2*N**(1/3.), (N, 3)) + np.random.normal(0, 0.1, (N, 3))
+        positions = create_neighbour_list(all_atoms, 0)
+        indices   = range(1, len(positions))
+        max_diff  = [0.0, 0.0]
+        max_dG    = 1.0
+        for k, cur_plan in enumerate([plan, G4_plan]):
+            for m in range(len(positions)):
+                for l in range(3):
+                    analytic  = symmetry_func_derivative(0, indices, positions, m, l, cur_plan)
+                    G_off     = []
+                    for offset in [h, -h]:
+                        pos_c       = np.copy(positions)
+                        pos_c[m,l] += offset
+                        G_off.append(symmetryTransformBehler(cur_plan, pos_c[indices] - pos_c[0]))
+                    max_diff[k] = max(max_diff[k], np.max(np.abs(analytic - (G_off[0] - G_off[1])/(2*h))))
+                    max_dG      = max(max_dG, np.max(np.abs(analytic)))
+        # Forces:
+        c        = np.random.normal(0, 1, plan.n_descriptors)
+        energy   = lambda xyz: sum(np.dot(c, symmetryTransformBehler(plan, create_neighbour_list(xyz, i, False)))
+                                   for i in range(N))
+        F        = force_calculation(np.tile(c, (N,1)), all_atoms, plan)
+        F_fd     = np.zeros((N, 3))
+        for m in range(N):
+            for l in range(3):
+                Ep_off = []
+                for offset in [h, -h]:
+                    xyz_c       = np.copy(all_atoms)
+                    xyz_c[m,l] += offset
+                    Ep_off.append(energy(xyz_c))
+                F_fd[m,l] = -(Ep_off[0] - Ep_off[1])/(2*h)
+        F_diff   = np.max(np.abs(F - F_fd))
+        ok       = max(max_diff) <= tolerance*max_dG and F_diff <= tolerance*max(np.max(np.abs(F)), 1.0)
+        all_ok   = all_ok and ok
+        print "%5d | %26g | %23g | %19g | %g %s" %(N, max_diff[0], max_diff[1], F_diff, np.max(np.abs(F)),
+                                                   "OK" if ok else "FAILED")
+    return all_ok
+
+def benchmark_force_engine(unit_cells=range(1,11), per_atom_max=3, noise=0.1):
+    """
+    Timing of force_calculation on the diamond lattices of nnp.in (8, 64, ..., 8000 atoms),
+    compared with one neighbour list per atom (force_calculation_per_atom) for small sizes.
+    """
+    from timeit import default_timer as timer
+    plan = load_descriptor_plan()
+    print " Atoms | Neighbours/atom | Engine [s] | Engine [us/atom] | Per atom [s] | Speedup | Max abs.diff"
+    for L in unit_cells:
+        all_atoms = diamond_lattice(L, noise=noise)
+        N         = len(all_atoms)
+        dNNdG     = np.random.normal(0, 1, (N, plan.n_descriptors))
+        t0        = timer()
+        F         = force_calculation(dNNdG, all_atoms, plan)
+        t_engine  = timer() - t0
+        offsets   = build_neighbour_list(all_atoms).offsets
+        if L <= per_atom_max:
+            t0        = timer()
+            F_ref     = force_calculation_per_atom(dNNdG, all_atoms, plan)
+            t_ref     = timer() - t0
+            print "%6d | %15.2f | %10.4f | %16.1f | %12.4f | %7.1f | %g" %(N, offsets[-1]/float(N), t_engine,
+                        t_engine/N*1E6, t_ref, t_ref/t_engine, np.max(np.abs(F - F_ref)))
+        else:
+            print "%6d | %15.2f | %10.4f | %16.1f | %12s | %7s | %s" %(N, offsets[-1]/float(N), t_engine,
+                        t_engine/N*1E6, "-", "-", "-")
+
+
+def run_checks():
+    """
+    All consistency checks of the symmetry functions and their derivatives:
+    every backend vs. numpy, analytic gradients vs. central differences.
+    Returns True if all pass.
+    """
+    from symmetry_functions import check_backends
+    from symmetry_transform import check_gradients
+    results = [check_backends(), check_derivative_backends(), check_gradients(), check_derivatives()]
+    return all(results)
 
 if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == "check":
+        """
+        >>> python derivatives_symm_func.py check
+        Exits with status 1 if any check fails
+        """
+        if not run_checks():
+            print "Symmetry function checks FAILED"
+            sys.exit(1)
+        print "All symmetry function checks OK"
+        sys.exit(0)
     """
     Checking that neigh. list correctly removes atoms outside cutoff at 3.77118
     """
@@ -238,3 +362,5 @@ if __name__ == '__main__':
     for selfindex in range(4):
         print selfindex
         print create_neighbour_list(test, selfindex), "\n"
+    check_derivatives()
+    benchmark_force_engine()
@@ -0,0 +1,161 @@
+"""
+Compiled set of symmetry functions ("descriptor plan").
+
+The Behler parameter file is parsed once into typed numpy arrays,
+grouped by symmetry function type and cutoff, so that the transform,
+the derivatives and the network evaluation never have to re-read it.
+"""
+import hashlib
+import os
+import numpy as np
+
+behler_Si_file = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                              "Important_data", "behler_Si_symm_funcs.txt")
+
+class DescriptorPlan:
+    """
+    Symmetry function parameters stored column-wise. Row n of the plan
+    is symmetry function number n in the symmetry vector.
+    Parameters not used by a function type are NaN, i.e. rs for G4/G5.
+
+    ----------------
+    Symm |   Vars
+    ----------------
+    G2   |   eta, rc, rs
+    G4   |   eta, rc, zeta, lambd
+    G5   |   eta, rc, zeta, lambd
+    """
+    def __init__(self, params_list, filename=None):
+        """
+        params_list: Same format as returned by generate_symmfunc_input_Si_Behler,
+            [[2, eta, rc, rs], [5, eta, rc, zeta, lambd], ...]
+        The hash only depends on the parameters, not on where they were read from.
+        """
+        n = len(params_list)
+        self.filename    = filename
+        self.params_list = [list(cur_param_set) for cur_param_set in params_list]
+        self.kind        = np.zeros(n, dtype=int)
+        self.eta         = np.full(n, np.nan)
+        self.rc          = np.full(n, np.nan)
+        self.rs          = np.full(n, np.nan)
+        self.zeta        = np.full(n, np.nan)
+        self.lambd       = np.full(n, np.nan)
+        for i,cur_param_set in enumerate(self.params_list):
+            self.kind[i] = cur_param_set[0]
+            if cur_param_set[0] == 2:
+                self.eta[i], self.rc[i], self.rs[i] = cur_param_set[1:4]
+            elif cur_param_set[0] in [4,5]:
+                self.eta[i], self.rc[i], self.zeta[i], self.lambd[i] = cur_param_set[1:5]
+            else:
+                raise ValueError("Symm.func. number: %s was not understood. Input 2, 4 or 5..." %cur_param_set[0])
+        self.G2_rows = np.where(self.kind == 2)[0]
+        self.G4_rows = np.where(self.kind == 4)[0]
+        self.G5_rows = np.where(self.kind == 5)[0]
+        self.cutoffs = np.unique(self.rc[~np.isnan(self.rc)])
+        # Rows grouped by function type and cutoff: (kind, rc) --> rows
+        self.groups  = {}
+        for kind in [2,4,5]:
+            for rc in self.cutoffs:
+                rows = np.where((self.kind == kind) & (self.rc == rc))[0]
+                if len(rows):
+                    self.groups[(kind, rc)] = rows
+        columns   = [self.kind.astype("<i8")] + [c.astype("<f8") for c in [self.eta, self.rc, self.rs, self.zeta, self.lambd]]
+        self.hash = hashlib.sha1(b"".join(np.ascontiguousarray(c).tobytes() for c in columns)).hexdigest()
+    def __len__(self):
+        return len(self.kind)
+    @property
+    def n_descriptors(self):
+        """
+        Length of the symmetry vector
+        """
+        return len(self.kind)
+    @property
+    def max_cutoff(self):
+        return self.cutoffs.max()
+
+_plan_cache = {} # (path, content hash, scaled) --> DescriptorPlan
+_hash_cache = {} # path --> (mtime, size, content hash)
+
+def load_descriptor_plan(filename=behler_Si_file, scale_to_SW_cut=False):
+    """
+    Returns the DescriptorPlan of a Behler-type parameter file.
+    Plans are memoized by path and content hash, so calling this repeatedly
+    only costs an os.stat as long as the file is unchanged.
+    """
+    path = os.path.abspath(filename)
+    stat = os.stat(path)
+    if path in _hash_cache and _hash_cache[path][:2] == (stat.st_mtime, stat.st_size):
+        file_hash = _hash_cache[path][2]
+    else:
+        with open(path, "rb") as open_file:
+            file_hash = hashlib.sha1(open_file.read()).hexdigest()
+        _hash_cache[path] = (stat.st_mtime, stat.st_size, file_hash)
+    key = (path, file_hash, scale_to_SW_cut)
+    if key not in _plan_cache:
+        params_list      = read_behler_symm_funcs(path, scale_to_SW_cut)
+        _plan_cache[key] = DescriptorPlan(params_list, filename=filename)
+    return _plan_cache[key]
+
+def read_behler_symm_funcs(filename, scale_to_SW_cut=False):
+    """
+    Parses the Behler parameter file. Returns list of lists:
+    [[2, eta, rc, rs], [5, eta, rc, zeta, lambd], ...]
+    """
+    if scale_to_SW_cut:
+        # Rescale to a lower cutoff, i.e. 3.77118
+        print "!!NB!! USING SCALED BEHLER SYMMETRY FUNCTIONS"
+    SW_cut          = 3.77118
+    scale_fac       = (SW_cut / 6.0) * 0.99999999999999 # Make damn sure floats stay below cut
+    paramsForSymm = []
+    with open(filename, "r") as open_file:
+        row = -1
+        for line in open_file:
+            row += 1
+            if row == 0:
+                continue
+            line = line.replace(",", " ")
+            linesplit = line.split()
+            if row == 1:
+                tot_nmbr_symm = int(linesplit[0])
+                continue
+            if linesplit[0] == "G2":
+                """
+                'G2', 2.0, 6.0, 0.0 # eta, cut, Rs
+                """
+                G2_params = np.array(linesplit[1:4], dtype=float)
+                if scale_to_SW_cut:
+                    G2_params[1:] *= scale_fac # cut AND Rs
+                paramsForSymm.append([2] + list(G2_params))
+            elif linesplit[0] == "G4":
+                """
+                'G4', 0.01 , 6.0, 1, 1  # eta, cut, zeta, lambda
+                """
+                G4_params = np.array(linesplit[1:5], dtype=float)
+                if scale_to_SW_cut:
+                    G4_params[1] *= scale_fac # ONLY cut
+                paramsForSymm.append([4] + list(G4_params))
+            elif linesplit[0] == "G5":
+                """
+                'G5', 0.01 , 6.0, 1, 1  # eta, cut, zeta, lambda
+                """
+                G5_params = np.array(linesplit[1:5], dtype=float)
+                if scale_to_SW_cut:
+                    G5_params[1] *= scale_fac # ONLY cut
+                paramsForSymm.append([5] + list(G5_params))
+            else:
+                print linesplit[0], "not understood. Should be 'G2', 'G4' or 'G5'..."
+    assert tot_nmbr_symm == len(paramsForSymm)
+    return paramsForSymm
+
+_list_cache = {} # Plans made from parameter lists (not files)
+
+def as_descriptor_plan(all_params_list):
+    """
+    Lets functions accept either a DescriptorPlan or the old list of lists.
+    """
+    if isinstance(all_params_list, DescriptorPlan):
+        return all_params_list
+    key = tuple(tuple(cur_param_set) for cur_param_set in all_params_list)
+    if key not in _list_cache:
+        _list_cache[key] = DescriptorPlan(all_params_list)
+    return _list_cache[key]
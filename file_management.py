@@ -4,6 +4,8 @@ import glob
 import shutil
 import datetime
 import numpy as np
+import precision
+from neighbour_list import build_neighbour_list, minimum_image
 from time import sleep
 
 def timeStamp():
@@ -11,30 +13,41 @@ def timeStamp():
 
 class loadFromFile:
     """
-    Loads file, shuffle rows and keeps it in memory for later use.
+    Loads file and keeps it in memory for later use, the data itself is never
+    moved: the test set and the batches are rows picked by index arrays, so
+    shuffling only permutes the (train) row indices.
+    Data is stored as precision.dtype.
+    reuse_buffer: Batches are gathered into the same work array (only valid until the next call)
     """
-    def __init__(self, testSizeSkip, filename, shuffle_rows=True):
+    def __init__(self, testSizeSkip, filename, shuffle_rows=True, reuse_buffer=False):
         self.skipIndices = testSizeSkip
         self.index       = 0
         self.filename    = filename
         if os.path.isfile(filename): # If file exist, load it
             try:
-                self.buffer = np.loadtxt(filename, delimiter=',')
+                self.buffer = np.loadtxt(filename, delimiter=',', dtype=precision.dtype)
             except Exception as e:
                 print "Could not load buffer. Error message follows:\n %s" %s
         else:
             print 'Found no training data called:\n"%s"\n...exiting!' %filename
             sys.exit(0)
+        self.buffer.flags.writeable = False # Rows are only ever picked, not moved
         if shuffle_rows:
-            np.random.shuffle(self.buffer) # Shuffles rows only (not columns) by default *yey*
+            rows = np.random.permutation(self.buffer.shape[0]) # Shuffles rows only (not columns)
+        else:
+            rows = np.arange(self.buffer.shape[0])
         # print "Tot. data points loaded from file:", self.buffer.shape[0]
-        self.testData  = self.buffer[0:testSizeSkip,:] # Pick out test data from total
-        self.buffer    = self.buffer[testSizeSkip:,:]  # Use rest of data for training
-        self.totTrainData = self.buffer.shape[0]
+        self.test_rows    = rows[0:testSizeSkip] # Pick out test data from total
+        self.train_rows   = rows[testSizeSkip:]  # Use rest of data for training
+        self.totTrainData = len(self.train_rows)
+        self.reuse_buffer = reuse_buffer
+        self.batch_buffer = None
 
     def __call__(self, size, return_test=False, verbose=False, shuffle=False):
         """
-        Returns the next batch of size 'size' which is a set of rows from the loaded file
+        Returns the next batch of size 'size' which is a set of rows from the loaded file.
+        The last batch of an epoch holds the rest of the training data (can be smaller),
+        epochIsDone is True for the first batch of the next epoch.
         """
         epochIsDone = False
         testSize = self.skipIndices
@@ -44,37 +57,44 @@ class loadFromFile:
                 print "You initiated this class with testSize = %d," %testSize
                 print "and now you request trainSize = %d." %size
                 print "I will continue with %d (blame the programmer)" %testSize
-            symm_vec_test = self.testData[:,1:] # Second column->last
-            Ep_test       = self.testData[:,0]  # First column
-            Ep_test       = Ep_test.reshape([testSize,1])
+            test_data     = np.take(self.buffer, self.test_rows, axis=0)
+            symm_vec_test = test_data[:,1:]  # Second column->last
+            Ep_test       = test_data[:,0:1] # First column
             return symm_vec_test, Ep_test
         else:
-            if i + size > self.totTrainData:
+            if size > self.totTrainData:
+                print "Requested batch size %d, is larger than data set %d" %(size, self.totTrainData)
+                return
+            if i >= self.totTrainData:
                 epochIsDone = True # Move to next epoch, all data has been seen
                 if verbose:
                     print "\nWarning: All training data 'used', shuffling (most likely) & starting over!\n"
                 if shuffle:
-                    np.random.shuffle(self.buffer)
+                    np.random.shuffle(self.train_rows) # Only the indices, O(rows)
                 self.index = 0 # Dont use test data for training!
                 i          = 0
-            if size <= self.totTrainData:
-                symm_vec_train = self.buffer[i:i+size, 1:] # Second column->last
-                Ep_train       = self.buffer[i:i+size, 0]  # First column
-                Ep_train       = Ep_train.reshape([size,1])
-                self.index += size # Update so that next time class is called, we get the next items
-                return symm_vec_train, Ep_train, epochIsDone
+            rows = self.train_rows[i:i+size]
+            if self.reuse_buffer:
+                if self.batch_buffer is None or len(self.batch_buffer) < size:
+                    self.batch_buffer = np.empty((size, self.buffer.shape[1]), dtype=self.buffer.dtype)
+                batch = np.take(self.buffer, rows, axis=0, out=self.batch_buffer[:len(rows)])
             else:
-                print "Requested batch size %d, is larger than data set %d" %(size, self.totTrainData)
+                batch = np.take(self.buffer, rows, axis=0)
+            symm_vec_train = batch[:,1:]  # Second column->last
+            Ep_train       = batch[:,0:1] # First column
+            self.index += len(rows) # Update so that next time class is called, we get the next items
+            return symm_vec_train, Ep_train, epochIsDone
     def number_of_train_data(self):
         """
         Returns the total number of data points after test size has been removed
         """
-        return len(self.buffer[:,0])
+        return self.totTrainData
     def return_all_data(self):
         """
-        Assumes testSize = 0 or else this will just return train data
+        Assumes testSize = 0 or else this will just return train data.
+        Returns a (writable) copy, the loaded data itself is never changed
         """
-        return self.buffer
+        return np.take(self.buffer, self.train_rows, axis=0)
 
 def findPathToData(find_tf_savefile=False):
     folder      = "Important_data/Trained_networks/"
@@ -131,43 +151,198 @@ def deleteOldData():
             else:
                 os.remove(file_path)     # ...or not
 
-def saveGraphFunc(sess, weights, biases, epoch, hiddenLayers, nNodes, save_dir, activation_function):
+def saveGraphFunc(sess, weights, biases, epoch, hiddenLayers, nNodes, save_dir, activation_function, plan_hash=None):
     """
-    Saves the neural network weights and biases to file,
-    in a format readably by 'humans'
+    Saves the neural network weights and biases to file, both in the binary
+    model format (graph<epoch>.nnm, see save_model) and in the format
+    readably by 'humans' and the LAMMPS plugin (graph<epoch>.dat)
+    plan_hash: Hash of the DescriptorPlan used for the inputs (default: Behler Si)
     """
-    saveFileName = save_dir + "/graph%d.dat" %epoch
-    with open(saveFileName, 'w') as outFile:
-        outStr = "%1d %1d %s 48 1" % (hiddenLayers, nNodes, activation_function) #TODO: 48 = nmbr of inputs
-        outFile.write(outStr + '\n')
-        size = len(sess.run(weights))
-        for i in range(size):
-            i_weights = sess.run(weights[i])
-            if i < size-1:
-                for j in range(len(i_weights)):
-                    for k in range(len(i_weights[0])):
-                        outFile.write("%s" % repr(i_weights[j][k]))
-                        outFile.write(" ")
-                    outFile.write("\n")
-            else:
-                for j in range(len(i_weights[0])):
-                    for k in range(len(i_weights)):
-                        outFile.write("%s" % repr(i_weights[k][j]))
-                        outFile.write(" ")
-                    outFile.write("\n")
-        outFile.write("\n")
-        for biasVariable in biases:
-            i_biases = sess.run(biasVariable)
-            for j in range(len(i_biases)):
-                outFile.write("%s" % repr(i_biases[j]))
-                outFile.write(" ")
-            outFile.write("\n")
+    if plan_hash is None:
+        from descriptor_plan import load_descriptor_plan
+        plan_hash = load_descriptor_plan().hash
+    model = make_model(sess.run(weights), sess.run(biases), activation_function, epoch, plan_hash)
+    save_model(save_dir + "/graph%d.nnm" %epoch, model)
+    write_graph_dat(save_dir + "/graph%d.dat" %epoch, model)
+
+"""
+Binary model format, version 1 (little endian):
+    8 bytes    "ANNMD-NN"
+    8 bytes    uint64, length of the JSON header
+    header     JSON: version, activation, epoch, layer_sizes, plan_hash, dtype and
+               name, shape and offset of every array, W0, W1, ..., b0, b1, ...
+    arrays     C-ordered, from the first multiple of 64 bytes after the header.
+               Offsets are relative to there, and are multiples of 64 too
+W<i> is (layer_sizes[i] x layer_sizes[i+1]), the output weights are a column.
+"""
+model_magic   = b"ANNMD-NN"
+model_version = 1
+
+def make_model(weights, biases, activation, epoch, plan_hash=None):
+    """
+    Model dictionary, as returned by load_model
+    """
+    weights = [np.asarray(w) for w in weights]
+    weights[-1] = weights[-1].reshape(-1,1) # Output weights as a column
+    return {"version":     model_version,
+            "activation":  activation,
+            "epoch":       int(epoch),
+            "layer_sizes": [int(weights[0].shape[0])] + [int(w.shape[1]) for w in weights],
+            "plan_hash":   plan_hash,
+            "weights":     weights,
+            "biases":      [np.asarray(b).reshape(-1) for b in biases]}
+
+def save_model(filename, model, dtype="<f8"):
+    """
+    Writes model (see make_model) in the binary model format
+    """
+    import json
+    arrays = [("W%d" %i, w) for i,w in enumerate(model["weights"])] + \
+             [("b%d" %i, b) for i,b in enumerate(model["biases"])]
+    header = {key: model[key] for key in ["activation", "epoch", "layer_sizes", "plan_hash"]}
+    header["version"] = model_version
+    header["dtype"]   = np.dtype(dtype).str
+    header["arrays"]  = []
+    offset = 0
+    for name, array in arrays:
+        header["arrays"].append({"name": name, "shape": list(array.shape), "offset": offset})
+        offset += array.size * np.dtype(dtype).itemsize
+        offset += -offset % 64
+    header_str = json.dumps(header, sort_keys=True).encode()
+    data_start = 16 + len(header_str)
+    data_start += -data_start % 64
+    with open(filename, "wb") as out_file:
+        out_file.write(model_magic)
+        out_file.write(np.array(len(header_str), dtype="<u8").tobytes())
+        out_file.write(header_str)
+        for (name, array), info in zip(arrays, header["arrays"]):
+            out_file.write(b"\0" * (data_start + info["offset"] - out_file.tell()))
+            out_file.write(np.ascontiguousarray(array, dtype=dtype).tobytes())
+
+def load_model(filename, mmap=True):
+    """
+    Reads a model in the binary model format, arrays are memory-mapped
+    (read only) unless mmap=False. Returns dictionary, see make_model.
+    """
+    import json
+    with open(filename, "rb") as in_file:
+        magic = in_file.read(len(model_magic))
+        if magic != model_magic:
+            print "File:", filename, "is not in the binary model format. Exiting!"
+            sys.exit(0)
+        header_len = int(np.frombuffer(in_file.read(8), dtype="<u8")[0])
+        header     = json.loads(in_file.read(header_len).decode())
+    data_start = 16 + header_len
+    data_start += -data_start % 64
+    if header["version"] > model_version:
+        print "Model version %d (%s) is newer than this reader (%d). Exiting!" %(header["version"],
+                    filename, model_version)
+        sys.exit(0)
+    arrays = {}
+    for info in header["arrays"]:
+        shape = tuple(info["shape"])
+        if mmap:
+            arrays[info["name"]] = np.memmap(filename, dtype=header["dtype"], mode="r",
+                                             offset=data_start + info["offset"], shape=shape)
+        else:
+            with open(filename, "rb") as in_file:
+                in_file.seek(data_start + info["offset"])
+                arrays[info["name"]] = np.fromfile(in_file, dtype=header["dtype"],
+                                                   count=int(np.prod(shape))).reshape(shape)
+    n_layers = len(header["layer_sizes"]) - 1
+    model    = {key: header[key] for key in ["version", "activation", "epoch", "layer_sizes", "plan_hash"]}
+    model["activation"] = str(model["activation"])
+    model["weights"]    = [arrays["W%d" %i] for i in range(n_layers)]
+    model["biases"]     = [arrays["b%d" %i] for i in range(n_layers)]
+    return model
+
+def write_graph_dat(filename, model):
+    """
+    Text format of graph<epoch>.dat (used by the LAMMPS plugin pair_nnp):
+    'hidden_layers nodes activation inputs outputs', weights row by row
+    (output weights on one line), empty line, biases one layer per line.
+    Values are written with repr (shortest exact form), each followed by a space.
+    """
+    weights = model["weights"]
+    def write_row(out_file, values):
+        out_file.write("".join("%s " %repr(value) for value in values) + "\n")
+    with open(filename, "w") as out_file:
+        out_file.write("%1d %1d %s %d 1\n" %(len(weights)-1, weights[0].shape[1], model["activation"],
+                                              weights[0].shape[0]))
+        for w in weights[:-1]:
+            for row in w:
+                write_row(out_file, row)
+        write_row(out_file, np.ravel(weights[-1]))
+        out_file.write("\n")
+        for b in model["biases"]:
+            write_row(out_file, np.ravel(b))
+
+def read_graph_dat(filename, epoch=None):
+    """
+    Reads graph<epoch>.dat, see write_graph_dat. Returns dictionary, see make_model
+    (no plan hash in this format).
+    """
+    with open(filename, "r") as nn_file:
+        hdn_layers, nodes, activation, nn_inp, nn_out = nn_file.readline().strip().split()
+        hdn_layers   = int(hdn_layers); nodes = int(nodes); nn_inp = int(nn_inp); nn_out = int(nn_out)
+        rows         = [np.array(line.split(), dtype=float) for line in nn_file if line.strip()]
+    tot_w_lines = (hdn_layers-1)*nodes + nn_inp + 1 # Last one from output layer
+    weights     = [np.array(rows[0:nn_inp])]
+    for i in range(nn_inp, tot_w_lines-1, nodes): # Loop over hidden layer 2 -->
+        weights.append(np.array(rows[i:i+nodes]))
+    weights.append(rows[tot_w_lines-1]) # This is output node
+    if epoch is None:
+        epoch = model_epoch(filename) or 0
+    return make_model(weights, rows[tot_w_lines:], activation, epoch)
+
+def model_epoch(filename):
+    """
+    Epoch from the file name graph<epoch>.nnm or graph<epoch>.dat
+    (0 for graph.dat / graph.nnm), None if not a model file
+    """
+    import re
+    match = re.match(r"graph(\d*)\.(nnm|dat)$", os.path.basename(filename))
+    if not match:
+        return None
+    return int(match.group(1) or 0)
+
+def model_epochs(folder):
+    """
+    Sorted epochs of all model files (graph<epoch>.nnm/.dat) in folder
+    """
+    epochs = [model_epoch(f) for f in glob.glob(os.path.join(folder, "graph*"))]
+    return sorted(set(e for e in epochs if e is not None))
+
+def find_model_file(folder, epoch=None):
+    """
+    Model file of 'epoch' in folder (default: last epoch), the binary
+    format is preferred over graph<epoch>.dat. Never asks.
+    """
+    model_files = [f for f in glob.glob(os.path.join(folder, "graph*")) if model_epoch(f) is not None]
+    if epoch is not None:
+        model_files = [f for f in model_files if model_epoch(f) == epoch]
+    if not model_files:
+        print "No model files (graph<epoch>.nnm/.dat) found in: '%s' (epoch: %s). Exiting!" %(folder, epoch)
+        sys.exit(0)
+    return max(model_files, key=lambda f: (model_epoch(f), f.endswith(".nnm")))
+
+def read_model(filename, mmap=True):
+    """
+    Model from either format, see load_model and read_graph_dat
+    """
+    if filename.endswith(".dat"):
+        return read_graph_dat(filename)
+    return load_model(filename, mmap)
 
 def readXYZ_Files(path_to_file, save_name, samples_per_dt=30, cutoff=3.77118,
-                  test_boundary=True, return_array=False):
+                  test_boundary=True, return_array=False, box=None, return_boxes=False):
     """
     Create the master list.
     Neighbouring atoms may vary, so I use a nested list
+    box: Box vectors (see neighbour_list.as_box) if the frames are periodic.
+         None: Read from the extended XYZ comment line, Lattice="ax ay az bx by bz cx cy cz",
+         frames without it are not periodic.
+    return_boxes: Also return the box of every frame (None if not periodic), with return_array
     """
     print "\nReading XYZ-file:"
     print '"%s"' %path_to_file
@@ -180,6 +355,8 @@ def readXYZ_Files(path_to_file, save_name, samples_per_dt=30, cutoff=3.77118,
     master_neigh_list = []
     tot_nmbr_of_atoms = 0
     time_step         = 0
+    frame_box         = box
+    frame_boxes       = []
     with open(path_to_file, 'r') as xyzFile:
         row = -1
         for line in xyzFile:
@@ -194,8 +371,14 @@ def readXYZ_Files(path_to_file, save_name, samples_per_dt=30, cutoff=3.77118,
                     continue
                 elif row == 1:
                     # print 'Comment line said: "%s"' %line[:-1]
+                    if box is None:
+                        frame_box = read_xyz_lattice(line)
                     continue
-            elif row == 0 or row == 1:
+            elif row == 0:
+                continue
+            elif row == 1:
+                if box is None:
+                    frame_box = read_xyz_lattice(line)
                 continue
             index = row - 2
             xyz_ti[index,:] = line.split()[1:]
@@ -205,12 +388,16 @@ def readXYZ_Files(path_to_file, save_name, samples_per_dt=30, cutoff=3.77118,
                     sys.stdout.flush()
                 row = -1
                 time_step += 1
+                frame_boxes.append(frame_box)
                 if return_array:
-                    compute_neigh_arrays(xyz_ti, master_neigh_list, cutoff, return_all)
+                    compute_neigh_arrays(xyz_ti, master_neigh_list, cutoff, return_all, frame_box)
                 else:
-                    compute_neigh_lists(xyz_ti, master_neigh_list, samples_per_dt, cutoff, test_boundary, return_all)
+                    compute_neigh_lists(xyz_ti, master_neigh_list, samples_per_dt, cutoff, test_boundary,
+                                        return_all, frame_box)
     if return_array:
         print " "
+        if return_boxes:
+            return master_neigh_list, frame_boxes
         return master_neigh_list
     else:
         with open(save_name, 'w') as xyzFile:
@@ -222,77 +409,91 @@ def readXYZ_Files(path_to_file, save_name, samples_per_dt=30, cutoff=3.77118,
                     out_string += str(number) + " "
                 xyzFile.write(out_string[:-1] + "\n")
 
-def compute_neigh_arrays(xyz, master_neigh_list, cutoff, return_all=False):
+def read_xyz_lattice(comment_line):
+    """
+    Box vectors (rows of 3x3 matrix) from an extended XYZ comment line,
+    i.e. 'Lattice="5.43 0 0 0 5.43 0 0 0 5.43" Properties=...', or None
+    """
+    if "Lattice=" not in comment_line:
+        return None
+    values = comment_line.split("Lattice=")[1].split('"')[1].split()
+    return np.array(values, dtype=float).reshape(3,3)
+
+def compute_neigh_arrays(xyz, master_neigh_list, cutoff, return_all=False, box=None):
+    """
+    Whole frames, centered around atom i (all atoms if return_all).
+    box: Periodic frames are centered with the minimum image convention.
+    """
+    if box is not None:
+        # Same frame, but every atom as close to atom i as possible
+        centered = lambda i: minimum_image(xyz - xyz[i,:], box)
+    else:
+        centered = lambda i: xyz - xyz[i,:]
     if return_all:
         if not master_neigh_list:
             print "Creating neighbour lists from all atoms per timestep!"
         for i in range(xyz.shape[0]):
-            x,y,z = xyz[i,:]
-            # Center coordinate system around chosen atom:
-            xyz_c = xyz.copy()
-            xyz_c[:,0] -= x
-            xyz_c[:,1] -= y
-            xyz_c[:,2] -= z
             # Chosen coordinates are now: x,y,z = 0,0,0
-            master_neigh_list.append(xyz_c)
+            master_neigh_list.append(centered(i))
     else:
         if not master_neigh_list:
             print "Creating neighbour lists for atom i!"
-        x,y,z = xyz[0,:]
         # Center coordinate system around chosen atom i=0:
-        xyz_c = xyz.copy()
-        xyz_c[:,0] -= x
-        xyz_c[:,1] -= y
-        xyz_c[:,2] -= z
-        # Chosen coordinates are now: x,y,z = 0,0,0
-        master_neigh_list.append(xyz_c)
+        master_neigh_list.append(centered(0))
 
-def compute_neigh_lists(xyz, master_neigh_list, samples_per_dt, cutoff, test_boundary=True, return_all=False):
+def compute_neigh_lists(xyz, master_neigh_list, samples_per_dt, cutoff, test_boundary=True, return_all=False,
+                        box=None):
     """
     Tip: Use at least 20x20x20 unit cells with i.e. Stillinger-Weber!
+    The chosen atoms are picked first, then all their neighbours are
+    found with one cell list per frame (see neighbour_list).
+    box: Box vectors of periodic frames. Then every atom is usable, and
+         'samples_per_dt' different atoms are picked (test_boundary is not needed).
     """
-    i = 0; i_tot_checked = 0
     tot_neig = samples_per_dt
     N = xyz.shape[0]
-    # Set limit for distance to any wall x,y,z-direction
-    r_max = xyz.max() - cutoff*1.1
-    r_min = xyz.min() + cutoff*1.1
-    while i_tot_checked < tot_neig*10: # Stop computation eventually if too small system is given as input
+    if box is not None:
         if return_all:
-            chosen_atom = i_tot_checked # Pick all atoms, one by one!
+            chosen_atoms = np.arange(min(tot_neig, N))
         else:
-            chosen_atom = np.random.randint(N) # Pick atoms at random
-        x,y,z = xyz[chosen_atom,:]
-        i_tot_checked += 1
-        if test_boundary:
-            if x < r_min or x > r_max or y < r_min or y > r_max or z < r_min or z > r_max:
-                # print "Too close",x,y,z
-                continue # Atom too close to wall
-        # Center coordinate system around chosen atom:
-        i += 1 # Found one to use
-        xyz_copy = np.copy(xyz)
-        xyz_copy[:,0] -= x
-        xyz_copy[:,1] -= y
-        xyz_copy[:,2] -= z
-        # Chosen coordinates are now: x,y,z = 0,0,0
-        r = np.linalg.norm(xyz_copy, axis=1)
-        # Find neighbours within cutoff unless "return all"
+            chosen_atoms = np.random.choice(N, min(tot_neig, N), replace=False)
+    else:
+        # Set limit for distance to any wall x,y,z-direction
+        r_max = xyz.max() - cutoff*1.1
+        r_min = xyz.min() + cutoff*1.1
+        def not_at_wall(atoms):
+            if not test_boundary:
+                return atoms
+            pos = xyz[atoms]
+            return atoms[np.all((pos >= r_min) & (pos <= r_max), axis=1)] # Not too close to wall
+        # Stop eventually (tot_neig*10 atoms checked) if too small system is given as input
         if return_all:
-            r_less = np.ones(tot_neig, dtype=bool) # All set to True
+            chosen_atoms = not_at_wall(np.arange(min(tot_neig*10, N)))[:tot_neig] # Pick all atoms, one by one!
         else:
-            r_less = (r < cutoff)
-        nn_list = []
-        for j,neigh_bool in enumerate(r_less):
-            if neigh_bool and j != chosen_atom: # Inside cutoff and "not itself"
-                nn_list.append(xyz_copy[j,0])
-                nn_list.append(xyz_copy[j,1])
-                nn_list.append(xyz_copy[j,2])
-                nn_list.append(r[j])
+            # Pick atoms at random. Only as many as are still missing are drawn at the time,
+            # so exactly the same random numbers are used as when drawing one by one
+            chosen_atoms = np.zeros(0, dtype=int)
+            n_checked    = 0
+            while len(chosen_atoms) < tot_neig and n_checked < tot_neig*10:
+                drawn        = np.random.randint(N, size=min(tot_neig - len(chosen_atoms), tot_neig*10 - n_checked))
+                n_checked   += len(drawn)
+                chosen_atoms = np.append(chosen_atoms, not_at_wall(drawn))
+    if return_all:
+        # All atoms, not only the ones inside cutoff
+        neigh_list = build_neighbour_list(xyz, np.inf, chosen_atoms, method="brute")
+        if box is not None:
+            neigh_list.displacements = minimum_image(neigh_list.displacements, box)
+            neigh_list.distances     = np.sqrt(np.sum(neigh_list.displacements**2, axis=1))
+    else:
+        neigh_list = build_neighbour_list(xyz, cutoff, chosen_atoms, box=box)
+    inside_cut = neigh_list.distances < cutoff
+    for i in range(len(chosen_atoms)):
+        rows    = slice(neigh_list.offsets[i], neigh_list.offsets[i+1])
+        keep    = inside_cut[rows] | return_all
+        nn_list = list(np.column_stack((neigh_list.displacements[rows][keep],
+                                        neigh_list.distances[rows][keep])).ravel()) # numpy floats: str() keeps all digits
         nn_list.append("nan") # This file does not contain pot. energy. So if wrongly read, give NAN
         master_neigh_list.append(nn_list)
-        if i == tot_neig:
-            break
-
 
 if __name__ == '__main__':
     print "By running this, you will delete all files and folders"
@@ -1,14 +1,23 @@
-from create_train_data import generate_symmfunc_input_Si_Behler
+import os
 import numpy as np
-from file_management import findPathToData, readXYZ_Files
+from file_management import findPathToData, readXYZ_Files, model_epochs
 from plot_tools import plotErrorEvolutionSWvsNN, plotEvolutionSWvsNN_N_diff_epochs, plotForcesSWvsNN, plotLAMMPSforces1atomEvo
 from create_train_data import PES_Stillinger_Weber
 import sys
-from derivatives_symm_func import force_calculation, create_neighbour_list
-from nn_evaluation import neural_network
+from derivatives_symm_func import force_calculation, create_neighbour_list, nn_energy_and_forces, scatter_forces
+from nn_evaluation import neural_network, sigmoid, ddx_sigmoid # Activation functions with derivatives
+from symmetry_transform import symmetryTransformBehlerBatch, symmetryTransformBehlerGradBatch
+from neighbour_list import build_neighbour_list, VerletList
+import precision
+import multiprocessing
 
-def test_structure_N_atom(neigh_cube, neural_network, plot_single=False, last_timestep=-1):
+def test_structure_N_atom(neigh_cube, neural_network, plot_single=False, last_timestep=-1, forces="analytic",
+                          box=None, skin=0.5, boxes=None):
     """
+    forces: "analytic" (see force_calculation) or "fd" (finite differences, see fd_forces)
+    box:    Box vectors if the frames are periodic (see neighbour_list.as_box)
+    boxes:  One box (or None) per frame instead, see readXYZ_Files(return_boxes=True)
+    skin:   Verlet skin, the analytic forces reuse one neighbour list across frames
     Structure:
     xyz = [[0, 0, 0 ], <--- must be origo
            [x2,y2,z2],
@@ -24,11 +33,8 @@ def test_structure_N_atom(neigh_cube, neural_network, plot_single=False, last_ti
     Fvec_SW_list = []
     Fvec_NN_list = []
 
-    # Need Ep of all atoms in NN-calculation of forces:
     tot_nmbr_of_atoms = neigh_cube[0].shape[0]
-    Ep_NN_all_atoms   = [None]*tot_nmbr_of_atoms
-    _, nmbr_G         = generate_symmfunc_input_Si_Behler()
-    dNNdG_matrix      = np.zeros((tot_nmbr_of_atoms, nmbr_G))
+    verlet_list       = VerletList(skin=skin, box=box)
 
     # Loop through all timesteps
     for t,xyz in enumerate(neigh_cube[0:last_timestep]):
@@ -36,6 +42,8 @@ def test_structure_N_atom(neigh_cube, neural_network, plot_single=False, last_ti
         if not np.all(xyz[0,:] == 0):
             print "Atoms not properly centered to origo. Exiting!"
             sys.exit(0)
+        if boxes is not None:
+            box = boxes[t]
         # Pick out neighbor atoms
         xyz_only_neigh = xyz[1:,:]
 
@@ -43,54 +51,34 @@ def test_structure_N_atom(neigh_cube, neural_network, plot_single=False, last_ti
         Ep_SW   = PES_Stillinger_Weber(xyz_only_neigh)
         Fvec_SW = (0,0,0) # Only a placeholder! LAMMPS data filled in later
 
-        # Potential and forces computed by trained neural network:
-        # for i_atom in range(tot_nmbr_of_atoms):
-        #     xyz_atom_centered       = create_neighbour_list(xyz, i_atom, return_self=False)
-        #     symm_vec                = neural_network.create_symvec_from_xyz(xyz_atom_centered)
-        #     Ep_NN_all_atoms[i_atom] = neural_network(symm_vec) # Evaluates the NN
-        #     dNNdG_matrix[i_atom,:]  = neural_network.derivative().reshape(nmbr_G,)
-        # # Now that we have all Ep of all atoms, run force calculation:
-        # f_tot = force_calculation(dNNdG_matrix, xyz)
-
-        # Finite difference derivative of NN:
-        i_a       = 0 # Look at this particle only
-        off_value = 0.000001
-        num_force_atom_0 = [0,0,0]
-        for fdir in [0,1,2]: # Force in direction x, y, z
-            Ep_off = [0,0] # Reset Ep
-            for i_off, offset in enumerate([-off_value, off_value]):
-                xyz_c            = np.copy(xyz)
-                xyz_c[i_a,fdir] -= offset # Moving the atom a tiny bit in direction "fdir"
-                for cur_atom in range(tot_nmbr_of_atoms):
-                    xyz_atom_centered = create_neighbour_list(xyz_c, cur_atom, return_self=False)
-                    symm_vec          = neural_network.create_symvec_from_xyz(xyz_atom_centered)
-                    Ep_off[i_off]    += neural_network(symm_vec) # Evaluates the NN
-            # print i2xyz(fdir), (Ep_off[1]-Ep_off[0])/(2*off_value)
-            # Compute the force with central difference (Error: O(dx^2)) <-- big O-notation
-            num_force_atom_0[fdir] = (Ep_off[1]-Ep_off[0])/(2*off_value)
-
-        # Compute Ep with no offset:
-        xyz_atom_centered = create_neighbour_list(xyz, 0, return_self=False)
-        symm_vec          = neural_network.create_symvec_from_xyz(xyz_atom_centered)
-        Ep_NN             = neural_network(symm_vec) # Evaluates the NN
+        if forces == "analytic":
+            # Potential and forces computed by trained neural network (one Jacobian pass per atom):
+            Ep_NN_all_atoms, f_tot = nn_energy_and_forces(neural_network, xyz, neigh_list=verlet_list.update(xyz, box))
+            Ep_NN = Ep_NN_all_atoms[0]
+            force_atom_0 = list(f_tot[0])
+        else:
+            # Finite difference derivative of NN (only the environments around atom 0 are recomputed):
+            force_atom_0 = list(fd_forces(xyz, neural_network, h=0.000001, atoms=[0], box=box)[0])
+
+            # Compute Ep with no offset:
+            xyz_atom_centered = create_neighbour_list(xyz, 0, return_self=False, box=box)
+            symm_vec          = neural_network.create_symvec_from_xyz(xyz_atom_centered)
+            Ep_NN             = neural_network(symm_vec) # Evaluates the NN
 
         # Append all values to lists:
         Ep_SW_list.append(Ep_SW)
         Fvec_SW_list.append(Fvec_SW)
-
-        # Analytic NN:
-        # Ep_NN_list.append(Ep_NN_all_atoms[:]) # Pick out first atom (for comparison)
-        # Fvec_NN_list.append(f_tot[0])
-
-        # Finite diff. derivatives:
-        Ep_NN_list.append(Ep_NN)
-        Fvec_NN_list.append(num_force_atom_0)
+        Ep_NN_list.append(Ep_NN) # First atom (for comparison)
+        Fvec_NN_list.append(force_atom_0)
 
         # Print out progress
         if t%20 == 0 and t > 50:
             sys.stdout.write("\rTimestep: %d" %t)
             sys.stdout.flush()
     print " "
+    if forces == "analytic":
+        print "Neighbour list rebuilt %d times in %d frames (skin: %g)" %(verlet_list.n_builds,
+                    verlet_list.n_frames, skin)
     Ep_SW_list = np.array(Ep_SW_list)
     Ep_NN_list = np.array(Ep_NN_list)
     if plot_single:
@@ -98,6 +86,215 @@ def test_structure_N_atom(neigh_cube, neural_network, plot_single=False, last_ti
     # Return values for more plotting
     return Ep_SW_list, Ep_NN_list, tot_nmbr_of_atoms, Fvec_SW_list, Fvec_NN_list
 
+def energy_and_fd_forces(xyz, neural_network, h=1E-3, cutoff=3.77118, box=None, chunk_size=16):
+    """
+    Total NN energy of all atoms in xyz (N x 3) and the forces on every atom
+    by central differences with step h (positions in the precision of the network).
+    Returns Ep, F (N x 3), G (N x nmbr_G). See fd_forces.
+    """
+    neigh_list = build_neighbour_list(xyz, cutoff, box=box)
+    G          = symmetryTransformBehlerBatch(neural_network.plan, neigh_list.displacements,
+                                              offsets=neigh_list.offsets).astype(neural_network.dtype, copy=False)
+    Ep_atoms   = neural_network.energies(G)
+    xyz_c      = np.array(xyz, dtype=neural_network.dtype).astype(float) # Move in the precision used
+    F          = fd_forces(xyz_c, neural_network, h, cutoff=cutoff, box=box, chunk_size=chunk_size)
+    return np.sum(Ep_atoms, dtype=float), F, G
+
+def fd_forces(xyz, neural_network, h=1E-3, atoms=None, cutoff=3.77118, box=None, chunk_size=16):
+    """
+    Forces on 'atoms' (default: all) by central differences, -(E(x+h) - E(x-h))/2h,
+    for all three directions. Moving atom m only changes the energy of m and the
+    atoms within the cutoff of it, so only their environments (in the moved frame)
+    are transformed and evaluated, 6 moves of 'chunk_size' atoms in one batch.
+    Same result as moving the atom and recomputing the whole frame.
+    Returns F (len(atoms) x 3)
+    """
+    if atoms is None:
+        atoms = np.arange(len(xyz))
+    margin     = 2*h # Atoms that may cross the cutoff when moved
+    neigh_list = build_neighbour_list(xyz, cutoff + margin, box=box)
+    row_center = neigh_list.center_of_rows()
+    moves      = np.concatenate([np.eye(3)*h, -np.eye(3)*h]) # +x, +y, +z, -x, -y, -z
+    F          = np.zeros((len(atoms), 3))
+    for start in range(0, len(atoms), chunk_size):
+        envs    = []  # Environments of all affected atoms, all moves
+        counts  = []  # Neighbours per environment
+        groups  = []  # (moved atom, move) each environment belongs to
+        for i_m, m in enumerate(atoms[start:start+chunk_size]):
+            affected = np.unique(np.append(m, neigh_list.neighbours(m)))
+            n_rows   = neigh_list.offsets[affected+1] - neigh_list.offsets[affected]
+            rows     = np.repeat(neigh_list.offsets[affected] - np.cumsum(n_rows) + n_rows, n_rows) + np.arange(n_rows.sum())
+            env      = np.repeat(np.arange(len(affected)), n_rows)
+            # x_j - x_i changes by +move if j = m, by -move if i = m
+            sign     = (neigh_list.indices[rows] == m).astype(float) - (row_center[rows] == m)
+            for k, move in enumerate(moves):
+                disp   = neigh_list.displacements[rows] + sign[:,np.newaxis]*move
+                inside = np.sum(disp**2, axis=1) <= cutoff**2
+                envs.append(disp[inside])
+                counts.append(np.bincount(env[inside], minlength=len(affected)))
+                groups.append(np.full(len(affected), 6*i_m + k))
+        counts  = np.concatenate(counts)
+        offsets = np.append(0, np.cumsum(counts))
+        G       = symmetryTransformBehlerBatch(neural_network.plan, np.concatenate(envs), offsets=offsets)
+        Ep      = neural_network.energies(G.astype(neural_network.dtype, copy=False))
+        n_moved = len(atoms[start:start+chunk_size])
+        Ep_move = np.bincount(np.concatenate(groups), Ep, minlength=6*n_moved).reshape(n_moved, 2, 3)
+        F[start:start+n_moved] = -(Ep_move[:,0] - Ep_move[:,1]) / (2*h)
+    return F
+
+def precision_report(frames, loadPath, act_func, ddx_act_f, h=1E-3, dtypes=[np.float64, np.float32]):
+    """
+    Energy and force deviation of the float32 path from the float64 path
+    (descriptors + network) on a reference set of frames (list of N x 3 arrays).
+    Forces are central differences with the same step h in both precisions.
+    """
+    results = {}
+    for dtype in dtypes:
+        precision.set_precision(dtype)
+        nn_eval = neural_network(loadPath, act_func, ddx_act_f)
+        results[dtype] = [energy_and_fd_forces(xyz, nn_eval, h) for xyz in frames]
+    precision.set_precision(dtypes[0])
+    ref, low   = results[dtypes[0]], results[dtypes[1]]
+    N_atoms    = np.array([len(xyz) for xyz in frames])
+    Ep_diff    = np.array([abs(r[0] - l[0]) for r,l in zip(ref, low)]) / N_atoms
+    F_diff     = np.concatenate([(r[1] - l[1]).ravel() for r,l in zip(ref, low)])
+    F_ref      = np.concatenate([r[1].ravel() for r in ref])
+    G_diff     = np.concatenate([np.abs(r[2] - l[2]).ravel() for r,l in zip(ref, low)])
+    G_ref      = np.concatenate([np.abs(r[2]).ravel() for r in ref])
+    print "\nPrecision report: %s vs. %s, %d frames, %d atoms, FD step %g" \
+          %(np.dtype(dtypes[1]).name, np.dtype(dtypes[0]).name, len(frames), N_atoms.sum(), h)
+    print "Symm. vec.  max abs diff: %g (max rel diff %g)" %(G_diff.max(), (G_diff/np.maximum(G_ref, 1E-300)).max())
+    print "Energy/atom max abs diff: %g, mean abs diff: %g" %(Ep_diff.max(), Ep_diff.mean())
+    print "Force       max abs diff: %g, RMS diff: %g (RMS force %g)" \
+          %(np.abs(F_diff).max(), np.sqrt(np.mean(F_diff**2)), np.sqrt(np.mean(F_ref**2)))
+    print "Bytes per symm. vec.: %d --> %d" %(ref[0][2][0].nbytes, low[0][2][0].nbytes)
+    return results
+
+def cache_descriptors(neigh_cube, plan, last_timestep=-1, box=None, boxes=None):
+    """
+    Everything about the frames that does not depend on the network: the SW energy
+    of atom 0, the neighbour list, the symmetry vectors G and their Jacobians dG
+    (see nn_energy_and_forces). Returns list of (Ep_SW, neigh_list, G, dG), one per frame.
+    box:   Box vectors of all frames if periodic
+    boxes: One box (or None) per frame instead, see readXYZ_Files(return_boxes=True)
+    """
+    cache = []
+    for t,xyz in enumerate(neigh_cube[0:last_timestep]):
+        if boxes is not None:
+            box = boxes[t]
+        neigh_list = build_neighbour_list(xyz, box=box)
+        G, dG      = symmetryTransformBehlerGradBatch(plan, neigh_list.displacements, offsets=neigh_list.offsets)
+        cache.append((PES_Stillinger_Weber(xyz[1:,:]), neigh_list, G, dG))
+    return cache
+
+_checkpoint_cache = None # Descriptors of the frames, set in every worker process
+
+def _set_checkpoint_cache(loadPath, act_func, ddx_act_f, cache):
+    global _checkpoint_cache
+    _checkpoint_cache = (loadPath, act_func, ddx_act_f, cache)
+
+def _evaluate_checkpoint(epoch):
+    """
+    Energy and force on atom 0 of every cached frame with the network of 'epoch'
+    """
+    loadPath, act_func, ddx_act_f, cache = _checkpoint_cache
+    nn_eval = neural_network(loadPath, act_func, ddx_act_f, epoch=epoch)
+    Ep_NN   = np.zeros(len(cache))
+    F_NN    = np.zeros((len(cache), 3))
+    for t,(Ep_SW, neigh_list, G, dG) in enumerate(cache):
+        Ep, dNNdG = nn_eval.energies_and_gradients(G.astype(nn_eval.dtype, copy=False))
+        Ep_NN[t]  = Ep[0]
+        F_NN[t]   = scatter_forces(dNNdG, dG, neigh_list)[0]
+    return epoch, Ep_NN, F_NN
+
+def evaluate_checkpoints(neigh_cube, loadPath, epochs=None, act_func=sigmoid, ddx_act_f=ddx_sigmoid,
+                         last_timestep=-1, F_ref=None, processes=None, box=None, boxes=None):
+    """
+    Evaluates the networks of all 'epochs' (default: every graph<epoch> in the folder
+    of loadPath) on the frames of neigh_cube, without asking for anything.
+    The descriptors are computed once, the checkpoints are spread over 'processes'
+    worker processes (default: all cores, 1 runs in this process).
+    F_ref: Reference forces on atom 0 (i.e. LAMMPS), compared if given.
+    box, boxes: Periodic frames, see cache_descriptors
+    Prints one line of errors per epoch, returns {epoch: (Ep_SW, Ep_NN, F_NN)}
+    """
+    if epochs is None:
+        epochs = model_epochs(os.path.dirname(loadPath))
+    if not epochs:
+        print "No model files (graph<epoch>.nnm/.dat) found in: '%s'. Exiting!" %os.path.dirname(loadPath)
+        sys.exit(0)
+    plan  = neural_network(loadPath, act_func, ddx_act_f, epoch=epochs[0]).plan
+    cache = cache_descriptors(neigh_cube, plan, last_timestep, box, boxes)
+    Ep_SW = np.array([frame[0] for frame in cache])
+    if processes is None:
+        processes = min(multiprocessing.cpu_count(), len(epochs))
+    if processes == 1:
+        _set_checkpoint_cache(loadPath, act_func, ddx_act_f, cache)
+        results = map(_evaluate_checkpoint, epochs)
+    else:
+        pool    = multiprocessing.Pool(processes, _set_checkpoint_cache, (loadPath, act_func, ddx_act_f, cache))
+        results = pool.map(_evaluate_checkpoint, epochs)
+        pool.close()
+        pool.join()
+    if F_ref is not None:
+        F_ref = np.asarray(F_ref, dtype=float)[:len(cache)]
+    print "\n Epoch | Ep atom 0: MAE | Max abs.err |    RMSE | Forces atom 0: RMSE | Max abs.err | RMS force"
+    all_results = {}
+    for epoch, Ep_NN, F_NN in sorted(results):
+        Ep_err = Ep_NN - Ep_SW
+        if F_ref is not None:
+            F_err  = F_NN[:len(F_ref)] - F_ref
+            F_cols = "%19g | %11g" %(np.sqrt(np.mean(F_err**2)), np.max(np.abs(F_err)))
+        else:
+            F_cols = "%19s | %11s" %("-", "-")
+        print "%6d | %14g | %11g | %7g | %s | %g" %(epoch, np.mean(np.abs(Ep_err)), np.max(np.abs(Ep_err)),
+                    np.sqrt(np.mean(Ep_err**2)), F_cols, np.sqrt(np.mean(F_NN**2)))
+        all_results[epoch] = (Ep_SW, Ep_NN, F_NN)
+    return all_results
+
+def verify_forces(xyz, neural_network, h=1E-6, box=None):
+    """
+    Analytic forces (nn_energy_and_forces) vs. central differences on all atoms,
+    all three directions. Returns the max abs. difference and the max |F|.
+    """
+    F    = nn_energy_and_forces(neural_network, xyz, box=box)[1]
+    F_fd = fd_forces(xyz, neural_network, h, box=box)
+    return np.max(np.abs(F - F_fd)), np.max(np.abs(F))
+
+def benchmark_fd_forces(neural_network, unit_cells=[1,2,4], h=1E-6, noise=0.1, full_atoms=2):
+    """
+    Timing of fd_forces for all atoms of the diamond lattices (8, 64, 512 atoms),
+    compared with moving each atom and recomputing the whole frame. The full
+    recompute is only timed for 'full_atoms' atoms, and scaled up to all atoms.
+    """
+    from timeit import default_timer as timer
+    from derivatives_symm_func import diamond_lattice
+    def energy(xyz):
+        neigh_list = build_neighbour_list(xyz)
+        return np.sum(neural_network.energies(symmetryTransformBehlerBatch(neural_network.plan,
+                      neigh_list.displacements, offsets=neigh_list.offsets)), dtype=float)
+    print " Atoms | Incremental [s] | Full recompute [s] | Speedup | Max abs.diff | Max abs.diff analytic"
+    for L in unit_cells:
+        xyz      = diamond_lattice(L, noise=noise)
+        N        = len(xyz)
+        t0       = timer()
+        F        = fd_forces(xyz, neural_network, h)
+        t_incr   = timer() - t0
+        F_full   = np.zeros((full_atoms, 3))
+        t0       = timer()
+        for m in range(full_atoms):
+            for fdir in [0,1,2]:
+                Ep_off = []
+                for offset in [h, -h]:
+                    xyz_c          = np.copy(xyz)
+                    xyz_c[m,fdir] += offset
+                    Ep_off.append(energy(xyz_c))
+                F_full[m,fdir] = -(Ep_off[0] - Ep_off[1])/(2*h)
+        t_full   = (timer() - t0) * N / float(full_atoms)
+        F_an     = nn_energy_and_forces(neural_network, xyz)[1]
+        print "%6d | %15.3f | %18.1f | %7.0f | %12g | %g" %(N, t_incr, t_full, t_full/t_incr,
+                    np.max(np.abs(F[:full_atoms] - F_full)), np.max(np.abs(F - F_an)))
+
 def i2xyz(i):
     """ For easy reading of error checks """
     if i == 0:
@@ -108,6 +305,42 @@ def i2xyz(i):
         return "z"
 
 if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == "precision":
+        """
+        >>> python force_verify.py precision n_atoms n_frames
+        """
+        n_atoms, n_frames = int(sys.argv[2]), int(sys.argv[3])
+        path_to_file = "Important_data/Test_nn/enfil_sw_%dp.xyz" %n_atoms
+        neigh_cube   = readXYZ_Files(path_to_file, "no-save-file.txt", return_array=True)
+        loadPath     = findPathToData(find_tf_savefile=True)
+        precision_report(neigh_cube[:n_frames], loadPath, sigmoid, ddx_sigmoid)
+        sys.exit(0)
+    if len(sys.argv) > 1 and sys.argv[1] == "epochs":
+        """
+        >>> python force_verify.py epochs folder n_atoms M [epoch epoch ...]
+        All checkpoints (or the given epochs) in folder, frames up to timestep M
+        """
+        folder, n_atoms, last_timestep = sys.argv[2], int(sys.argv[3]), int(sys.argv[4])
+        epochs       = [int(epoch) for epoch in sys.argv[5:]] or None
+        path_to_file = "Important_data/Test_nn/enfil_sw_%dp.xyz" %n_atoms
+        neigh_cube, boxes = readXYZ_Files(path_to_file, "no-save-file.txt", return_array=True, return_boxes=True)
+        F_LAMMPS     = plotLAMMPSforces1atomEvo() or None # If the force dumps exist
+        evaluate_checkpoints(neigh_cube, os.path.join(folder, ""), epochs, last_timestep=last_timestep,
+                             F_ref=F_LAMMPS, boxes=boxes)
+        sys.exit(0)
+    if len(sys.argv) > 1 and sys.argv[1] == "verify":
+        """
+        >>> python force_verify.py verify n_atoms n_frames
+        Analytic vs. finite difference forces, all atoms of every frame
+        """
+        n_atoms, n_frames = int(sys.argv[2]), int(sys.argv[3])
+        path_to_file = "Important_data/Test_nn/enfil_sw_%dp.xyz" %n_atoms
+        neigh_cube, boxes = readXYZ_Files(path_to_file, "no-save-file.txt", return_array=True, return_boxes=True)
+        nn_eval      = neural_network(findPathToData(find_tf_savefile=True), sigmoid, ddx_sigmoid)
+        for t,xyz in enumerate(neigh_cube[:n_frames]):
+            print "Frame %d: max abs.diff forces %g (max |F| %g)" %((t,) + verify_forces(xyz, nn_eval, box=boxes[t]))
+        benchmark_fd_forces(nn_eval)
+        sys.exit(0)
     try:
         N = int(sys.argv[1])
         M = int(sys.argv[2])
@@ -116,32 +349,25 @@ if __name__ == '__main__':
         print "Usage:\n>>> python force_verify.py N M"
         print "- N is the different NN-versions to visualize"
         print "- M is the last timestep"
+        print "Or, all checkpoints without questions:\n>>> python force_verify.py epochs folder n_atoms M [epoch ...]"
         sys.exit(0)
     n_atoms    = int(raw_input("Number of atoms? "))
     path_to_file = "Important_data/Test_nn/enfil_sw_%dp.xyz" %n_atoms
-    neigh_cube   = readXYZ_Files(path_to_file, "no-save-file.txt", return_array=True)
+    neigh_cube, boxes = readXYZ_Files(path_to_file, "no-save-file.txt", return_array=True, return_boxes=True)
     loadPath     = findPathToData(find_tf_savefile=True)
     master_list  = []
 
-    # Activation functions with derivatives:
-    sigmoid  = lambda x: 1.0/(1+np.exp(-x))
-    ddx_sig  = lambda x: sigmoid(x)*(1-sigmoid(x))
-    relu     = lambda x: np.maximum(x, 0, x) # (in-place of x --> quick!!)
-    ddx_relu = lambda x: np.array((x >= 0), dtype=float)
-    act_tanh = lambda x: np.tanh(x)
-    ddx_tanh = lambda x: 1.0 - np.tanh(x)**2 #1.0/np.cosh(x)**2
-
     # If showing single NN-version (trained to a certain epoch), then plot
     if N == 1:
         plot_single = True
     else:
         plot_single = False
 
-    # Loop over different trained versions of the NN:
-    for i in range(N):
-        nn_eval = neural_network(loadPath, sigmoid, ddx_sig)
+    # Loop over different trained versions of the NN (the last N epochs):
+    for epoch in model_epochs(os.path.dirname(loadPath))[-N:]:
+        nn_eval = neural_network(loadPath, sigmoid, ddx_sigmoid, epoch=epoch)
         Ep_SW, Ep_NN, N_atoms, F_SW, F_NN = test_structure_N_atom(neigh_cube,
-                                            nn_eval, plot_single=plot_single, last_timestep=last_timestep)
+                                            nn_eval, plot_single=plot_single, last_timestep=last_timestep, boxes=boxes)
         # diff = np.mean(np.abs(np.array([i-j for i,j in zip(Ep_SW, Ep_NN[:,0])])))
         # print "Potential energy abs diff:", diff
         plot_info = [Ep_SW, Ep_NN, N_atoms, nn_eval.what_epoch]
@@ -0,0 +1,405 @@
+"""
+Neighbour lists of whole frames.
+
+All atoms j != i with r_ij <= cutoff are stored compactly (no dummy atoms),
+in the ragged format used by symmetry_transform.pad_environments:
+the neighbours of center c are indices[offsets[c]:offsets[c+1]].
+
+Periodic frames: Give the box vectors, then ghost atoms (periodic images)
+within the cutoff of the box are added before the search. An atom may then
+be a neighbour several times, and even of itself, if the box is small.
+"""
+import sys
+import numpy as np
+
+class NeighbourList:
+    """
+    centers:       Atom index of every center (all atoms by default)
+    offsets:       (n_centers + 1), environment c is rows offsets[c]:offsets[c+1]
+    indices:       (total_neighbours) atom index of every neighbour
+    displacements: (total_neighbours x 3) x_j - x_i
+    distances:     (total_neighbours) r_ij
+    shifts:        (total_neighbours x 3) periodic image of every neighbour,
+                   x_j - x_i = all_atoms[j] + shifts.dot(box) - all_atoms[i]
+                   (None if not periodic)
+    """
+    def __init__(self, centers, offsets, indices, displacements, distances, cutoff,
+                 shifts=None, box=None):
+        self.centers       = centers
+        self.offsets       = offsets
+        self.indices       = indices
+        self.displacements = displacements
+        self.distances     = distances
+        self.cutoff        = cutoff
+        self.shifts        = shifts
+        self.box           = box
+    def __len__(self):
+        return len(self.centers)
+    def counts(self):
+        """
+        Number of neighbours of every center
+        """
+        return np.diff(self.offsets)
+    def center_of_rows(self):
+        """
+        Atom index of the center each row (neighbour) belongs to
+        """
+        return np.repeat(self.centers, self.counts())
+    def environment(self, c):
+        """
+        Displacements of the neighbours of center number c
+        """
+        return self.displacements[self.offsets[c]:self.offsets[c+1]]
+    def neighbours(self, c):
+        """
+        Atom indices of the neighbours of center number c
+        """
+        return self.indices[self.offsets[c]:self.offsets[c+1]]
+
+def as_box(box):
+    """
+    Box vectors as the rows of a 3x3 matrix.
+    box: 3 side lengths (orthorhombic box) or 3x3 matrix, box[k] = vector k
+    """
+    box = np.asarray(box, dtype=float)
+    if box.shape == (3,):
+        box = np.diag(box)
+    if box.shape != (3,3) or abs(np.linalg.det(box)) < 1E-12:
+        print "Box:", box, "was not understood. Give 3 side lengths or 3 (non-planar) box vectors..."
+        sys.exit(0)
+    return box
+
+def fractional_coordinates(xyz, box):
+    return np.dot(xyz, np.linalg.inv(box))
+
+def minimum_image(displacements, box):
+    """
+    Closest periodic image of every displacement vector.
+    Exact for orthorhombic boxes, and for any box if |x| < half the
+    smallest plane spacing.
+    """
+    box  = as_box(box)
+    frac = fractional_coordinates(displacements, box)
+    return np.dot(frac - np.round(frac), box)
+
+def periodic_images(all_atoms, box, cutoff):
+    """
+    Atoms wrapped into the box, followed by all ghost atoms within 'cutoff'
+    of it. Returns positions, image_of (atom index of every position) and
+    shifts (periodic image relative to all_atoms, see NeighbourList).
+    """
+    frac    = fractional_coordinates(all_atoms, box)
+    wrapped = np.floor(frac).astype(int)
+    frac   -= wrapped
+    # Ghosts are needed 'cutoff' out from every face (plane spacing: 1/|b_k|)
+    margin  = cutoff * np.sqrt(np.sum(np.linalg.inv(box)**2, axis=0))
+    n_max   = np.ceil(margin).astype(int)
+    grid    = np.meshgrid(*[np.arange(-n, n+1) for n in n_max], indexing="ij")
+    images  = np.array(grid).reshape(3,-1).T
+    images  = images[np.argsort(np.sum(images**2, axis=1), kind="mergesort")] # No shift first
+    all_frac, image_of, shifts = [], [], []
+    for image in images:
+        inside = np.all((frac + image >= -margin) & (frac + image < 1 + margin), axis=1)
+        all_frac.append(frac[inside] + image)
+        image_of.append(np.nonzero(inside)[0])
+        shifts.append(image - wrapped[inside])
+    return np.dot(np.concatenate(all_frac), box), np.concatenate(image_of), np.concatenate(shifts)
+
+class CellList:
+    """
+    Linked-cell binning of one frame. The bounding box of the atoms is split
+    in cells of side >= cutoff, so all neighbours of an atom are found in its
+    own and the 26 surrounding cells. Binning is O(N) and done once per frame,
+    every query is O(neighbours).
+    """
+    def __init__(self, all_atoms, cutoff, max_cells_per_atom=8):
+        self.all_atoms = np.asarray(all_atoms, dtype=float)
+        self.cutoff    = cutoff
+        tot_atoms      = self.all_atoms.shape[0]
+        self.origin    = self.all_atoms.min(axis=0)
+        extent         = self.all_atoms.max(axis=0) - self.origin
+        self.n_cells   = np.maximum(np.floor(extent / cutoff).astype(int), 1)
+        while np.prod(self.n_cells) > max_cells_per_atom*max(tot_atoms, 1):
+            # Very sparse frame: Fewer (larger) cells
+            self.n_cells = np.maximum(self.n_cells // 2, 1)
+        self.cell_size = np.where(extent > 0, extent / self.n_cells, cutoff)
+        self.cell_of   = self.cell_coordinates(self.all_atoms)
+        cell_id        = self.flat_id(self.cell_of)
+        self.sorted_atoms = np.argsort(cell_id, kind="mergesort") # Atoms ordered by cell
+        counts         = np.bincount(cell_id, minlength=np.prod(self.n_cells))
+        self.cell_start = np.append(0, np.cumsum(counts))
+    def cell_coordinates(self, xyz):
+        cell = np.floor((xyz - self.origin) / self.cell_size).astype(int)
+        return np.minimum(cell, self.n_cells - 1) # Atoms on the upper boundary
+    def flat_id(self, cell):
+        return (cell[...,0]*self.n_cells[1] + cell[...,1])*self.n_cells[2] + cell[...,2]
+    def query(self, centers):
+        """
+        Returns rows (position in 'centers') and atom indices of all pairs
+        with r_ij <= cutoff, j != i, sorted by row and then atom index.
+        """
+        rows    = [np.zeros(0, dtype=int)]
+        indices = [np.zeros(0, dtype=int)]
+        for shift in np.array(np.meshgrid([-1,0,1], [-1,0,1], [-1,0,1], indexing="ij")).reshape(3,-1).T:
+            cell   = self.cell_of[centers] + shift
+            valid  = np.all((cell >= 0) & (cell < self.n_cells), axis=1)
+            row    = np.nonzero(valid)[0]
+            cell   = self.flat_id(cell[valid])
+            counts = self.cell_start[cell+1] - self.cell_start[cell]
+            # All atoms of the cell, for every center (ragged expansion)
+            row    = np.repeat(row, counts)
+            first  = np.repeat(self.cell_start[cell] - np.cumsum(counts) + counts, counts)
+            neigh  = self.sorted_atoms[first + np.arange(len(row))]
+            r2     = np.sum((self.all_atoms[neigh] - self.all_atoms[centers[row]])**2, axis=1)
+            inside = (r2 <= self.cutoff**2) & (neigh != centers[row])
+            rows.append(row[inside])
+            indices.append(neigh[inside])
+        rows    = np.concatenate(rows)
+        indices = np.concatenate(indices)
+        order   = np.lexsort((indices, rows))
+        return rows[order], indices[order]
+
+def build_neighbour_list(all_atoms, cutoff=3.77118, centers=None, chunk_size=500, method="cells", box=None):
+    """
+    Neighbour list of the atoms 'centers' (default: all), all atoms j != i with
+    r_ij <= cutoff. 'chunk_size' centers are searched at the time.
+    method: "cells" (CellList, O(N)) or "brute" (all distances, O(N^2), for checking)
+    box:    Box vectors (see as_box) for periodic frames, None: not periodic
+    """
+    all_atoms = np.asarray(all_atoms, dtype=float)
+    if centers is None:
+        centers = np.arange(all_atoms.shape[0])
+    centers   = np.asarray(centers, dtype=int).reshape(-1)
+    positions = all_atoms
+    if box is not None:
+        box = as_box(box)
+        positions, image_of, shifts = periodic_images(all_atoms, box, cutoff)
+        # The atoms themselves come first, so 'centers' index positions too
+    if method == "cells":
+        cell_list = CellList(positions, cutoff)
+    elif method != "brute":
+        print "Neighbour search method:", method, "was not understood. Use 'cells' or 'brute'..."
+        sys.exit(0)
+    rows      = [np.zeros(0, dtype=int)]
+    indices   = [np.zeros(0, dtype=int)]
+    for start in range(0, len(centers), chunk_size):
+        chunk         = centers[start:start+chunk_size]
+        if method == "cells":
+            row, neigh = cell_list.query(chunk)
+        else:
+            r2         = np.sum((positions[np.newaxis,:,:] - positions[chunk,np.newaxis,:])**2, axis=-1)
+            inside     = r2 <= cutoff**2
+            inside[np.arange(len(chunk)), chunk] = False # Not self
+            row, neigh = np.nonzero(inside)
+        rows.append(row + start)
+        indices.append(neigh)
+    rows          = np.concatenate(rows)
+    indices       = np.concatenate(indices)
+    offsets       = np.append(0, np.cumsum(np.bincount(rows, minlength=len(centers))))
+    displacements = positions[indices] - positions[centers[rows]]
+    distances     = np.sqrt(np.sum(displacements**2, axis=1))
+    if box is None:
+        return NeighbourList(centers, offsets, indices, displacements, distances, cutoff)
+    return NeighbourList(centers, offsets, image_of[indices], displacements, distances, cutoff,
+                         shifts[indices] - shifts[centers[rows]], box)
+
+class VerletList:
+    """
+    Neighbour list carried across consecutive frames of a trajectory.
+    All pairs within cutoff + skin are stored, and each frame only recomputes
+    their displacements and keeps the ones within cutoff. The list is rebuilt
+    when some atom has moved more than skin/2 since the last build.
+        verlet_list = VerletList(cutoff, skin, box)
+        for xyz in frames:
+            neigh_list = verlet_list.update(xyz)
+    Periodic frames may be wrapped by the MD code, atoms that cross the box
+    are followed by counting their images (moves must be < half the box per frame).
+    Counters: n_frames, n_builds (see rebuild_fraction)
+    """
+    def __init__(self, cutoff=3.77118, skin=0.5, box=None, method="cells"):
+        self.cutoff   = cutoff
+        self.skin     = skin
+        self.box      = None if box is None else as_box(box)
+        self.method   = method
+        self.n_frames = 0
+        self.n_builds = 0
+        self.reference = None # Positions at last build
+    def rebuild_fraction(self):
+        return self.n_builds / float(max(self.n_frames, 1))
+    def unwrapped(self, all_atoms):
+        """
+        Positions continued from the reference positions across the periodic box
+        """
+        if self.box is None:
+            return all_atoms
+        moved       = fractional_coordinates(all_atoms - self.previous, self.box)
+        self.images = self.images - np.round(moved).astype(int)
+        return all_atoms + np.dot(self.images, self.box)
+    def update(self, all_atoms, box=None):
+        """
+        NeighbourList (cutoff) of frame all_atoms. box: New box vectors (default: unchanged)
+        """
+        all_atoms = np.asarray(all_atoms, dtype=float)
+        self.n_frames += 1
+        rebuild = self.reference is None or all_atoms.shape != self.reference.shape or \
+                  (box is not None and not np.array_equal(as_box(box), self.box)) # Box changed (i.e. NPT)
+        if not rebuild:
+            positions = self.unwrapped(all_atoms)
+            max_move2 = np.max(np.sum((positions - self.reference)**2, axis=1))
+            rebuild   = max_move2 > (0.5*self.skin)**2
+        if rebuild:
+            if box is not None:
+                self.box = as_box(box)
+            self.n_builds  += 1
+            self.verlet     = build_neighbour_list(all_atoms, self.cutoff + self.skin, method=self.method, box=self.box)
+            self.rows       = np.repeat(np.arange(len(self.verlet)), self.verlet.counts())
+            self.reference  = all_atoms.copy()
+            self.images     = np.zeros(all_atoms.shape, dtype=int)
+            positions       = all_atoms
+        self.previous = all_atoms.copy()
+        displacements = positions[self.verlet.indices] - positions[self.rows]
+        if self.box is not None:
+            displacements += np.dot(self.verlet.shifts, self.box)
+        distances = np.sqrt(np.sum(displacements**2, axis=1))
+        inside    = distances <= self.cutoff
+        offsets   = np.append(0, np.cumsum(np.bincount(self.rows[inside], minlength=len(self.verlet))))
+        shifts    = None
+        if self.box is not None:
+            # Image relative to the given (possibly wrapped) positions
+            shifts = self.verlet.shifts[inside] + self.images[self.verlet.indices[inside]] \
+                                                - self.images[self.rows[inside]]
+        return NeighbourList(self.verlet.centers, offsets, self.verlet.indices[inside], displacements[inside],
+                             distances[inside], self.cutoff, shifts, self.box)
+
+def check_neighbour_list(sizes=[1,2,10,100,1000], cutoffs=[0.5,3.77118,100.]):
+    """
+    Cell list vs. all distances, on random frames. Returns True if identical.
+    """
+    all_ok = True
+    for N in sizes:
+        all_atoms = np.random.uniform(0, 2*N**(1/3.), (N, 3))
+        for cutoff in cutoffs:
+            cells = build_neighbour_list(all_atoms, cutoff, chunk_size=77)
+            brute = build_neighbour_list(all_atoms, cutoff, method="brute")
+            ok    = np.array_equal(cells.offsets, brute.offsets) and np.array_equal(cells.indices, brute.indices)
+            all_ok = all_ok and ok
+            print "Atoms: %5d, cutoff: %8g, pairs: %7d %s" %(N, cutoff, cells.offsets[-1], "OK" if ok else "FAILED")
+    return all_ok
+
+def check_periodic_neighbour_list(sizes=[1,5,50,500], cutoffs=[1.,3.77118,9.]):
+    """
+    Periodic neighbour lists (tilted box) vs. the same frame repeated enough times,
+    without periodicity. Compares the sorted distances of every atom in the
+    middle copy. Returns True if all agree.
+    """
+    all_ok = True
+    for N in sizes:
+        box       = np.array([[1.,0,0], [0.3,1.,0], [-0.2,0.1,0.9]]) * 2*N**(1/3.)
+        all_atoms = np.random.uniform(-0.5, 1.5, (N, 3)).dot(box) # Also outside the box
+        for cutoff in cutoffs:
+            periodic  = build_neighbour_list(all_atoms, cutoff, box=box)
+            n         = int(np.ceil(cutoff * np.sqrt(np.sum(np.linalg.inv(box)**2, axis=0)).max())) + 2
+            reps      = np.array(np.meshgrid(*[np.arange(-n,n+1)]*3, indexing="ij")).reshape(3,-1).T
+            copies    = (all_atoms[np.newaxis,:,:] + reps.dot(box)[:,np.newaxis,:]).reshape(-1,3)
+            middle    = np.nonzero(np.all(reps == 0, axis=1))[0][0] * N
+            reference = build_neighbour_list(copies, cutoff, centers=np.arange(middle, middle+N))
+            images    = all_atoms[periodic.indices] + periodic.shifts.dot(box) - all_atoms[periodic.center_of_rows()]
+            ok        = np.array_equal(periodic.offsets, reference.offsets) and \
+                        np.allclose(images, periodic.displacements) and \
+                        all(np.allclose(np.sort(periodic.distances[periodic.offsets[c]:periodic.offsets[c+1]]),
+                                        np.sort(reference.distances[reference.offsets[c]:reference.offsets[c+1]]))
+                            for c in range(N))
+            all_ok    = all_ok and ok
+            print "Periodic, atoms: %4d, cutoff: %8g, pairs: %7d %s" %(N, cutoff, periodic.offsets[-1], "OK" if ok else "FAILED")
+    return all_ok
+
+def random_walk(all_atoms, n_frames, step, box=None):
+    """
+    Trajectory where every atom moves by N(0, step) per frame, wrapped into the box if periodic
+    """
+    frames = [all_atoms]
+    for t in range(n_frames - 1):
+        xyz = frames[-1] + np.random.normal(0, step, all_atoms.shape)
+        if box is not None:
+            frac = fractional_coordinates(xyz, box)
+            xyz  = np.dot(frac - np.floor(frac), box)
+        frames.append(xyz)
+    return frames
+
+def check_verlet_list(n_atoms=200, n_frames=50, step=0.05, cutoff=3.77118, skin=0.5):
+    """
+    VerletList vs. a new neighbour list every frame, on random walks with and
+    without a (wrapped) periodic box. Returns True if the neighbours agree.
+    """
+    all_ok = True
+    for box in [None, np.array([[1.,0,0], [0.2,1.,0], [0,-0.1,1.1]]) * 1.8*n_atoms**(1/3.)]:
+        verlet_list = VerletList(cutoff, skin, box)
+        max_diff    = 0.0
+        ok          = True
+        for xyz in random_walk(np.random.uniform(0, 1.8*n_atoms**(1/3.), (n_atoms, 3)), n_frames, step, box):
+            reused = verlet_list.update(xyz)
+            new    = build_neighbour_list(xyz, cutoff, box=box)
+            ok     = ok and np.array_equal(reused.offsets, new.offsets)
+            for c in range(n_atoms):
+                rows_r = slice(reused.offsets[c], reused.offsets[c+1])
+                rows_n = slice(new.offsets[c], new.offsets[c+1])
+                ok     = ok and np.array_equal(np.sort(reused.indices[rows_r]), np.sort(new.indices[rows_n]))
+                if ok:
+                    max_diff = max(max_diff, np.max(np.abs(np.sort(reused.distances[rows_r]) -
+                                                           np.sort(new.distances[rows_n])), initial=0.0))
+            if box is not None:
+                images = xyz[reused.indices] + reused.shifts.dot(box) - xyz[reused.center_of_rows()]
+                max_diff = max(max_diff, np.max(np.abs(images - reused.displacements), initial=0.0))
+        ok     = ok and max_diff < 1E-10
+        all_ok = all_ok and ok
+        print "Verlet list, %-12s frames: %d, builds: %d, max abs.diff: %g %s" %("periodic," if box is not None
+                    else "not periodic,", verlet_list.n_frames, verlet_list.n_builds, max_diff, "OK" if ok else "FAILED")
+    return all_ok
+
+def benchmark_verlet_list(unit_cells=8, n_frames=100, step=0.01, skins=[0.0,0.2,0.5,1.0]):
+    """
+    Seconds per frame of a random walk on a periodic diamond lattice (nnp.in),
+    VerletList for different skins (skin 0: new list every frame)
+    """
+    from timeit import default_timer as timer
+    from derivatives_symm_func import diamond_lattice
+    box    = np.eye(3) * unit_cells * 5.431
+    frames = random_walk(diamond_lattice(unit_cells), n_frames, step, box)
+    print "%d atoms, %d frames, step %g" %(len(frames[0]), n_frames, step)
+    print " Skin | Builds | Rebuild fraction | Pairs/atom (stored) | [ms/frame]"
+    for skin in skins:
+        verlet_list = VerletList(skin=skin, box=box)
+        t0          = timer()
+        for xyz in frames:
+            verlet_list.update(xyz)
+        t_frame     = (timer() - t0) / n_frames
+        print "%5.2f | %6d | %16.2f | %19.2f | %10.2f" %(skin, verlet_list.n_builds, verlet_list.rebuild_fraction(),
+                    verlet_list.verlet.offsets[-1] / float(len(frames[0])), t_frame*1E3)
+
+def benchmark_neighbour_list(unit_cells=[2,4,8,10,16], brute_max=10):
+    """
+    Seconds per frame on the diamond lattices of nnp.in, cell list vs. all distances
+    """
+    from timeit import default_timer as timer
+    from derivatives_symm_func import diamond_lattice
+    print " Atoms | Cells [s] | Cells [us/atom] | Brute [s] | Speedup"
+    for L in unit_cells:
+        all_atoms = diamond_lattice(L, noise=0.1)
+        N         = len(all_atoms)
+        t0        = timer()
+        build_neighbour_list(all_atoms)
+        t_cells   = timer() - t0
+        if L <= brute_max:
+            t0      = timer()
+            build_neighbour_list(all_atoms, method="brute")
+            t_brute = timer() - t0
+            print "%6d | %9.4f | %15.2f | %9.4f | %7.1f" %(N, t_cells, t_cells/N*1E6, t_brute, t_brute/t_cells)
+        else:
+            print "%6d | %9.4f | %15.2f | %9s | %7s" %(N, t_cells, t_cells/N*1E6, "-", "-")
+
+if __name__ == '__main__':
+    check_neighbour_list()
+    check_periodic_neighbour_list()
+    check_verlet_list()
+    benchmark_neighbour_list()
+    benchmark_verlet_list()
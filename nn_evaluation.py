@@ -1,33 +1,96 @@
 import numpy as np
-import glob, os
-from create_train_data import generate_symmfunc_input_Si_Behler
+import os
+import sys
+import precision
+from descriptor_plan import load_descriptor_plan, as_descriptor_plan
 from symmetry_transform import symmetryTransformBehler
+from file_management import find_model_file, model_epoch, read_model
+
+# Activation functions with derivatives:
+sigmoid     = lambda x: 1.0/(1+np.exp(-x))
+relu        = lambda x: np.maximum(x, 0)
+ddx_relu    = lambda x: np.array((x >= 0), dtype=x.dtype)
+act_tanh    = lambda x: np.tanh(x)
+ddx_tanh    = lambda x: 1.0 - np.tanh(x)**2
+
+def ddx_sigmoid(x):
+    s = sigmoid(x) # Only once
+    return s*(1-s)
+
+def fused_sigmoid(z, out, ddx_out):
+    """
+    out = sigmoid(z), ddx_out = sigmoid'(z), in-place (out may be z)
+    """
+    np.negative(z, out=out)
+    np.exp(out, out=out)
+    out += 1
+    np.reciprocal(out, out=out)
+    np.subtract(1, out, out=ddx_out)
+    ddx_out *= out
+
+def fused_tanh(z, out, ddx_out):
+    np.tanh(z, out=out)
+    np.multiply(out, out, out=ddx_out)
+    np.subtract(1, ddx_out, out=ddx_out)
+
+def fused_relu(z, out, ddx_out):
+    np.greater_equal(z, 0, out=ddx_out)
+    np.maximum(z, 0, out=out)
+
+activations = {"sigmoid": (sigmoid, ddx_sigmoid, fused_sigmoid),
+               "tanh":    (act_tanh, ddx_tanh, fused_tanh),
+               "relu":    (relu, ddx_relu, fused_relu)}
+
+def activation_name(act_func, ddx_act_f):
+    """
+    Name of the pair of functions in 'activations', None if not one of them
+    """
+    for name, (f, ddx_f, _) in activations.items():
+        if f is act_func and ddx_f is ddx_act_f:
+            return name
+    return None
 
 class neural_network():
     """
     Loads and stores the neural network of choice in memory.
     Can evaluate the network and return the derivative w.r.t. inputs.
+    Weights are stored and evaluated in 'dtype' (default: precision.dtype).
+    epoch: Epoch to load (default: last), see read_NN_from_file.
     """
-    def __init__(self, loadPath, act_func, ddx_act_f):
-        node_w_list, node_biases, what_epoch = read_NN_from_file(loadPath)
-        G_funcs, nmbr_G  = generate_symmfunc_input_Si_Behler()
+    def __init__(self, loadPath, act_func, ddx_act_f, plan=None, dtype=None, epoch=None):
+        node_w_list, node_biases, what_epoch, activation, plan_hash = read_NN_from_file(loadPath, epoch)
+        if dtype is None:
+            dtype = precision.dtype
+        if plan is None:
+            plan = load_descriptor_plan() # Behler Si
+        plan             = as_descriptor_plan(plan)
+        if plan_hash is not None and plan_hash != plan.hash:
+            print "!!NB!! Network was trained on other symmetry functions (plan hash: %s, not %s)" %(plan_hash, plan.hash)
+        G_funcs, nmbr_G  = plan.params_list, plan.n_descriptors
+        self.plan        = plan
+        self.dtype       = dtype
         self.what_epoch  = what_epoch
         self.all_layers  = len(node_w_list) + 1
         self.hdn_layers  = self.all_layers - 2
-        self.node_biases = node_biases
+        self.node_biases = [np.asarray(b, dtype=dtype) for b in node_biases]
         self.G_funcs     = G_funcs
         self.nmbr_G      = nmbr_G
         self.act_func    = act_func
         self.ddx_act_f   = ddx_act_f
-        self.node_w_list = node_w_list
+        self.activation  = activation_name(act_func, ddx_act_f) # i.e. "sigmoid", None if not in 'activations'
+        if activation in activations and self.activation != activation:
+            print "!!NB!! Graph file says activation: %s, but %s was given. Using the one given." \
+                  %(activation, self.activation or act_func)
+        self._engine     = None
+        self.node_w_list = [np.asarray(w, dtype=dtype) for w in node_w_list]
         # Force last weight vector to be Nx1 matrix
-        self.node_w_list[-1] = node_w_list[-1].reshape(node_w_list[-1].shape[0],1)
+        self.node_w_list[-1] = self.node_w_list[-1].reshape(node_w_list[-1].shape[0],1)
     def __call__(self, sym_vec):
         """
         Evaluates the neural network and returns the energy
         """
         self.node_sum  = []
-        vec_prev_layer = sym_vec # First input
+        vec_prev_layer = np.asarray(sym_vec, dtype=self.dtype) # First input
         self.node_sum.append(vec_prev_layer)
         # Evaluate the neural network:
         for i,w_mat in enumerate(self.node_w_list):
@@ -47,7 +110,7 @@ class neural_network():
         ddx_act_f  = self.ddx_act_f
         f_vec_G2   = np.zeros(3)   # Will contain the forces (Fx, Fy, Fz)
         f_vec_G4   = np.zeros(3)
-        output     = np.array(1.0) # Derivative of output neruon is 1 since its f(x) = x
+        output     = np.array(1.0, dtype=self.dtype) # Derivative of output neruon is 1 since its f(x) = x
         deriv_list = [0] * tot_layers
         deriv_list[-1] = output
         # Loop backwards through layers of NN (from output to the input)
@@ -60,12 +123,49 @@ class neural_network():
         deriv_list[0] = np.dot(deriv_list[1], weights_trans)
         dNNdG         = np.array(deriv_list[0].transpose())
         return dNNdG
+    def energies(self, G):
+        """
+        Energies of all atoms, G: (n_atoms x nmbr_G) matrix of symmetry vectors.
+        Returns (n_atoms) array
+        """
+        layer = np.asarray(G, dtype=self.dtype)
+        for i,w_mat in enumerate(self.node_w_list):
+            layer = np.dot(layer, w_mat) + self.node_biases[i]
+            if i != len(self.node_w_list)-1: # We dont use act_func on output layer
+                layer = self.act_func(layer)
+        return layer[:,0]
+    def energies_and_gradients(self, G):
+        """
+        Energies of all atoms and the derivatives w.r.t. their symmetry vectors,
+        same as __call__ and derivative() for every row of G, but one matmul per layer.
+        Returns (n_atoms) array, (n_atoms x nmbr_G) matrix
+        """
+        layer    = np.asarray(G, dtype=self.dtype)
+        node_sum = [] # Hidden layers, before activation
+        for i,w_mat in enumerate(self.node_w_list):
+            layer = np.dot(layer, w_mat) + self.node_biases[i]
+            if i != len(self.node_w_list)-1: # We dont use act_func on output layer
+                node_sum.append(layer)
+                layer = self.act_func(layer)
+        # Backwards through the layers, output neuron has derivative 1 since its f(x) = x
+        deriv = np.repeat(self.node_w_list[-1].T, len(layer), axis=0)
+        for i in reversed(range(self.hdn_layers)):
+            deriv *= self.ddx_act_f(node_sum[i])
+            deriv  = np.dot(deriv, self.node_w_list[i].T) # Linear input nodes for i = 0
+        return layer[:,0], deriv
+    def engine(self, max_batch=1000):
+        """
+        InferenceEngine of this network, made once (grows if max_batch is larger)
+        """
+        if self._engine is None or self._engine.max_batch < max_batch:
+            self._engine = InferenceEngine(self, max_batch)
+        return self._engine
     def create_symvec_from_xyz(self, xyz):
         """
         XYZ is neighbor-coordinates only!
         """
-        symm_vec = symmetryTransformBehler(self.G_funcs, xyz)
-        return symm_vec
+        symm_vec = symmetryTransformBehler(self.plan, xyz)
+        return symm_vec.astype(self.dtype, copy=False)
     def what_epoch(self):
         return self.what_epoch
     def nmbr_G(self):
@@ -74,49 +174,314 @@ class neural_network():
         return self.G_funcs
 
 
-def read_NN_from_file(loadPath):
-    which_graph_file = loadPath + "graph.dat"
-    # Remove filename at the end (variable length)
-    for i,letter in enumerate(reversed(loadPath)):
-        if letter == "/": # Find index i of last letter "/" in path
-            break
-    loadPath = loadPath[:-i] # Now points to the folder, not the file
-    folder_list = glob.glob(loadPath + "graph*")
-    folder_list = sorted(folder_list, key=os.path.getmtime)# Sort by time created
-    if len(folder_list) == 1:
-        which_graph_file = folder_list[0]
-    else:
-        print "\nFound multiple graph_EPOCHS.dat-files. Choose one:"
-        for i,graph_file in enumerate(folder_list):
-            print " %d)"%i, graph_file[61:]
-        i = int(raw_input("Input an integer: "))
-        which_graph_file = folder_list[i] # Dont use loadPath, since glob-list has entire (relative) path
-    what_epoch       = int(which_graph_file[66:-4])
-    with open(which_graph_file, "r") as nn_file:
-        hdn_layers, nodes, act_func, nn_inp, nn_out = nn_file.readline().strip().split()
-        hdn_layers   = int(hdn_layers); nodes = int(nodes); nn_inp = int(nn_inp); nn_out = int(nn_out)
-        tot_w_lines  = (hdn_layers-1)*nodes + nn_inp + 1 # Last one from output layer
-        node_weights = np.zeros((tot_w_lines,nodes))
-        node_biases  = []
-        line_index = 0 # We dont care about first line, already taken care of above
-        for line in nn_file:
-            line = line.strip().split() # Remove newline and spaces. Then split into list of numbers
-            if not line:
-                continue # Skip line between W and B
-            line = np.array(line, dtype=float) # Convert list of strings to array of floats
-            if line_index < tot_w_lines: # Reading node weights
-                # print "W",line_index,line[0] # Error checking
-                node_weights[line_index,:] = line
+class InferenceEngine:
+    """
+    Energies and dE/dG of a batch of symmetry vectors with per-layer work
+    arrays preallocated for 'max_batch' atoms. Activations and their derivatives
+    are computed in the same (fused, in-place) forward pass, and the backward
+    pass reuses them, so evaluating does not allocate in steady state.
+    Larger batches are done max_batch atoms at the time.
+    n_allocations, allocated_bytes: Arrays made by the engine so far (work and output).
+        engine      = nn_eval.engine()
+        Ep, dNNdG   = engine(G) # Views of the work arrays, valid until next call
+    """
+    def __init__(self, nn_eval, max_batch=1000, activation=None):
+        self.dtype      = nn_eval.dtype
+        self.max_batch  = max_batch
+        self.n_allocations   = 0
+        self.allocated_bytes = 0
+        if activation is None:
+            activation = nn_eval.activation
+        if activation in activations:
+            self.fused_act = activations[activation][2]
+        else:
+            # Not known, use the functions of the network (allocates)
+            def fused_act(z, out, ddx_out):
+                ddx_out[...] = nn_eval.ddx_act_f(z)
+                out[...]     = nn_eval.act_func(z)
+            self.fused_act = fused_act
+        self.weights    = [self.allocate(w.shape, w) for w in nn_eval.node_w_list]
+        self.weights_T  = [self.allocate(w.T.shape, w.T) for w in nn_eval.node_w_list]
+        self.biases     = [self.allocate(np.shape(b), b) for b in nn_eval.node_biases]
+        nmbr_G          = self.weights[0].shape[0]
+        self.inputs     = self.allocate((max_batch, nmbr_G))
+        self.layers     = [self.allocate((max_batch, w.shape[1])) for w in self.weights] # Last: energies
+        self.ddx_layers = [self.allocate((max_batch, w.shape[1])) for w in self.weights[:-1]]
+        self.deltas     = [self.allocate((max_batch, w.shape[1])) for w in self.weights[:-1]]
+        self.dNNdG      = self.allocate((max_batch, nmbr_G))
+    def allocate(self, shape, values=None):
+        self.n_allocations   += 1
+        work                  = np.zeros(shape, dtype=self.dtype)
+        self.allocated_bytes += work.nbytes
+        if values is not None:
+            work[...] = values
+        return work
+    def forward_backward(self, G, gradients=True):
+        """
+        One batch of at most max_batch rows. Returns views of the work arrays.
+        """
+        n = len(G)
+        np.copyto(self.inputs[:n], G) # Casts to dtype
+        layer = self.inputs[:n]
+        for i in range(len(self.weights)):
+            out = self.layers[i][:n]
+            np.dot(layer, self.weights[i], out=out)
+            out += self.biases[i]
+            if i != len(self.weights)-1: # We dont use act_func on output layer
+                self.fused_act(out, out, self.ddx_layers[i][:n])
+            layer = out
+        if not gradients:
+            return layer[:,0], None
+        # Backwards through the layers, output neuron has derivative 1 since its f(x) = x
+        delta      = self.deltas[-1][:n]
+        delta[...] = self.weights_T[-1]
+        for i in reversed(range(len(self.deltas))):
+            delta *= self.ddx_layers[i][:n]
+            if i == 0:
+                out = self.dNNdG[:n] # Linear input nodes
             else:
-                # print "B",line_index,line[0] # Error checking
-                node_biases.append(line)
-            line_index += 1
-    # Convert to proper matrices
-    node_w_list = []
-    node_w_list.append(node_weights[0:nn_inp,:])
-    # print node_weights[nn_inp:nn_inp+nodes,:]
-    # raw_input("ASDF")
-    for i in range(nn_inp, tot_w_lines-1, nodes): # Loop over hidden layer 2 -->
-        node_w_list.append(node_weights[i:i+nodes,:])
-    node_w_list.append(node_weights[-1,:]) # This is output node
-    return node_w_list, node_biases, what_epoch
+                out = self.deltas[i-1][:n]
+            np.dot(delta, self.weights_T[i], out=out)
+            delta = out
+        return layer[:,0], self.dNNdG[:n]
+    def __call__(self, G, gradients=True, Ep_out=None, dNNdG_out=None):
+        """
+        Energies (n_atoms) and dE/dG (n_atoms x nmbr_G) of all rows of G.
+        Up to max_batch rows: returns views of the work arrays unless
+        Ep_out, dNNdG_out are given. Larger: new arrays (or the given ones).
+        """
+        n = len(G)
+        if n <= self.max_batch and Ep_out is None:
+            return self.forward_backward(G, gradients)
+        if Ep_out is None:
+            Ep_out = self.allocate(n)
+        if dNNdG_out is None and gradients:
+            dNNdG_out = self.allocate(G.shape)
+        for start in range(0, n, self.max_batch):
+            stop      = min(start + self.max_batch, n)
+            Ep, dNNdG = self.forward_backward(G[start:stop], gradients)
+            Ep_out[start:stop] = Ep
+            if gradients:
+                dNNdG_out[start:stop] = dNNdG
+        return Ep_out, dNNdG_out
+
+class NetworkEnsemble:
+    """
+    Committee of K networks (i.e. different seeds or epochs), evaluated together:
+    the weights of layer i are stacked in a (K x inputs x outputs) array, so every
+    layer is one batched matmul for all models. All networks need the same number
+    of hidden layers and activation, narrower layers are padded with zero weights
+    (exact, padded nodes do not contribute).
+        ensemble = NetworkEnsemble([nn_eval_1, nn_eval_2, ...])
+        Ep_mean, Ep_std, dNNdG_mean = ensemble(G)
+    """
+    def __init__(self, networks):
+        first = networks[0]
+        if len(set((nn_eval.all_layers, nn_eval.node_w_list[0].shape[0]) for nn_eval in networks)) != 1:
+            print "Ensemble: All networks must have the same number of layers and inputs. Exiting!"
+            sys.exit(0)
+        if len(set((nn_eval.act_func, nn_eval.ddx_act_f) for nn_eval in networks)) != 1:
+            print "Ensemble: All networks must use the same activation function. Exiting!"
+            sys.exit(0)
+        self.networks  = networks
+        self.n_models  = len(networks)
+        self.dtype     = first.dtype
+        self.plan      = first.plan
+        if first.activation in activations:
+            self.fused_act = activations[first.activation][2]
+        else:
+            def fused_act(z, out, ddx_out):
+                ddx_out[...] = first.ddx_act_f(z)
+                out[...]     = first.act_func(z)
+            self.fused_act = fused_act
+        self.weights   = []
+        self.biases    = []
+        for i in range(len(first.node_w_list)):
+            n_in  = max(nn_eval.node_w_list[i].shape[0] for nn_eval in networks)
+            n_out = max(nn_eval.node_w_list[i].shape[1] for nn_eval in networks)
+            w_stack = np.zeros((self.n_models, n_in, n_out), dtype=self.dtype)
+            b_stack = np.zeros((self.n_models, 1, n_out), dtype=self.dtype)
+            for k, nn_eval in enumerate(networks):
+                w = nn_eval.node_w_list[i]
+                w_stack[k,:w.shape[0],:w.shape[1]] = w
+                b_stack[k,0,:w.shape[1]]           = nn_eval.node_biases[i]
+            self.weights.append(w_stack)
+            self.biases.append(b_stack)
+        self.weights_T = [np.ascontiguousarray(np.swapaxes(w, 1, 2)) for w in self.weights]
+        # The input layer is shared by all models: one (nmbr_G x K*nodes) matrix, one matmul
+        K, nmbr_G, nodes = self.weights[0].shape
+        self.W0_flat     = np.ascontiguousarray(np.swapaxes(self.weights[0], 0, 1).reshape(nmbr_G, K*nodes))
+        self.b0_flat     = self.biases[0].reshape(K*nodes)
+        self.W0_T_flat   = self.weights_T[0].reshape(K*nodes, nmbr_G)
+    def forward(self, G):
+        """
+        Activations and their derivatives are computed together (fused).
+        Returns the activation derivatives of the hidden layers, ddx_layers[i]
+        (K x n_atoms x nodes), and the energies (K x n_atoms)
+        """
+        n_atoms    = len(G)
+        K, nodes   = self.n_models, self.W0_flat.shape[1] // self.n_models
+        layer      = np.dot(np.asarray(G, dtype=self.dtype), self.W0_flat) + self.b0_flat # (n_atoms x K*nodes)
+        layer      = np.ascontiguousarray(np.swapaxes(layer.reshape(n_atoms, K, nodes), 0, 1))
+        ddx_layers = []
+        for i in range(1, len(self.weights)):
+            ddx_layers.append(np.empty_like(layer))
+            self.fused_act(layer, layer, ddx_layers[-1])
+            layer = np.matmul(layer, self.weights[i]) + self.biases[i] # (K x n_atoms x nodes)
+        return ddx_layers, layer[...,0]
+    def backward(self, ddx_layers):
+        """
+        dE/dx of the first hidden layer (before activation), (K x n_atoms x nodes)
+        """
+        # Output neuron has derivative 1 since its f(x) = x
+        deriv = ddx_layers[-1] * self.weights_T[-1]
+        for i in reversed(range(len(ddx_layers)-1)):
+            deriv  = np.matmul(deriv, self.weights_T[i+1])
+            deriv *= ddx_layers[i]
+        return deriv
+    def energies_and_gradients(self, G):
+        """
+        Energies (K x n_atoms) and dE/dG (K x n_atoms x nmbr_G) of every model
+        """
+        ddx_layers, Ep = self.forward(G)
+        return Ep, np.matmul(self.backward(ddx_layers), self.weights_T[0]) # Linear input nodes
+    def energies(self, G):
+        """
+        Energies (K x n_atoms) of every model
+        """
+        return self.forward(G)[1]
+    def __call__(self, G, chunk_size=1000):
+        """
+        Mean and standard deviation of the energy of every atom over the models,
+        and the mean dE/dG (n_atoms x nmbr_G). 'chunk_size' atoms at the time.
+        The mean dE/dG is one matmul over all models, K dE/dG's are never stored.
+        """
+        n_atoms    = len(G)
+        Ep_mean    = np.zeros(n_atoms, dtype=self.dtype)
+        Ep_std     = np.zeros(n_atoms, dtype=self.dtype)
+        dNNdG_mean = np.zeros((n_atoms, self.W0_flat.shape[0]), dtype=self.dtype)
+        for start in range(0, n_atoms, chunk_size):
+            stop         = min(start + chunk_size, n_atoms)
+            ddx_layers, Ep = self.forward(G[start:stop])
+            deriv          = np.swapaxes(self.backward(ddx_layers), 0, 1).reshape(stop-start, -1) # (n_atoms x K*nodes)
+            Ep_mean[start:stop]    = np.mean(Ep, axis=0)
+            Ep_std[start:stop]     = np.std(Ep, axis=0)
+            dNNdG_mean[start:stop] = np.dot(deriv, self.W0_T_flat) / self.n_models
+        return Ep_mean, Ep_std, dNNdG_mean
+
+def load_ensemble(loadPaths, act_func, ddx_act_f, epochs=None, plan=None, dtype=None):
+    """
+    NetworkEnsemble of the networks in loadPaths (see read_NN_from_file),
+    epochs: one per path (default: last epoch of each)
+    """
+    if epochs is None:
+        epochs = [None] * len(loadPaths)
+    return NetworkEnsemble([neural_network(loadPath, act_func, ddx_act_f, plan, dtype, epoch)
+                            for loadPath, epoch in zip(loadPaths, epochs)])
+
+def read_NN_from_file(loadPath, epoch=None):
+    """
+    Reads the network in the folder of loadPath (i.e. '.../run<epoch>' or a folder
+    ending with '/'), the last epoch unless 'epoch' is given. loadPath can also be
+    a model file. Binary models (graph<epoch>.nnm) are preferred over graph<epoch>.dat.
+    Returns weights, biases, epoch, activation and the descriptor plan hash (None for .dat)
+    """
+    if os.path.isfile(loadPath) and model_epoch(loadPath) is not None:
+        which_graph_file = loadPath
+    else:
+        which_graph_file = find_model_file(os.path.dirname(loadPath), epoch)
+    print "Loading neural network:", which_graph_file
+    model       = read_model(which_graph_file)
+    node_w_list = list(model["weights"])
+    node_w_list[-1] = node_w_list[-1].reshape(-1) # This is output node
+    return node_w_list, list(model["biases"]), model["epoch"], model["activation"], model["plan_hash"]
+
+def check_batch_evaluation(nn_eval, G, tolerance=1E-10):
+    """
+    energies_and_gradients vs. __call__ and derivative() one row of G at the time,
+    with timings. Returns True if they agree within 'tolerance' (relative).
+    """
+    from timeit import default_timer as timer
+    Ep_ref  = np.zeros(len(G))
+    dG_ref  = np.zeros(G.shape)
+    t0      = timer()
+    for i_atom, symm_vec in enumerate(G):
+        Ep_ref[i_atom] = nn_eval(symm_vec)
+        dG_ref[i_atom] = nn_eval.derivative().ravel()
+    t_loop  = timer() - t0
+    t0      = timer()
+    Ep, dG  = nn_eval.energies_and_gradients(G)
+    t_batch = timer() - t0
+    diff_Ep = np.max(np.abs(Ep - Ep_ref)) / max(np.max(np.abs(Ep_ref)), 1.0)
+    diff_dG = np.max(np.abs(dG - dG_ref)) / max(np.max(np.abs(dG_ref)), 1.0)
+    ok      = diff_Ep <= tolerance and diff_dG <= tolerance
+    print "Atoms: %d, rel.diff energies: %g, gradients: %g %s" %(len(G), diff_Ep, diff_dG, "OK" if ok else "FAILED")
+    print "Per atom: %.4f s, batch: %.4f s, speedup: %.1f" %(t_loop, t_batch, t_loop/t_batch)
+    return ok
+
+def benchmark_inference_engine(nn_eval, G, repeats=100, max_batch=1000):
+    """
+    InferenceEngine vs. energies_and_gradients on the symmetry vectors G:
+    Max abs.diff, time per call and arrays allocated by the engine per call
+    (plus traced bytes per call where tracemalloc exists, Python 3).
+    """
+    from timeit import default_timer as timer
+    engine       = InferenceEngine(nn_eval, max_batch)
+    Ep_ref, dG_ref = nn_eval.energies_and_gradients(G)
+    Ep, dG       = engine(G)
+    print "Max abs.diff energies: %g, gradients: %g" %(np.max(np.abs(Ep - Ep_ref)), np.max(np.abs(dG - dG_ref)))
+    t0           = timer()
+    for i in range(repeats):
+        nn_eval.energies_and_gradients(G)
+    t_ref        = (timer() - t0) / repeats
+    allocations  = engine.n_allocations
+    t0           = timer()
+    for i in range(repeats):
+        engine(G)
+    t_engine     = (timer() - t0) / repeats
+    print "Atoms: %d, energies_and_gradients: %.3f ms, engine: %.3f ms, speedup: %.1f" \
+            %(len(G), t_ref*1E3, t_engine*1E3, t_ref/t_engine)
+    print "Engine arrays: %d (%d bytes), allocated per call: %g" %(engine.n_allocations,
+                engine.allocated_bytes, (engine.n_allocations - allocations) / float(repeats))
+    try:
+        import tracemalloc
+    except ImportError:
+        return
+    for name, evaluate in [("energies_and_gradients", nn_eval.energies_and_gradients), ("engine", engine)]:
+        evaluate(G) # Warm up
+        tracemalloc.start()
+        for i in range(repeats):
+            evaluate(G)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print "%-22s peak traced bytes: %d" %(name, peak)
+
+def benchmark_ensemble(nn_eval, G, n_models=[1,2,4,8,16,32], noise=0.1, repeats=5):
+    """
+    NetworkEnsemble vs. a loop over energies_and_gradients of every model.
+    The models are copies of nn_eval with weights perturbed by 'noise' (relative).
+    """
+    import copy
+    from timeit import default_timer as timer
+    print "Atoms: %d, layers: %s" %(len(G), [w.shape[0] for w in nn_eval.node_w_list] + [1])
+    print " Models | Loop [ms] | Ensemble [ms] | Speedup | Ensemble/K [ms] | Max abs.diff (mean, std, dE/dG)"
+    for K in n_models:
+        networks = []
+        for k in range(K):
+            member = copy.copy(nn_eval)
+            member.node_w_list = [w * (1 + noise*np.random.normal(0, 1, w.shape)) for w in nn_eval.node_w_list]
+            networks.append(member)
+        ensemble = NetworkEnsemble(networks)
+        t0       = timer()
+        for i in range(repeats):
+            results = [member.energies_and_gradients(G) for member in networks]
+            Ep      = np.array([Ep_k for Ep_k, dNNdG_k in results])
+            ref     = [np.mean(Ep, axis=0), np.std(Ep, axis=0), np.mean([dNNdG_k for Ep_k, dNNdG_k in results], axis=0)]
+        t_loop   = (timer() - t0) / repeats
+        t0       = timer()
+        for i in range(repeats):
+            values = ensemble(G)
+        t_ens    = (timer() - t0) / repeats
+        diff     = [np.max(np.abs(value - ref_value)) for value, ref_value in zip(values, ref)]
+        print "%7d | %9.2f | %13.2f | %7.2f | %15.3f | %g, %g, %g" %(K, t_loop*1E3, t_ens*1E3, t_loop/t_ens,
+                    t_ens/K*1E3, diff[0], diff[1], diff[2])
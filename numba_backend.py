@@ -0,0 +1,237 @@
+"""
+Numba backend for the symmetry functions and their derivatives.
+The per-environment kernels are compiled in nopython mode and run in
+parallel over environments (prange). Registers itself as "numba" on import:
+    from symmetry_functions import set_backend
+    set_backend("numba") # Falls back to numpy if numba is not installed
+Only the cosine cutoff is compiled, tabulated functions (lookup) use numpy.
+"""
+from math import exp,cos,sin,pi,sqrt
+import numpy as np
+from numba import njit, prange
+from symmetry_functions import register_backend
+
+@njit(cache=True)
+def _cutoff_cos(r, rc):
+    if r <= rc:
+        return 0.5*(cos(pi*r/rc)+1)
+    return 0.
+
+@njit(cache=True)
+def _ddx_cutoff_cos(r, rc):
+    if r <= rc:
+        return (-0.5*pi/rc) * sin(pi*r/rc)
+    return 0.
+
+@njit(parallel=True, cache=True)
+def _G2_all(r, eta, rc, rs):
+    """
+    r: (samples x n_neighbours), output (n_params x samples)
+    """
+    n_samples, n_neigh = r.shape
+    summation = np.zeros((len(eta), n_samples))
+    for s in prange(n_samples):
+        for j in range(n_neigh):
+            for p in range(len(eta)):
+                if r[s,j] <= rc[p]:
+                    summation[p,s] += exp(-eta[p]*(r[s,j]-rs[p])**2) * _cutoff_cos(r[s,j], rc[p])
+    return summation
+
+@njit(cache=True)
+def _power(x, zeta, zeta_int):
+    """
+    x**zeta, by repeated squaring if zeta is a non-negative integer (zeta_int >= 0)
+    """
+    if zeta_int < 0:
+        return x**zeta
+    result = 1.0
+    while zeta_int:
+        if zeta_int & 1:
+            result *= x
+        x        *= x
+        zeta_int >>= 1
+    return result
+
+@njit(parallel=True, cache=True)
+def _angular_all(xyz, eta, rc, zeta, lambda_c, with_rjk):
+    """
+    xyz: (samples x n_neighbours x 3), output (n_params x samples).
+    G4 if with_rjk, else G5. exp(-eta*r^2)*fc(r) is computed once per neighbour.
+    """
+    n_samples, n_neigh = xyz.shape[0], xyz.shape[1]
+    n_params  = len(eta)
+    zeta_int  = np.full(n_params, -1)
+    for p in range(n_params):
+        if zeta[p] == int(zeta[p]) and zeta[p] >= 0:
+            zeta_int[p] = int(zeta[p])
+    summation = np.zeros((n_params, n_samples))
+    for s in prange(n_samples):
+        r = np.empty(n_neigh)
+        w = np.empty((n_neigh, n_params))
+        for j in range(n_neigh):
+            r[j] = sqrt(xyz[s,j,0]**2 + xyz[s,j,1]**2 + xyz[s,j,2]**2)
+            for p in range(n_params):
+                w[j,p] = exp(-eta[p]*r[j]**2) * _cutoff_cos(r[j], rc[p])
+        for j in range(n_neigh):
+            for k in range(j+1, n_neigh):
+                cos_theta = (xyz[s,j,0]*xyz[s,k,0] + xyz[s,j,1]*xyz[s,k,1] + xyz[s,j,2]*xyz[s,k,2]) / (r[j]*r[k])
+                r2_jk     = 0.
+                if with_rjk:
+                    r2_jk = (xyz[s,j,0]-xyz[s,k,0])**2 + (xyz[s,j,1]-xyz[s,k,1])**2 + (xyz[s,j,2]-xyz[s,k,2])**2
+                for p in range(n_params):
+                    w_jk = w[j,p] * w[k,p]
+                    if w_jk == 0.:
+                        continue # Outside cutoff
+                    if with_rjk:
+                        w_jk *= exp(-eta[p]*r2_jk) * _cutoff_cos(sqrt(r2_jk), rc[p])
+                    summation[p,s] += _power(1 + lambda_c[p]*cos_theta, zeta[p], zeta_int[p]) * w_jk
+        for p in range(n_params):
+            summation[p,s] *= 2**(1-zeta[p]) # Normalization factor
+    return summation
+
+@njit(cache=True)
+def _ddx_G2(neighborindices, neighborpositions, eta, Rc, Rs, i, m, l):
+    value = 0.0
+    for j in neighborindices:
+        if m != i and m != j:
+            continue # dRij/dRml = 0
+        Rij      = sqrt((neighborpositions[j,0]-neighborpositions[i,0])**2 +
+                        (neighborpositions[j,1]-neighborpositions[i,1])**2 +
+                        (neighborpositions[j,2]-neighborpositions[i,2])**2)
+        dRijdRml = (neighborpositions[j,l] - neighborpositions[i,l]) / Rij
+        if m == i:
+            dRijdRml = -dRijdRml
+        term   = -2.0*eta*(Rij-Rs) * _cutoff_cos(Rij, Rc) + _ddx_cutoff_cos(Rij, Rc)
+        value += exp(-eta*(Rij-Rs)**2) * term * dRijdRml
+    return value
+
+@njit(parallel=True, cache=True)
+def _ddx_angular(neighborindices, neighborpositions, lamb, zeta, eta, Rc, i, m, l, with_rjk):
+    """
+    d/dx_ml of G4 (with_rjk) or G5 for atom i, summed over all neighbour pairs j<k
+    """
+    n_neigh = len(neighborindices)
+    value   = 0.0
+    for jj in prange(n_neigh):
+        j = neighborindices[jj]
+        for kk in range(jj+1, n_neigh):
+            k = neighborindices[kk]
+            # How x_ij = x_j - x_i, x_ik and x_jk change when atom m moves
+            a = int(m == j) - int(m == i)
+            b = int(m == k) - int(m == i)
+            c = int(m == k) - int(m == j)
+            if a == 0 and b == 0 and c == 0:
+                continue # dG/dx_ml = 0
+            x_ij  = neighborpositions[j] - neighborpositions[i]
+            x_ik  = neighborpositions[k] - neighborpositions[i]
+            x_jk  = neighborpositions[k] - neighborpositions[j]
+            Rij   = sqrt(x_ij[0]**2 + x_ij[1]**2 + x_ij[2]**2)
+            Rik   = sqrt(x_ik[0]**2 + x_ik[1]**2 + x_ik[2]**2)
+            Rjk   = sqrt(x_jk[0]**2 + x_jk[1]**2 + x_jk[2]**2)
+            if Rij > Rc or Rik > Rc or (with_rjk and Rjk > Rc):
+                continue # Outside cutoff
+            cos_theta = (x_ij[0]*x_ik[0] + x_ij[1]*x_ik[1] + x_ij[2]*x_ik[2]) / (Rij*Rik)
+            dRij  = a * x_ij[l] / Rij
+            dRik  = b * x_ik[l] / Rik
+            dcos  = a * (x_ik[l]/(Rij*Rik) - cos_theta*x_ij[l]/Rij**2) \
+                  + b * (x_ij[l]/(Rij*Rik) - cos_theta*x_ik[l]/Rik**2)
+            fc_ij, fc_ik = _cutoff_cos(Rij, Rc), _cutoff_cos(Rik, Rc)
+            r2    = Rij**2 + Rik**2
+            dr2   = 2*(Rij*dRij + Rik*dRik)
+            fc    = fc_ij * fc_ik
+            dfc   = _ddx_cutoff_cos(Rij, Rc)*dRij*fc_ik + fc_ij*_ddx_cutoff_cos(Rik, Rc)*dRik
+            if with_rjk:
+                dRjk  = c * x_jk[l] / Rjk
+                fc_jk = _cutoff_cos(Rjk, Rc)
+                r2   += Rjk**2
+                dr2  += 2*Rjk*dRjk
+                dfc   = dfc*fc_jk + fc*_ddx_cutoff_cos(Rjk, Rc)*dRjk
+                fc   *= fc_jk
+            A      = 1 + lamb*cos_theta
+            E      = exp(-eta*r2)
+            value += (zeta*A**(zeta-1)*lamb*dcos*E*fc - A**zeta*eta*dr2*E*fc + A**zeta*E*dfc)
+    return 2**(1-zeta) * value
+
+def _params(*columns):
+    return [np.ascontiguousarray(column, dtype=np.float64) for column in columns]
+
+def G2_all(r, eta, rc, rs):
+    """
+    Same as symmetry_functions.G2_all (cosine cutoff)
+    """
+    r         = np.asarray(r, dtype=np.float64)
+    summation = _G2_all(np.ascontiguousarray(r.reshape((-1, r.shape[-1]))), *_params(eta, rc, rs))
+    return summation.reshape((len(summation),) + r.shape[:-1])
+
+def G4_all(xyz, eta, rc, zeta, lambda_c):
+    """
+    Same as symmetry_functions.G4_all (cosine cutoff)
+    """
+    xyz       = np.asarray(xyz, dtype=np.float64)
+    summation = _angular_all(np.ascontiguousarray(xyz.reshape((-1,) + xyz.shape[-2:])),
+                             *(_params(eta, rc, zeta, lambda_c) + [True]))
+    return summation.reshape((len(summation),) + xyz.shape[:-2])
+
+def G5_all(xyz, eta, rc, zeta, lambda_c):
+    """
+    Same as symmetry_functions.G5_all (cosine cutoff)
+    """
+    xyz       = np.asarray(xyz, dtype=np.float64)
+    summation = _angular_all(np.ascontiguousarray(xyz.reshape((-1,) + xyz.shape[-2:])),
+                             *(_params(eta, rc, zeta, lambda_c) + [False]))
+    return summation.reshape((len(summation),) + xyz.shape[:-2])
+
+def calculate_ddx_G2(neighborindices, neighborpositions, eta, Rc, Rs, i, m, l):
+    """
+    Same as derivatives_symm_func.calculate_ddx_G2
+    """
+    return _ddx_G2(np.asarray(neighborindices, dtype=np.int64), np.asarray(neighborpositions, dtype=np.float64),
+                   float(eta), float(Rc), float(Rs), i, m, l)
+
+def calculate_ddx_G4(neighborindices, neighborpositions, lamb, zeta, eta, rc, index, m, l):
+    """
+    Same as derivatives_symm_func.calculate_ddx_G4
+    """
+    return _ddx_angular(np.asarray(neighborindices, dtype=np.int64), np.asarray(neighborpositions, dtype=np.float64),
+                        float(lamb), float(zeta), float(eta), float(rc), index, m, l, True)
+
+def calculate_ddx_G5(neighborindices, neighborpositions, lamb, zeta, eta, rc, index, m, l):
+    """
+    Same as derivatives_symm_func.calculate_ddx_G5
+    """
+    return _ddx_angular(np.asarray(neighborindices, dtype=np.int64), np.asarray(neighborpositions, dtype=np.float64),
+                        float(lamb), float(zeta), float(eta), float(rc), index, m, l, False)
+
+register_backend("numba", {"G2_all": G2_all, "G4_all": G4_all, "G5_all": G5_all,
+                           "ddx_G2": calculate_ddx_G2, "ddx_G4": calculate_ddx_G4, "ddx_G5": calculate_ddx_G5})
+
+def benchmark_backends(size=2000, neighbour_list=[4,10,20,40]):
+    """
+    Samples per second of symmetryTransformBehlerBatch with each backend
+    """
+    from timeit import default_timer as timer
+    from descriptor_plan import load_descriptor_plan
+    from symmetry_transform import symmetryTransformBehlerBatch
+    from symmetry_functions import set_backend
+    plan = load_descriptor_plan()
+    print "Neighbours | numpy [samples/s] | numba [samples/s] | Speedup | Max abs.diff"
+    for neighbours in neighbour_list:
+        xyz    = np.random.uniform(-3.5, 3.5, (size, neighbours, 3))
+        speeds = []
+        values = []
+        for backend in ["numpy", "numba"]:
+            set_backend(backend)
+            symmetryTransformBehlerBatch(plan, xyz[:10]) # Compile
+            t0 = timer()
+            values.append(symmetryTransformBehlerBatch(plan, xyz))
+            speeds.append(size / (timer() - t0))
+        set_backend("numpy")
+        print "%10d | %17.1f | %17.1f | %7.1f | %g" %(neighbours, speeds[0], speeds[1],
+                    speeds[1]/speeds[0], np.max(np.abs(values[1] - values[0])))
+
+if __name__ == '__main__':
+    from symmetry_functions import check_backends
+    from derivatives_symm_func import check_derivative_backends
+    check_backends()
+    check_derivative_backends()
+    benchmark_backends()
@@ -0,0 +1,33 @@
+"""
+Floating point precision used for descriptors, data set files, training
+buffers and the numpy evaluation of the neural network.
+
+float64 is the reference. float32 halves memory and bandwidth, and is what
+TensorFlow uses in training anyway ('float' placeholders).
+Select it once, before anything is computed or loaded:
+    import precision
+    precision.set_precision("float32")
+"""
+import sys
+import numpy as np
+
+dtype = np.float64
+
+def set_precision(new_dtype):
+    global dtype
+    new_dtype = np.dtype(new_dtype).type
+    if new_dtype not in [np.float32, np.float64]:
+        print "Precision:", new_dtype, "was not understood. Use 'float32' or 'float64'..."
+        sys.exit(0)
+    dtype = new_dtype
+
+def get_precision():
+    return dtype
+
+def savetxt_fmt():
+    """
+    Shortest format that still stores every value exactly (9 digits for float32)
+    """
+    if dtype == np.float32:
+        return "%.8e"
+    return "%.18e"
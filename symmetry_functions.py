@@ -1,5 +1,6 @@
-from math import exp,cos,pi,tanh,sqrt # Faster than numpy for scalars
+from math import exp,cos,pi,tanh,sqrt,factorial # Faster than numpy for scalars
 import numpy as np
+import sys
 
 """
 #################
@@ -32,6 +33,124 @@ def cutoff_cos(r,rc):
     else:
         return 0.5*(np.cos(pi*r/rc)+1) * (r <= rc)# * (r < r_SW_cut)
 
+def ddx_cutoff_tanh(r,rc):
+    return -3.0/rc * np.tanh(1-r/rc)**2 * (1 - np.tanh(1-r/rc)**2) * (r <= rc)
+
+def ddx_cutoff_cos(r,rc):
+    return -0.5*pi/rc * np.sin(pi*r/rc) * (r <= rc)
+
+cutoff_derivatives = {cutoff_tanh: ddx_cutoff_tanh, cutoff_cos: ddx_cutoff_cos}
+
+def radial_term(r, eta, rc, rs, cutoff=cutoff_cos):
+    """
+    exp(-eta*(r-rs)^2) * fc(r), the radial part of G2 (and of G4/G5 with rs = 0)
+    """
+    return np.exp(-eta*(r-rs)**2)*cutoff(r,rc)
+
+"""
+#################
+Lookup tables
+#################
+"""
+
+class LookupTable:
+    """
+    f(r) tabulated on a uniform grid over [0, r_max], with f = 0 beyond r_max.
+    kind = "linear" or "cubic" (4-point Lagrange), coefficients are stored per
+    grid interval so evaluation is a lookup plus a short Horner scheme.
+    The grid is doubled until the interpolation error, measured between the
+    grid points, is at most max_error (or max_points is reached, see .error).
+    """
+    def __init__(self, func, r_max, max_error=1E-8, kind="cubic", n_points=64, max_points=2**22):
+        if kind not in ["linear", "cubic"]:
+            print "Lookup table kind:", kind, "was not understood. Use 'linear' or 'cubic'..."
+            sys.exit(0)
+        self.func      = func
+        self.r_max     = float(r_max)
+        self.max_error = max_error
+        self.kind      = kind
+        while True:
+            self.build(n_points)
+            r_test     = (np.arange(n_points)[:,np.newaxis] + np.linspace(0.05, 0.95, 7)).ravel() * self.h
+            self.error = np.max(np.abs(self(r_test) - func(r_test)))
+            if self.error <= max_error or n_points >= max_points:
+                break
+            n_points *= 2
+    def build(self, n_points):
+        self.n_points = n_points
+        self.h        = self.r_max / n_points
+        self.inv_h    = 1.0 / self.h
+        f = self.func(np.arange(-1, n_points+1) * self.h) # f(-h), f(0), ..., f(r_max)
+        if self.kind == "linear":
+            coef = [f[1:-1], f[2:] - f[1:-1]]
+        else:
+            # Interval [r_i, r_i+1] is interpolated through r_i-1,...,r_i+2, the last one
+            # through r_i-2,...,r_i+1 so that nothing beyond r_max (i.e. a kink) is used
+            nodes  = np.arange(-1, n_points-1)[:,np.newaxis] + np.arange(4)
+            nodes[-1] -= 1
+            shifts = nodes[:,0] - np.arange(n_points) # First stencil node relative to the interval
+            coef   = np.zeros((4, n_points))
+            for shift in set(shifts):
+                t_nodes   = np.arange(4) + shift
+                intervals = np.where(shifts == shift)[0]
+                lagrange  = np.linalg.inv(t_nodes[:,np.newaxis]**np.arange(4)) # Polynomial coefficients
+                coef[:,intervals] = np.dot(lagrange, f[nodes[intervals]+1].T)
+        # Interval number n_points (and everything clipped to it) is r >= r_max, i.e. 0
+        self.coef = [np.append(c, 0.0) for c in coef]
+    def __call__(self, r):
+        x = np.asarray(r) * self.inv_h
+        i = np.minimum(x.astype(int), self.n_points)
+        t = x - i
+        c = self.coef
+        if self.kind == "linear":
+            return np.take(c[0], i) + np.take(c[1], i)*t
+        return ((np.take(c[3], i)*t + np.take(c[2], i))*t + np.take(c[1], i))*t + np.take(c[0], i)
+
+_table_cache = {} # (function, parameters, max_error, kind) --> LookupTable
+
+def lookup_table(key, func, r_max, max_error=1E-8, kind="cubic"):
+    """
+    Tables are only built once per key, e.g. (cutoff_cos, rc, eta, rs)
+    """
+    key = key + (max_error, kind)
+    if key not in _table_cache:
+        _table_cache[key] = LookupTable(func, r_max, max_error, kind)
+    return _table_cache[key]
+
+class TabulatedCutoff:
+    """
+    Tabulated version of a cutoff function, one table per rc. Can be used wherever
+    a cutoff function is expected, i.e. G2(r, rc, rs, eta, cutoff=TabulatedCutoff()).
+    """
+    def __init__(self, cutoff=cutoff_cos, max_error=1E-8, kind="cubic"):
+        self.cutoff    = cutoff
+        self.max_error = max_error
+        self.kind      = kind
+    def table(self, rc):
+        rc = float(rc)
+        return lookup_table((self.cutoff, rc), lambda r: self.cutoff(r, rc), rc, self.max_error, self.kind)
+    def __call__(self, r, rc):
+        if np.ndim(rc) == 0:
+            return self.table(rc)(r)
+        # Array of cutoffs (see G2_all): one table each, broadcast against r
+        values = np.array([self.table(rc_n)(r) for rc_n in np.ravel(rc)])
+        return values.reshape(np.broadcast(r, rc).shape)
+
+class TabulatedRadial:
+    """
+    Tabulated radial_term, one table per (rc, eta, rs)
+    """
+    def __init__(self, cutoff=cutoff_cos, max_error=1E-8, kind="cubic"):
+        self.cutoff    = cutoff
+        self.max_error = max_error
+        self.kind      = kind
+    def __call__(self, r, eta, rc, rs):
+        eta, rc, rs = float(eta), float(rc), float(rs)
+        cutoff      = self.cutoff
+        table       = lookup_table((radial_term, cutoff, rc, eta, rs),
+                                   lambda r: radial_term(r, eta, rc, rs, cutoff), rc, self.max_error, self.kind)
+        return table(r)
+
 """
 #################
 Single particle symmetry functions
@@ -48,18 +167,518 @@ def G2(r, rc, rs, eta, cutoff=cutoff_cos):
     summation = np.sum( np.exp(-eta*(r-rs)**2)*r_cut )
     return summation
 
+def G2_all(r, eta, rc, rs, cutoff=cutoff_cos, radial=None):
+    """
+    Evaluates many G2's at once, one for each element of the
+    parameter columns eta, rc and rs (arrays of same length):
+        G2_all(r, eta, rc, rs)[n] == G2(r, rc[n], rs[n], eta[n])
+    Each distinct cutoff is only computed once.
+    r may have leading (batch) dimensions, i.e. (samples x n_neighbours),
+    the output is then (n_params x samples).
+    radial: Optional tabulated radial term, see TabulatedRadial.
+    """
+    if radial is not None:
+        return np.array([np.sum(radial(r, eta_n, rc_n, rs_n), axis=-1) for eta_n, rc_n, rs_n in zip(eta, rc, rs)])
+    newaxes   = (1,)*np.ndim(r)
+    eta       = np.asarray(eta, dtype=float).reshape((-1,) + newaxes)
+    rs        = np.asarray(rs,  dtype=float).reshape((-1,) + newaxes)
+    rc_unique, rc_index = np.unique(np.asarray(rc, dtype=float), return_inverse=True)
+    r_cut     = cutoff(r[np.newaxis], rc_unique.reshape((-1,) + newaxes)) # (n_cutoffs x ... x n_neighbours)
+    summation = np.sum( np.exp(-eta*(r-rs)**2)*r_cut[rc_index], axis=-1 )
+    return summation
+
 def G3(r, rc, kappa, cutoff=cutoff_cos):
     r_cut     = cutoff(r,rc)
     summation = np.sum( np.cos(kappa*r)*r_cut )
     return summation
 
+_pair_cache = {} # Index arrays of neighbour pairs, reused for same number of neighbours
+
+def neighbour_pairs(N):
+    """
+    Returns index arrays j, k of all unique neighbour pairs j < k.
+    Pairs are ordered by k, so the pairs among the first n neighbours
+    are always the first n*(n-1)/2 entries.
+    """
+    if N not in _pair_cache:
+        k, j = np.tril_indices(N, -1)
+        _pair_cache[N] = (j, k)
+    return _pair_cache[N]
+
 def G4(xyz, rc, eta, zeta, lambda_c, cutoff=cutoff_cos):
     """ xyz:
     [[x1 y1 z1]
      [x2 y2 z2]
      [x3 y3 z3]
      [x4 y4 z4]]
-     """
+
+    All j<k triplets are evaluated at once, see G4_serial for the loop version.
+    """
+    r          = np.linalg.norm(xyz,axis=1)
+    j, k       = neighbour_pairs(len(r))
+    r_cut      = cutoff(r,rc)
+    r_jk       = np.linalg.norm(xyz[j] - xyz[k], axis=1)
+    cos_theta  = np.sum(xyz[j]*xyz[k], axis=1) / (r[j]*r[k])
+    cutoff_ijk = r_cut[j] * r_cut[k] * cutoff(r_jk, rc)
+    part_sum   = (1+lambda_c * cos_theta)**zeta * np.exp(-eta*(r[j]**2+r[k]**2+r_jk**2))
+    summation  = np.sum(part_sum*cutoff_ijk)
+    summation *= 2**(1-zeta) # Normalization factor
+    return summation
+
+def G5(xyz, rc, eta, zeta, lambda_c, cutoff=cutoff_cos):
+    """ xyz:
+    [[x1 y1 z1]
+     [x2 y2 z2]
+     [x3 y3 z3]
+     [x4 y4 z4]]
+
+    All j<k triplets are evaluated at once, see G5_serial for the loop version.
+    """
+    r          = np.linalg.norm(xyz,axis=1)
+    j, k       = neighbour_pairs(len(r))
+    r_cut      = cutoff(r,rc)
+    cos_theta  = np.sum(xyz[j]*xyz[k], axis=1) / (r[j]*r[k])
+    cutoff_ijk = r_cut[j] * r_cut[k]
+    part_sum   = (1+lambda_c * cos_theta)**zeta * np.exp(-eta*(r[j]**2+r[k]**2))
+    summation  = np.sum(part_sum*cutoff_ijk)
+    summation *= 2**(1-zeta)
+    return summation
+
+def sort_neighbours(xyz):
+    """
+    Sorts the neighbours of one, or many (samples x n_neighbours x 3), environments
+    by distance. Returns sorted xyz, sorted distances and the ordering used.
+    """
+    r     = np.linalg.norm(xyz, axis=-1)
+    order = np.argsort(r, axis=-1)
+    if r.ndim == 1:
+        return xyz[order], r[order], order
+    samples = np.arange(r.shape[0])[:,np.newaxis]
+    return xyz[samples,order], r[samples,order], order
+
+def neighbours_inside(r_sorted, rc):
+    """
+    Number of (sorted) neighbours with r <= rc. For many environments
+    the largest number is returned, so r_sorted[...,:n] holds all of them.
+    """
+    if r_sorted.shape[-1] == 0:
+        return 0
+    return int(np.max(np.sum(r_sorted <= rc, axis=-1)))
+
+class TripletGeometry:
+    """
+    Geometry of all neighbour triplets (i,j,k), j<k, of one environment.
+    Everything that does not depend on the symmetry function parameters is
+    computed once, so that many G4/G5 parameter rows can be evaluated
+    against the same neighbour list:
+        - cos(theta_jik)
+        - r_ij^2 + r_ik^2
+        - r_jk^2
+        - cutoff products fc(r_ij)*fc(r_ik) and fc(r_jk), once per cutoff
+    xyz may also hold many environments with the same number of neighbours,
+    (samples x n_neighbours x 3), then all arrays get a leading samples-axis.
+
+    Neighbours are sorted by distance (see 'order'), and since triplets are ordered
+    by k (see neighbour_pairs), a cutoff rc only needs the first n*(n-1)/2 triplets,
+    n being the number of neighbours inside rc. Neighbours beyond 'max_cutoff'
+    are dropped altogether.
+
+    G5 with integer zeta can also be evaluated in linear time, see G5_separable.
+    'separable' is True, False or "auto" (use it whenever it is cheaper).
+    The pair arrays are only computed when the pairwise kernel is actually used.
+
+    With a tabulated 'radial' (see TabulatedRadial) the products of exponentials and
+    cutoffs are looked up per neighbour, exp(-eta*r^2)*fc(r), instead of per triplet.
+    """
+    def __init__(self, xyz, cutoff=cutoff_cos, max_cutoff=None, is_sorted=False, separable="auto", radial=None):
+        if is_sorted:
+            self.order = None
+            r          = np.linalg.norm(xyz,axis=-1)
+        else:
+            xyz, r, self.order = sort_neighbours(xyz)
+        if max_cutoff is not None:
+            n   = neighbours_inside(r, max_cutoff)
+            xyz = xyz[...,:n,:]
+            r   = r[...,:n]
+        self.cutoff    = cutoff
+        self.radial    = radial
+        self.separable = separable
+        self.xyz       = xyz
+        self.r         = r
+        self.j, self.k = neighbour_pairs(self.r.shape[-1])
+        self.cos_theta = None # Pair arrays, see compute_pairs
+        self.cut_ijk   = {} # rc --> fc(r_ij)*fc(r_ik)
+        self.cut_jk    = {} # rc --> fc(r_jk)
+        self.n_inside  = {} # rc --> number of neighbours inside rc
+        self.monomials = None # Powers of unit vectors, see G5_separable
+        self.cos_full  = None # (n x n) pair matrices, see compute_matrices
+    def compute_pairs(self):
+        if self.cos_theta is not None:
+            return
+        xyz, j, k      = self.xyz, self.j, self.k
+        r_j, r_k       = self.r[...,j], self.r[...,k]
+        self.cos_theta = np.sum(xyz[...,j,:]*xyz[...,k,:], axis=-1) / (r_j*r_k)
+        self.r2_sum    = r_j**2 + r_k**2
+        self.r2_jk     = np.sum((xyz[...,j,:] - xyz[...,k,:])**2, axis=-1)
+        self.r_jk      = np.sqrt(self.r2_jk)
+    def compute_matrices(self):
+        """
+        Unit vectors, cos(theta_jik) and r_jk for all j,k (not only j<k), used by the gradients
+        """
+        if self.cos_full is not None:
+            return
+        self.unit      = self.xyz / self.r[...,np.newaxis]
+        self.cos_full  = np.matmul(self.unit, np.swapaxes(self.unit, -1, -2))
+        self.r_jk_full = np.linalg.norm(self.xyz[...,:,np.newaxis,:] - self.xyz[...,np.newaxis,:,:], axis=-1)
+    def radial_and_derivative(self, r, eta, rc, rs):
+        """
+        exp(-eta*(r-rs)^2)*fc(r) and its derivative w.r.t. r
+        """
+        if self.cutoff not in cutoff_derivatives:
+            print "Gradients need the derivative of the cutoff function, see cutoff_derivatives. Exiting!"
+            sys.exit(0)
+        r_cut     = self.cutoff(r, rc)
+        exp_value = np.exp(-eta*(r-rs)**2)
+        return exp_value*r_cut, exp_value*(cutoff_derivatives[self.cutoff](r, rc) - 2*eta*(r-rs)*r_cut)
+    def G2_grad_all(self, eta, rc, rs):
+        """
+        G2 values (n_params x samples) and their gradients w.r.t. the (sorted)
+        neighbour positions (n_params x samples x n_neighbours x 3), in one pass
+        """
+        values = np.zeros((len(eta),) + self.r.shape[:-1])
+        grads  = np.zeros((len(eta),) + self.xyz.shape)
+        self.compute_matrices()
+        for p, (eta_p, rc_p, rs_p) in enumerate(zip(eta, rc, rs)):
+            n                   = self.inside(rc_p)
+            g, dg_dr            = self.radial_and_derivative(self.r[...,:n], eta_p, rc_p, rs_p)
+            values[p]           = np.sum(g, axis=-1)
+            grads[p,...,:n,:]   = dg_dr[...,np.newaxis] * self.unit[...,:n,:]
+        return values, grads
+    def G4_grad_all(self, rc, eta, zeta, lambda_c):
+        return self._angular_grad_all(rc, eta, zeta, lambda_c, True)
+    def G5_grad_all(self, rc, eta, zeta, lambda_c):
+        return self._angular_grad_all(rc, eta, zeta, lambda_c, False)
+    def _angular_grad_all(self, rc, eta, zeta, lambda_c, with_rjk):
+        """
+        G4/G5 values (n_params x samples) and gradients (n_params x samples x n_neighbours x 3)
+        from the full (n x n) pair matrices. With c = cos(theta_jik), A = (1 + lambda*c)^zeta,
+        w = exp(-eta*r^2)*fc(r) and h = w(r_jk) (G4 only), the pair term is A*w_j*w_k*h_jk and
+            dc/dx_j    = (u_k - c*u_j) / r_j
+            dr_j/dx_j  = u_j
+            dr_jk/dx_j = (x_j - x_k) / r_jk
+        """
+        self.compute_matrices()
+        values = np.zeros((len(zeta),) + self.r.shape[:-1])
+        grads  = np.zeros((len(zeta),) + self.xyz.shape)
+        for eta_n, rc_n in set(zip(eta, rc)):
+            n        = self.inside(rc_n)
+            u, x     = self.unit[...,:n,:], self.xyz[...,:n,:]
+            cos_jk   = self.cos_full[...,:n,:n]
+            w, dw_dr = self.radial_and_derivative(self.r[...,:n], eta_n, rc_n, 0.0)
+            w_k      = w[...,np.newaxis,:] * (1 - np.eye(n)) # w_k for all j != k
+            if with_rjk:
+                r_jk     = self.r_jk_full[...,:n,:n]
+                h, dh_dr = self.radial_and_derivative(r_jk, eta_n, rc_n, 0.0)
+                dh_x     = w[...,:,np.newaxis] * w_k * dh_dr / np.where(w_k != 0, r_jk, 1.0) # Term of dr_jk/dx_j
+                w_k      = w_k * h
+            w_jk_h   = w[...,:,np.newaxis] * w_k
+            for row in [p for p in range(len(zeta)) if eta[p] == eta_n and rc[p] == rc_n]:
+                base  = 1 + lambda_c[row]*cos_jk
+                A     = base**zeta[row]
+                dA_dc = zeta[row]*lambda_c[row] * base**(zeta[row]-1)
+                norm  = 2**(1-zeta[row]) # Normalization factor
+                values[row] = norm * 0.5 * np.sum(A*w_jk_h, axis=(-1,-2)) # All j != k, each pair twice
+                angle = dA_dc * w_jk_h
+                grad  = (np.matmul(angle, u) - u*np.sum(angle*cos_jk, axis=-1)[...,np.newaxis]) \
+                        / self.r[...,:n,np.newaxis]
+                grad += u * (dw_dr * np.sum(A*w_k, axis=-1))[...,np.newaxis]
+                if with_rjk:
+                    dist  = A * dh_x
+                    grad += x*np.sum(dist, axis=-1)[...,np.newaxis] - np.matmul(dist, x)
+                grads[row,...,:n,:] = norm * grad
+        return values, grads
+    def inside(self, rc):
+        """
+        Number of neighbours inside rc (see neighbours_inside)
+        """
+        if rc not in self.n_inside:
+            self.n_inside[rc] = neighbours_inside(self.r, rc)
+        return self.n_inside[rc]
+    def pairs_inside(self, rc):
+        """
+        Number of triplets where both neighbours can be inside rc
+        """
+        n = self.inside(rc)
+        return n*(n-1)//2
+    def cutoff_products(self, rc, with_rjk=False):
+        """
+        Returns fc(r_ij)*fc(r_ik) (times fc(r_jk) if 'with_rjk') for the triplets inside rc
+        """
+        self.compute_pairs()
+        t = self.pairs_inside(rc)
+        if rc not in self.cut_ijk:
+            r_cut            = self.cutoff(self.r, rc)
+            self.cut_ijk[rc] = r_cut[...,self.j[:t]] * r_cut[...,self.k[:t]]
+        if not with_rjk:
+            return self.cut_ijk[rc]
+        if rc not in self.cut_jk:
+            self.cut_jk[rc] = self.cutoff(self.r_jk[...,:t], rc)
+        return self.cut_ijk[rc] * self.cut_jk[rc]
+    def radial_products(self, rc, eta, with_rjk=False):
+        """
+        Same as exp(-eta*r2)*cutoff_products(rc, with_rjk), from the tabulated radial term
+        """
+        self.compute_pairs()
+        t = self.pairs_inside(rc)
+        w = self.radial(self.r[...,:self.inside(rc)], eta, rc, 0.0)
+        products = w[...,self.j[:t]] * w[...,self.k[:t]]
+        if with_rjk:
+            products *= self.radial(self.r_jk[...,:t], eta, rc, 0.0)
+        return products
+    def G4(self, rc, eta, zeta, lambda_c):
+        return self.G4_all([rc], [eta], [zeta], [lambda_c])[0]
+    def G5(self, rc, eta, zeta, lambda_c):
+        return self.G5_all([rc], [eta], [zeta], [lambda_c])[0]
+    def G4_all(self, rc, eta, zeta, lambda_c):
+        """
+        Evaluates one G4 per element of the parameter columns (arrays of same length)
+        """
+        self.compute_pairs()
+        return self._angular_all(rc, eta, zeta, lambda_c, self.r2_sum + self.r2_jk, True)
+    def G5_all(self, rc, eta, zeta, lambda_c):
+        """
+        Evaluates one G5 per element of the parameter columns (arrays of same length)
+        """
+        zeta      = np.asarray(zeta, dtype=float)
+        lambda_c  = np.asarray(lambda_c, dtype=float)
+        eta       = np.asarray(eta, dtype=float)
+        rc        = np.asarray(rc,  dtype=float)
+        use_sep   = np.array([self.use_separable(rc_n, zeta_n) for rc_n, zeta_n in zip(rc, zeta)], dtype=bool)
+        summation = np.zeros((len(zeta),) + self.r.shape[:-1])
+        if np.any(use_sep):
+            summation[use_sep]  = self.G5_separable(rc[use_sep], eta[use_sep], zeta[use_sep], lambda_c[use_sep])
+        if not np.all(use_sep):
+            self.compute_pairs()
+            pairwise            = ~use_sep
+            summation[pairwise] = self._angular_all(rc[pairwise], eta[pairwise], zeta[pairwise],
+                                                    lambda_c[pairwise], self.r2_sum, False)
+        return summation
+    def use_separable(self, rc, zeta):
+        """
+        Decides if G5_separable or the pairwise kernel is used for one G5
+        """
+        if self.separable == "auto":
+            n = self.inside(rc)
+            return separable_zeta(zeta) and separable_terms(int(zeta)) < separable_crossover*(n-1)
+        return self.separable and separable_zeta(zeta)
+    def _angular_all(self, rc, eta, zeta, lambda_c, r2, with_rjk):
+        """
+        Common part of G4 and G5. The angular factor is computed once per distinct
+        (zeta, lambda) and the product of exponential and cutoffs once per distinct
+        (eta, rc), only for the triplets inside rc. Output is (n_params x samples)
+        for batched input.
+        """
+        zeta      = np.asarray(zeta, dtype=float)
+        lambda_c  = np.asarray(lambda_c, dtype=float)
+        eta       = np.asarray(eta, dtype=float)
+        rc        = np.asarray(rc,  dtype=float)
+        newaxes   = (1,)*np.ndim(r2)
+        t_max     = max(self.pairs_inside(rc_n) for rc_n in set(rc))
+        zl_unique, zl_index = np.unique(zeta + 1j*lambda_c, return_inverse=True)
+        angle_factor = (1 + zl_unique.imag.reshape((-1,) + newaxes) * self.cos_theta[...,:t_max]) \
+                       **zl_unique.real.reshape((-1,) + newaxes)
+        summation    = np.zeros((len(zeta),) + np.shape(r2)[:-1])
+        for eta_n, rc_n in set(zip(eta, rc)):
+            rows           = np.where((eta == eta_n) & (rc == rc_n))[0]
+            t              = self.pairs_inside(rc_n)
+            if self.radial is None:
+                exp_cut_factor = np.exp(-eta_n * r2[...,:t]) * self.cutoff_products(rc_n, with_rjk)
+            else:
+                exp_cut_factor = self.radial_products(rc_n, eta_n, with_rjk)
+            summation[rows] = np.sum(angle_factor[zl_index[rows],...,:t] * exp_cut_factor, axis=-1)
+        summation   *= (2**(1-zeta)).reshape((-1,) + newaxes[:-1]) # Normalization factor
+        return summation
+    def G5_separable(self, rc, eta, zeta, lambda_c):
+        """
+        G5 for integer zeta in O(n_neighbours) instead of O(n_neighbours^2).
+        With w_j = exp(-eta*r_ij^2)*fc(r_ij) and unit vectors u_j:
+            (1 + lambda*cos)^zeta = sum_n binom(zeta,n) lambda^n (u_j.u_k)^n
+            (u_j.u_k)^n           = sum_{a+b+c=n} n!/(a!b!c!) u_j^(a,b,c) u_k^(a,b,c)
+        so the sum over j<k becomes (sum_{j,k} - sum_{j=k}) / 2 where the full double
+        sum factorizes into squares of the moments M_abc = sum_j w_j u_j^(a,b,c).
+        """
+        zeta      = np.asarray(zeta, dtype=float)
+        lambda_c  = np.asarray(lambda_c, dtype=float)
+        eta       = np.asarray(eta, dtype=float)
+        rc        = np.asarray(rc,  dtype=float)
+        max_zeta  = int(zeta.max())
+        n_terms   = separable_terms(max_zeta)
+        exponents, degree, multinomial = monomial_exponents(max_zeta)
+        if self.monomials is None or self.monomials.shape[-1] < n_terms:
+            u      = self.xyz / self.r[...,np.newaxis]
+            powers = u[...,np.newaxis] ** np.arange(max_zeta+1) # (..., N, xyz, power)
+            self.monomials = powers[...,0,exponents[:,0]] * powers[...,1,exponents[:,1]] * powers[...,2,exponents[:,2]]
+        # Coefficient of each moment squared, for each row: binom(zeta,n) lambda^n n!/(a!b!c!)
+        zeta_int = zeta.astype(int)[:,np.newaxis]
+        inside   = degree <= zeta_int
+        binom    = factorials[zeta_int] / (factorials[np.minimum(degree, zeta_int)] * factorials[np.maximum(zeta_int - degree, 0)])
+        coef     = binom * lambda_c[:,np.newaxis]**degree * multinomial * inside
+        summation = np.zeros((len(zeta),) + self.r.shape[:-1])
+        for eta_n, rc_n in set(zip(eta, rc)):
+            rows      = np.where((eta == eta_n) & (rc == rc_n))[0]
+            n         = self.inside(rc_n)
+            if self.radial is None:
+                w     = np.exp(-eta_n * self.r[...,:n]**2) * self.cutoff(self.r[...,:n], rc_n)
+            else:
+                w     = self.radial(self.r[...,:n], eta_n, rc_n, 0.0)
+            moments   = np.einsum('...n,...nt->...t', w, self.monomials[...,:n,:n_terms])
+            all_pairs = np.dot(moments**2, coef[rows].T)                                 # j,k (all)
+            self_pair = np.sum(w**2, axis=-1)[...,np.newaxis] * (1 + lambda_c[rows])**zeta[rows] # j = k
+            summation[rows] = np.moveaxis(0.5*(all_pairs - self_pair), -1, 0)
+        summation *= (2**(1-zeta)).reshape((-1,) + (1,)*(self.r.ndim-1)) # Normalization factor
+        return summation
+
+separable_max_zeta  = 8    # Round-off grows with zeta (alternating binomial sums), use pairs above
+separable_crossover = 5.0  # Separable if terms < crossover*(n-1), measured with benchmark_G5_separable
+
+def separable_zeta(zeta):
+    return zeta == int(zeta) and 0 <= zeta <= separable_max_zeta
+
+def separable_terms(max_zeta):
+    """
+    Number of monomials u_x^a u_y^b u_z^c with a+b+c <= max_zeta
+    """
+    return (max_zeta+1)*(max_zeta+2)*(max_zeta+3)//6
+
+factorials      = np.array([float(factorial(n)) for n in range(separable_max_zeta+1)])
+_exponent_cache = {}
+
+def monomial_exponents(max_zeta):
+    """
+    All (a,b,c) with a+b+c <= max_zeta, ordered by degree a+b+c.
+    Returns exponents, degrees and multinomial coefficients (a+b+c)!/(a!b!c!)
+    """
+    if max_zeta not in _exponent_cache:
+        exponents   = np.array([(a, b, n-a-b) for n in range(max_zeta+1)
+                                for a in range(n,-1,-1) for b in range(n-a,-1,-1)], dtype=int)
+        degree      = exponents.sum(axis=1)
+        multinomial = factorials[degree] / np.prod(factorials[exponents], axis=1)
+        _exponent_cache[max_zeta] = (exponents, degree, multinomial)
+    return _exponent_cache[max_zeta]
+
+def G4_all(xyz, eta, rc, zeta, lambda_c, cutoff=cutoff_cos):
+    """
+    One G4 per element of the parameter columns (same order as G2_all),
+    output is (n_params x samples), see TripletGeometry
+    """
+    return TripletGeometry(xyz, cutoff).G4_all(rc, eta, zeta, lambda_c)
+
+def G5_all(xyz, eta, rc, zeta, lambda_c, cutoff=cutoff_cos):
+    """
+    One G5 per element of the parameter columns (same order as G2_all),
+    output is (n_params x samples), see TripletGeometry
+    """
+    return TripletGeometry(xyz, cutoff).G5_all(rc, eta, zeta, lambda_c)
+
+"""
+#################
+Backends
+#################
+"""
+
+_backends          = {} # name --> {kernel name: function}
+_optional_backends = {"numba": "numba_backend"} # name --> module that registers it on import
+active_backend     = "numpy"
+
+def register_backend(name, kernels):
+    """
+    kernels: {kernel name: function}. Kernels a backend does not
+    provide are taken from the reference backend "numpy".
+    ----------------
+    Kernel   |   Arguments
+    ----------------
+    G2_all   |   r,   eta, rc, rs
+    G4_all   |   xyz, eta, rc, zeta, lambda_c
+    G5_all   |   xyz, eta, rc, zeta, lambda_c
+    ddx_G2   |   see derivatives_symm_func.calculate_ddx_G2
+    ddx_G4   |   see derivatives_symm_func.calculate_ddx_G4
+    """
+    _backends.setdefault(name, {}).update(kernels)
+
+def load_backend(name):
+    """
+    Returns True if the backend is available (imports optional ones)
+    """
+    if name not in _backends and name in _optional_backends:
+        try:
+            __import__(_optional_backends[name])
+        except ImportError as e:
+            print "Backend '%s' is not available (%s)" %(name, e)
+            return False
+    return name in _backends
+
+def set_backend(name):
+    """
+    Selects the backend used by symmetryTransformBehler and the derivatives.
+    Falls back to "numpy" if it can not be loaded, i.e. numba is not installed.
+    """
+    global active_backend
+    if name not in _backends and name not in _optional_backends:
+        print "Backend:", name, "was not understood. Use one of:", sorted(set(_backends) | set(_optional_backends))
+        sys.exit(0)
+    if not load_backend(name):
+        print "...falling back to the numpy backend"
+        name = "numpy"
+    active_backend = name
+    return name
+
+def get_kernel(kernel, backend=None):
+    if backend is None:
+        backend = active_backend
+    if kernel in _backends[backend]:
+        return _backends[backend][kernel]
+    return _backends["numpy"][kernel]
+
+register_backend("numpy", {"G2_all": G2_all, "G4_all": G4_all, "G5_all": G5_all})
+
+def check_backends(neighbour_list=[1,2,5,12,30], samples=20, tolerance=1E-12):
+    """
+    Checks that every available backend agrees with the numpy (reference)
+    backend within 'tolerance' (relative), on random environments with
+    the Behler Si parameters. Returns True if all agree.
+    """
+    from descriptor_plan import load_descriptor_plan
+    plan    = load_descriptor_plan()
+    all_ok  = True
+    columns = {"G2_all": (plan.G2_rows, [plan.eta, plan.rc, plan.rs]),
+               "G4_all": (plan.G5_rows, [plan.eta, plan.rc, plan.zeta, plan.lambd]), # G4 on the G5 parameters
+               "G5_all": (plan.G5_rows, [plan.eta, plan.rc, plan.zeta, plan.lambd])}
+    for name in sorted(set(_backends) | set(_optional_backends)):
+        if name == "numpy" or not load_backend(name):
+            continue
+        for kernel in sorted(_backends[name]):
+            if kernel not in columns:
+                continue # Checked by the module defining it, i.e. derivatives_symm_func
+            rows, params = columns[kernel]
+            params       = [p[rows] for p in params]
+            max_diff     = 0.0
+            for N in neighbour_list:
+                xyz = np.random.uniform(-4., 4., (samples, N, 3))
+                x   = np.linalg.norm(xyz, axis=-1) if kernel == "G2_all" else xyz
+                ref = get_kernel(kernel, "numpy")(x, *params)
+                for x_i in [x, x[0]]: # Batch and single environment
+                    value    = get_kernel(kernel, name)(x_i, *params)
+                    ref_i    = ref if x_i is x else ref[:,0]
+                    max_diff = max(max_diff, np.max(np.abs(value - ref_i) / np.maximum(np.abs(ref_i), 1.0)))
+            ok      = max_diff <= tolerance
+            all_ok  = all_ok and ok
+            print "Backend %-6s %-7s max rel.diff: %g %s" %(name, kernel, max_diff, "OK" if ok else "FAILED")
+    return all_ok
+
+def G4_serial(xyz, rc, eta, zeta, lambda_c, cutoff=cutoff_cos):
+    """
+    Slow, i.e. only use for checking G4 (same input as G4)
+    """
     r         = np.linalg.norm(xyz,axis=1)
     N         = len(r)
     r_cut     = cutoff(r,rc)
@@ -77,13 +696,10 @@ def G4(xyz, rc, eta, zeta, lambda_c, cutoff=cutoff_cos):
     summation *= 2**(1-zeta) # Normalization factor
     return summation
 
-def G5(xyz, rc, eta, zeta, lambda_c, cutoff=cutoff_cos):
-    """ xyz:
-    [[x1 y1 z1]
-     [x2 y2 z2]
-     [x3 y3 z3]
-     [x4 y4 z4]]
-     """
+def G5_serial(xyz, rc, eta, zeta, lambda_c, cutoff=cutoff_cos):
+    """
+    Slow, i.e. only use for checking G5 (same input as G5)
+    """
     r         = np.linalg.norm(xyz,axis=1)
     N         = len(r)
     r_cut     = cutoff(r,rc)
@@ -226,8 +842,59 @@ def G5_single_neighbor_rjk(theta, rc, zeta, lambda_c, eta, cutoff=cutoff_cos, pe
     cutoff_factor = cutoff(rij, rc)**2
     return angle_factor * exp_factor * cutoff_factor
 
+def benchmark_G4_G5(neighbour_list=[4,8,16,32], rc=6.0, repeats=20):
+    """
+    Compares the vectorized G4/G5 with the serial (double loop) versions
+    for a growing number of neighbours.
+    """
+    from timeit import default_timer as timer
+    eta, zeta, lambda_c = 0.01, 2.0, -1.0
+    print "Neighbours |  G4 serial [ms] |  G4 vector [ms] | Speedup |  G5 serial [ms] |  G5 vector [ms] | Speedup | Max rel.diff"
+    for N in neighbour_list:
+        xyz     = np.random.uniform(-rc/2., rc/2., (N,3))
+        timings = []
+        max_err = 0.0
+        for G_fast, G_slow in [(G4, G4_serial), (G5, G5_serial)]:
+            for G in [G_slow, G_fast]:
+                t0 = timer()
+                for i in range(repeats):
+                    value = G(xyz, rc, eta, zeta, lambda_c)
+                timings.append((timer() - t0) / repeats * 1000.)
+            G_exact = G_slow(xyz, rc, eta, zeta, lambda_c)
+            max_err = max(max_err, abs(G_fast(xyz, rc, eta, zeta, lambda_c) - G_exact) / abs(G_exact))
+        print "%10d | %15.4f | %15.4f | %7.1f | %15.4f | %15.4f | %7.1f | %g" \
+              %(N, timings[0], timings[1], timings[0]/timings[1],
+                   timings[2], timings[3], timings[2]/timings[3], max_err)
+
+def benchmark_G5_separable(neighbour_list=[4,8,16,32,64,128], zetas=[1,2,4,8], rc=6.0, repeats=20):
+    """
+    Timing of G5 with the separable (linear) and the pairwise (quadratic) kernel.
+    The crossover is the number of neighbours where the separable one gets faster.
+    """
+    from timeit import default_timer as timer
+    eta = 0.01
+    print "zeta | Neighbours | Pairwise [ms] | Separable [ms] | Speedup | Max rel.diff"
+    for zeta in zetas:
+        crossover = None
+        for N in neighbour_list:
+            xyz     = np.random.uniform(-rc/2., rc/2., (N,3))
+            timings = []
+            values  = []
+            for separable in [False, True]:
+                t0 = timer()
+                for i in range(repeats):
+                    G = TripletGeometry(xyz, separable=separable).G5_all([rc]*2, [eta]*2, [zeta]*2, [1.,-1.])
+                timings.append((timer() - t0) / repeats * 1000.)
+                values.append(G)
+            if crossover is None and timings[1] < timings[0]:
+                crossover = N
+            print "%4d | %10d | %13.4f | %14.4f | %7.2f | %g" %(zeta, N, timings[0], timings[1],
+                        timings[0]/timings[1], np.max(np.abs(values[1]-values[0])/np.abs(values[0])))
+        print "zeta = %d: separable kernel is faster from %s neighbours" %(zeta, crossover)
+
 if __name__ == '__main__':
     """
     Mainly for testing purpose
     """
-    print "This does absolutely nothing, I'm afraid dear!"
+    benchmark_G4_G5()
+    benchmark_G5_separable()
@@ -1,5 +1,10 @@
-from symmetry_functions import G1,G2,G3,G4,G5
+from symmetry_functions import G1,G2,G2_all,G3,G4,G5,TripletGeometry,sort_neighbours,neighbours_inside
+from symmetry_functions import cutoff_cos,TabulatedCutoff,TabulatedRadial,get_kernel
+from descriptor_plan import as_descriptor_plan
+import symmetry_functions
+import precision
 import numpy as np
+import sys
 
 def symmetryTransform(G_funcs, xyz_i):
     """
@@ -107,55 +112,266 @@ def symmetryTransform(G_funcs, xyz_i):
             G_output.append( G5(xyz, rc, eta, zeta, lambda_c) )
     return np.array(G_output)
 
-def symmetryTransformBehler(all_params_list, xyz):
-    r        = np.linalg.norm(xyz, axis=1)
-    G_output = []
-    for cur_param_set in all_params_list:
-        if cur_param_set[0] == 2:
-            """
-            ### This is G2 ###
-            ### Variables: ###
-                - rc, rs, eta
-            """
-            eta, rc, rs = cur_param_set[1:4] # notice not same order
-            G_output.append( G2(r, float(rc), float(rs), float(eta)) )
-        elif cur_param_set[0] == 4:
-            """
-            ### This is G4 ###
-            ### Variables:
-                - rc, eta, zeta, lambd
-            """
-            eta, rc, zeta, lambd = cur_param_set[1:5] # notice not same order
-            G_output.append( G4(xyz, float(rc), float(eta), float(zeta), float(lambd)) )
-        elif cur_param_set[0] == 5:
-            """
-            ### This is G5 ###
-            ### Variables:
-                - rc, eta, zeta, lambd
-            """
-            eta, rc, zeta, lambd = cur_param_set[1:5] # notice not same order
-            G_output.append( G5(xyz, float(rc), float(eta), float(zeta), float(lambd)) )
+def symmetryTransformBehler(plan, xyz, lookup=None, lookup_kind="cubic"):
+    """
+    plan: DescriptorPlan (or the old list of lists, see generate_symmfunc_input_Si_Behler)
+    xyz:  Neighbour coordinates relative to atom i, (n_neighbours x 3).
+          Many environments with the same number of neighbours can be given
+          as (samples x n_neighbours x 3), output is then (samples x n_descriptors)
+    lookup: None (exact) or max. error of the tabulated cutoff and radial functions,
+          "linear" or "cubic" interpolation, see LookupTable.
+    Computed in double precision, returned in precision.dtype.
+    Uses the active backend, see symmetry_functions.set_backend.
+    """
+    plan     = as_descriptor_plan(plan)
+    cutoff   = cutoff_cos
+    radial   = None
+    if lookup is not None:
+        cutoff = TabulatedCutoff(cutoff_cos, lookup, lookup_kind)
+        radial = TabulatedRadial(cutoff_cos, lookup, lookup_kind)
+    # Sort neighbours by distance, so each cutoff only sees the neighbours inside it
+    xyz, r, _ = sort_neighbours(xyz)
+    G_output = np.zeros(r.shape[:-1] + (plan.n_descriptors,))
+    if lookup is None and symmetry_functions.active_backend != "numpy":
+        # Compiled kernels, one call per symmetry function type:
+        n = neighbours_inside(r, plan.max_cutoff)
+        for rows, kernel, x, params in [(plan.G2_rows, "G2_all", r[...,:n],     [plan.eta, plan.rc, plan.rs]),
+                                        (plan.G4_rows, "G4_all", xyz[...,:n,:], [plan.eta, plan.rc, plan.zeta, plan.lambd]),
+                                        (plan.G5_rows, "G5_all", xyz[...,:n,:], [plan.eta, plan.rc, plan.zeta, plan.lambd])]:
+            if len(rows):
+                G_values           = get_kernel(kernel)(x, *[column[rows] for column in params])
+                G_output[...,rows] = np.moveaxis(G_values, 0, -1)
+        return G_output.astype(precision.dtype, copy=False)
+    if len(plan.G2_rows):
+        """
+        ### This is G2 ###
+        ### Variables: ###
+            - rc, rs, eta
+        """
+        # All G2's of the same cutoff are computed in one go, see G2_all:
+        for rc in np.unique(plan.rc[plan.G2_rows]):
+            rows                = plan.groups[(2, rc)]
+            r_inside            = r[...,:neighbours_inside(r, rc)]
+            G_output[...,rows]  = np.moveaxis(G2_all(r_inside, plan.eta[rows], plan.rc[rows], plan.rs[rows],
+                                                      cutoff, radial), 0, -1)
+    if len(plan.G4_rows) or len(plan.G5_rows):
+        # All G4's and G5's are computed from the same triplet geometry, see TripletGeometry:
+        triplets = TripletGeometry(xyz, cutoff, plan.max_cutoff, is_sorted=True, radial=radial)
+    if len(plan.G4_rows):
+        """
+        ### This is G4 ###
+        ### Variables:
+            - rc, eta, zeta, lambd
+        """
+        rows                = plan.G4_rows
+        G4_values           = triplets.G4_all(plan.rc[rows], plan.eta[rows], plan.zeta[rows], plan.lambd[rows])
+        G_output[...,rows]  = np.moveaxis(G4_values, 0, -1)
+    if len(plan.G5_rows):
+        """
+        ### This is G5 ###
+        ### Variables:
+            - rc, eta, zeta, lambd
+        """
+        rows                = plan.G5_rows
+        G5_values           = triplets.G5_all(plan.rc[rows], plan.eta[rows], plan.zeta[rows], plan.lambd[rows])
+        G_output[...,rows]  = np.moveaxis(G5_values, 0, -1)
+    return G_output.astype(precision.dtype, copy=False)
+
+def symmetryTransformBehlerGrad(plan, xyz):
+    """
+    Symmetry vector and its Jacobian w.r.t. the neighbour coordinates, in one pass
+    (distances, exponentials and cutoffs are shared between values and derivatives).
+    xyz: (n_neighbours x 3), or (samples x n_neighbours x 3)
+    Returns G:  (n_descriptors),                    or (samples x n_descriptors)
+            dG: (n_descriptors x n_neighbours x 3), or (samples x n_descriptors x n_neighbours x 3)
+    where dG[...,g,j,:] = dG_g / dxyz_j (same neighbour order as the input).
+    The derivative w.r.t. the central atom is -np.sum(dG, axis=-2).
+    """
+    plan            = as_descriptor_plan(plan)
+    N               = xyz.shape[-2]
+    xyz, r, order   = sort_neighbours(xyz)
+    triplets        = TripletGeometry(xyz, max_cutoff=plan.max_cutoff, is_sorted=True)
+    n               = triplets.r.shape[-1] # Neighbours beyond max_cutoff have zero gradient
+    G_output        = np.zeros(r.shape[:-1] + (plan.n_descriptors,))
+    dG_sorted       = np.zeros(r.shape[:-1] + (N, plan.n_descriptors, 3))
+    for rows, grad_all, params in [(plan.G2_rows, triplets.G2_grad_all, [plan.eta, plan.rc, plan.rs]),
+                                   (plan.G4_rows, triplets.G4_grad_all, [plan.rc, plan.eta, plan.zeta, plan.lambd]),
+                                   (plan.G5_rows, triplets.G5_grad_all, [plan.rc, plan.eta, plan.zeta, plan.lambd])]:
+        if len(rows):
+            values, grads           = grad_all(*[column[rows] for column in params])
+            G_output[...,rows]      = np.moveaxis(values, 0, -1)
+            dG_sorted[...,:n,rows,:] = np.moveaxis(grads, 0, -2)
+    # Back to the input order of the neighbours:
+    dG_output = np.zeros_like(dG_sorted)
+    if r.ndim == 1:
+        dG_output[order] = dG_sorted
+    else:
+        dG_output[np.arange(r.shape[0])[:,np.newaxis], order] = dG_sorted
+    return G_output, np.swapaxes(dG_output, -3, -2)
+
+far_away = 1E3 # Position used for padding neighbours, outside of any cutoff
+
+def pad_environments(xyz, mask=None, offsets=None, start=0, stop=None):
+    """
+    Returns environments start,...,stop-1 as a padded (samples x max_neighbours x 3)
+    array, where missing neighbours are placed at (far_away, far_away, far_away)
+    so that every cutoff function makes them vanish.
+    xyz: padded (samples x max_neighbours x 3) array with mask (samples x max_neighbours),
+         True for real neighbours (mask=None: all are real),
+      or ragged (total_neighbours x 3) array with offsets, i.e. environment s is
+         xyz[offsets[s]:offsets[s+1]]
+    """
+    if offsets is None:
+        xyz_pad = np.array(xyz[start:stop], dtype=float) # Copy
+        if mask is not None:
+            xyz_pad[~mask[start:stop]] = far_away
+        return xyz_pad
+    offsets  = np.asarray(offsets)
+    if stop is None:
+        stop = len(offsets) - 1
+    counts   = np.diff(offsets[start:stop+1])
+    xyz_pad  = np.full((stop-start, max(counts.max(), 1), 3), far_away)
+    sample   = np.repeat(np.arange(stop-start), counts)
+    position = np.arange(offsets[stop]-offsets[start]) - np.repeat(offsets[start:stop]-offsets[start], counts)
+    xyz_pad[sample, position] = xyz[offsets[start]:offsets[stop]]
+    return xyz_pad
+
+def symmetryTransformBehlerBatch(plan, xyz, mask=None, offsets=None, chunk_size=200, verbose=False,
+                                 lookup=None, lookup_kind="cubic"):
+    """
+    Symmetry vectors of many environments, see pad_environments for input formats.
+    Environments are transformed 'chunk_size' at the time to bound memory usage.
+    lookup, lookup_kind: see symmetryTransformBehler.
+    Returns (samples x n_descriptors) matrix of precision.dtype, only each
+    chunk is computed in double precision.
+    """
+    plan      = as_descriptor_plan(plan)
+    n_samples = xyz.shape[0] if offsets is None else len(offsets) - 1
+    G_output  = np.zeros((n_samples, plan.n_descriptors), dtype=precision.dtype)
+    for start in range(0, n_samples, chunk_size):
+        stop = min(start + chunk_size, n_samples)
+        G_output[start:stop] = symmetryTransformBehler(plan, pad_environments(xyz, mask, offsets, start, stop),
+                                                          lookup, lookup_kind)
+        if verbose:
+            sys.stdout.write('\r' + ' '*80) # White out line
+            percent = round(float(stop)/n_samples*100., 2)
+            sys.stdout.write('\rTransforming xyz with symmetry functions. %.2f %% complete' %(percent))
+            sys.stdout.flush()
+    return G_output
+
+def symmetryTransformBehlerGradBatch(plan, xyz, mask=None, offsets=None, chunk_size=200):
+    """
+    Symmetry vectors and Jacobians of many environments, see pad_environments
+    for input formats and symmetryTransformBehlerGrad for the output.
+    Returns G: (samples x n_descriptors) and
+         padded input: dG (samples x n_descriptors x max_neighbours x 3)
+         ragged input: dG (total_neighbours x n_descriptors x 3), row t belongs to xyz[t]
+    """
+    plan      = as_descriptor_plan(plan)
+    n_samples = xyz.shape[0] if offsets is None else len(offsets) - 1
+    G_output  = np.zeros((n_samples, plan.n_descriptors))
+    if offsets is None:
+        dG_output = np.zeros((n_samples, plan.n_descriptors) + xyz.shape[1:])
+    else:
+        dG_output = np.zeros((offsets[-1] - offsets[0], plan.n_descriptors, 3))
+    for start in range(0, n_samples, chunk_size):
+        stop            = min(start + chunk_size, n_samples)
+        G_chunk, dG_chunk = symmetryTransformBehlerGrad(plan, pad_environments(xyz, mask, offsets, start, stop))
+        G_output[start:stop] = G_chunk
+        if offsets is None:
+            dG_output[start:stop] = dG_chunk
         else:
-            print "Symm.func. number:", cur_param_set[0], "was not understood. Input 2 or 4..."
-    return np.array(G_output)
+            # Padding neighbours are dropped, the real ones come first in each environment
+            counts = np.diff(offsets[start:stop+1])
+            real   = np.arange(dG_chunk.shape[-2]) < counts[:,np.newaxis]
+            dG_output[offsets[start]-offsets[0]:offsets[stop]-offsets[0]] = np.swapaxes(dG_chunk, 1, 2)[real]
+    if mask is not None:
+        dG_output *= np.asarray(mask)[:,np.newaxis,:,np.newaxis] # Padding neighbours
+    return G_output, dG_output
 
+def check_gradients(neighbour_list=[1,2,5,12,30], samples=5, h=1E-6, tolerance=1E-12, fd_tolerance=1E-6):
+    """
+    Compares symmetryTransformBehlerGrad with symmetryTransformBehler
+    (values, 'tolerance') and with central differences (Jacobian,
+    'fd_tolerance' relative to max(|Jacobian|, 1)). Returns True if all agree.
+    """
+    from descriptor_plan import load_descriptor_plan
+    plan   = load_descriptor_plan()
+    all_ok = True
+    print "Neighbours | Max rel.diff values | Max abs.diff Jacobian vs. FD | Max |Jacobian|"
+    for N in neighbour_list:
+        xyz       = np.random.uniform(-4., 4., (samples, N, 3))
+        G, dG     = symmetryTransformBehlerGrad(plan, xyz)
+        G_ref     = symmetryTransformBehler(plan, xyz)
+        dG_fd     = np.zeros_like(dG)
+        for j in range(N):
+            for c in range(3):
+                xyz_p, xyz_m = np.copy(xyz), np.copy(xyz)
+                xyz_p[:,j,c] += h
+                xyz_m[:,j,c] -= h
+                dG_fd[:,:,j,c] = (symmetryTransformBehler(plan, xyz_p) - symmetryTransformBehler(plan, xyz_m)) / (2*h)
+        G_single, dG_single = symmetryTransformBehlerGrad(plan, xyz[0])
+        G_range   = np.maximum(np.max(np.abs(G_ref), axis=0), 1E-300) # Relative to the range of each descriptor
+        dG_range  = max(np.max(np.abs(dG)), 1.0)
+        G_diff    = np.max(np.abs(G - G_ref) / G_range)
+        dG_diff   = np.max(np.abs(dG - dG_fd))
+        single_ok = np.max(np.abs(G_single - G[0]) / G_range) <= tolerance and \
+                    np.max(np.abs(dG_single - dG[0])) <= tolerance*dG_range # Single environment vs. batch
+        ok        = single_ok and G_diff <= tolerance and dG_diff <= fd_tolerance*dG_range
+        all_ok    = all_ok and ok
+        print "%10d | %19g | %28g | %g %s" %(N, G_diff, dG_diff, np.max(np.abs(dG)), "OK" if ok else "FAILED")
+    return all_ok
 
+def benchmark_batch_transform(size=2000, neighbour_list=[4,10,20], chunk_sizes=[100,500,2000]):
+    """
+    Samples per second of symmetryTransformBehlerBatch vs. calling
+    symmetryTransformBehler in a loop over all samples.
+    """
+    from timeit import default_timer as timer
+    from descriptor_plan import load_descriptor_plan
+    plan = load_descriptor_plan()
+    print "Neighbours |  Loop [samples/s] | Chunk | Batch [samples/s] | Speedup | Max abs.diff"
+    for neighbours in neighbour_list:
+        xyz = np.random.uniform(-3.5, 3.5, (size, neighbours, 3))
+        t0  = timer()
+        G_loop = np.array([symmetryTransformBehler(plan, xyz_i) for xyz_i in xyz])
+        loop_speed = size / (timer() - t0)
+        for chunk_size in chunk_sizes:
+            t0 = timer()
+            G_batch = symmetryTransformBehlerBatch(plan, xyz, chunk_size=chunk_size)
+            batch_speed = size / (timer() - t0)
+            print "%10d | %17.1f | %5d | %17.1f | %7.1f | %g" %(neighbours, loop_speed, chunk_size,
+                        batch_speed, batch_speed/loop_speed, np.max(np.abs(G_batch - G_loop)))
+
+def benchmark_lookup_tables(size=2000, neighbours=20, max_errors=[1E-4,1E-6,1E-8,1E-10], kinds=["linear","cubic"]):
+    """
+    Speed vs. accuracy of the tabulated cutoff and radial functions,
+    compared with the exact transform. Table construction is not timed.
+    Descriptors are sums over neighbours (pairs), so their error can be
+    up to n_neighbours (n_pairs) times the max_error of a single table.
+    """
+    from timeit import default_timer as timer
+    from descriptor_plan import load_descriptor_plan
+    plan = load_descriptor_plan()
+    xyz  = np.random.uniform(-3.5, 3.5, (size, neighbours, 3))
+    t0   = timer()
+    G_exact     = symmetryTransformBehlerBatch(plan, xyz)
+    exact_speed = size / (timer() - t0)
+    print "Exact: %.1f samples/s" %(exact_speed)
+    print " Kind  | Max error | Table points | Lookup [samples/s] | Speedup | Max abs.diff | Max rel.diff"
+    for kind in kinds:
+        for max_error in max_errors:
+            symmetryTransformBehler(plan, xyz[:1], max_error, kind) # Build the tables
+            t0 = timer()
+            G_lookup = symmetryTransformBehlerBatch(plan, xyz, lookup=max_error, lookup_kind=kind)
+            lookup_speed = size / (timer() - t0)
+            n_points = max(table.n_points for key, table in symmetry_functions._table_cache.items()
+                           if key[-2:] == (max_error, kind))
+            abs_diff = np.abs(G_lookup - G_exact)
+            rel_diff = abs_diff / np.max(np.abs(G_exact), axis=0) # Relative to the range of each descriptor
+            print "%6s | %9.0e | %12d | %18.1f | %7.2f | %12g | %g" %(kind, max_error, n_points, lookup_speed,
+                        lookup_speed/exact_speed, np.max(abs_diff), np.max(rel_diff))
 
 if __name__ == '__main__':
-    print "This will perform tests of the Stillinger Weber potential"
-    print "-------------------------------"
-
-    r_low     = 0.85
-    r_high    = 1.8
-    size      = 1       # Note this
-    neighbors = 15
-    PES       = PES_Stillinger_Weber
-    xyz_N     = createXYZ(r_low, r_high, size, neighbors)
-    Ep        = potentialEnergyGenerator(xyz_N, PES)
-    xyz_i     = xyz_N[:,:,0] # Size is just 1, but anyway..
-    G_funcs   = example_generate_G_funcs_input()
-    G_vec     = symmetryTransform(G_funcs, xyz_i)
-
-    print "Number of symmetry functions used to describe each atom i:", len(G_vec)
-    print "-------------------------------"
-    print G_vec
+    benchmark_batch_transform()
+    benchmark_lookup_tables()
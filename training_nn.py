@@ -21,7 +21,12 @@ import signal # Catch ctrl+c
 
 def train_neural_network(x, y, epochs, nNodes, hiddenLayers, batchSize, testSize,
                      learning_rate=0.001, loss_function="L2", activation_function="sigmoid",
-                     potential_name="",verbose=True,grid_search_flag=False):
+                     potential_name="",verbose=True,grid_search_flag=False,input_pipeline=False):
+    """
+    input_pipeline: Batches are shuffled, cut and prefetched in-graph (tf.data, see
+                    make_input_pipeline), else fed one by one from loadFromFile (feed_dict).
+                    Off by default, it was not faster on one core (see benchmark_input_pipeline)
+    """
     # Allow for Ctrl+C to stop training early (and/or continue anyway)
     global quit_now; quit_now = False
     def signal_handler(signal, frame):
@@ -50,16 +55,27 @@ def train_neural_network(x, y, epochs, nNodes, hiddenLayers, batchSize, testSize
     # Begin timing (wall-, not cpu time. Not meant for rigid comparison!)
     t0 = timer()
 
+    # Load into memory the train/test data
+    all_data     = loadFromFile(testSize, filename, shuffle_rows=True, reuse_buffer=True)
+    xTest, yTest = all_data(testSize, return_test=True)
+    train_size   = all_data.number_of_train_data() # Note that SUM(all batch_size) = train_size
+
     # Begin session
     with tf.Session() as sess:
+        # Batches come from the tf.data pipeline, or are fed directly into x and y
+        if input_pipeline:
+            iterator, x_batch, y_batch, batches_per_epoch = make_input_pipeline(x, y, batchSize, train_size)
+        else:
+            x_batch, y_batch = x, y
+
         # Setup of graph for later computation with tensorflow
-        prediction, weights, biases, neurons = neural_network(x)
+        prediction, weights, biases, neurons = neural_network(x_batch)
         if   loss_function == "L2": # Train with RMSE error
-            cost = tf.nn.l2_loss(prediction-y)
+            cost = tf.nn.l2_loss(prediction-y_batch)
         elif loss_function == "L1": # Train with L1 norm
-            cost = tf.reduce_sum(np.abs(prediction-y))
+            cost = tf.reduce_sum(np.abs(prediction-y_batch))
         # Create operation to get the RMSE loss: (not for training, only evaluation)
-        RMSE = tf.sqrt(tf.reduce_mean(tf.square(prediction-y)))
+        RMSE = tf.sqrt(tf.reduce_mean(tf.square(prediction-y_batch)))
 
         # Create the optimizer, with cost function to minimize
         optimizer = tf.train.AdamOptimizer(learning_rate=learning_rate).minimize(cost)
@@ -80,11 +96,13 @@ def train_neural_network(x, y, epochs, nNodes, hiddenLayers, batchSize, testSize
             saveFileName += "/run"
             saver.save(sess, saveFileName + "0", write_meta_graph=False)
 
-        # Load into memory the train/test data, and generate batch
-        all_data          = loadFromFile(testSize, filename, shuffle_rows=True)
-        xTest, yTest      = all_data(testSize, return_test=True)
-        xTrain, yTrain, _ = all_data(batchSize, shuffle=False) # Get next batch of data
-        train_size        = all_data.number_of_train_data() # Note that SUM(all batch_size) = train_size
+        # Hand all training data to the pipeline once, or generate the first batch
+        if input_pipeline:
+            train_data = all_data.return_all_data()
+            sess.run(iterator.initializer, feed_dict={x: train_data[:,1:], y: train_data[:,0:1]})
+            batch_count = 0
+        else:
+            xTrain, yTrain, _ = all_data(batchSize, shuffle=False) # Get next batch of data
 
         # Loop over all epocs
         for epoch in range(0, numberOfEpochs):
@@ -96,16 +114,21 @@ def train_neural_network(x, y, epochs, nNodes, hiddenLayers, batchSize, testSize
             # Loop over all the train data set in batches
             while not epochIsDone:
                 # Loop through batches of the training set and adjust parameters for each batch. This is "online learning".
-                _, batch_cost = sess.run([optimizer, cost], feed_dict={x: xTrain, y: yTrain})
-                avg_cost     += batch_cost / train_size
+                if input_pipeline:
+                    _, batch_cost = sess.run([optimizer, cost]) # Next batch is already waiting in the pipeline
+                    batch_count  += 1
+                    epochIsDone   = batch_count % batches_per_epoch == 0
+                else:
+                    _, batch_cost = sess.run([optimizer, cost], feed_dict={x: xTrain, y: yTrain})
 
-                # Read new data from loaded training data file (to use next step, unless epoch done)
-                xTrain, yTrain, epochIsDone = all_data(batchSize, shuffle=True) # Get next batch of data. If last batch-->then shuffle
+                    # Read new data from loaded training data file (to use next step, unless epoch done)
+                    xTrain, yTrain, epochIsDone = all_data(batchSize, shuffle=True) # Get next batch of data. If last batch-->then shuffle
+                avg_cost += batch_cost / train_size
 
                 # If all training data has been seen "once" epoch is done
                 if epochIsDone:
                     # Compute test set loss etc:
-                    testRMSE  = sess.run(RMSE, feed_dict={x: xTest , y: yTest})
+                    testRMSE  = sess.run(RMSE, feed_dict={x_batch: xTest , y_batch: yTest}) # Bypasses the pipeline
                     trainRMSE = sqrt(avg_cost*2) # Math.sqrt does this quickest (only one number)
                     list_of_rmse_test.append(testRMSE)
                     list_of_rmse_train.append(trainRMSE)
@@ -149,6 +172,63 @@ def train_neural_network(x, y, epochs, nNodes, hiddenLayers, batchSize, testSize
         return wall_time
 
 
+def make_input_pipeline(x, y, batchSize, train_size, prefetch=2):
+    """
+    In-graph shuffling, batching and background prefetching of the training data.
+    x, y: Placeholders that the training data is fed through once (iterator.initializer).
+    The batches go through the data in a new random order every epoch, the last batch
+    of an epoch holds the rest (train_size % batchSize), so nothing is left out.
+    Returns the iterator, next batch (x, y) and number of batches per epoch
+    """
+    dataset  = tf.data.Dataset.from_tensor_slices((x, y))
+    dataset  = dataset.shuffle(buffer_size=train_size).batch(batchSize).repeat().prefetch(prefetch)
+    iterator = dataset.make_initializable_iterator()
+    x_batch, y_batch = iterator.get_next()
+    return iterator, x_batch, y_batch, int(np.ceil(train_size / float(batchSize)))
+
+def benchmark_input_pipeline(filename, mb_sizes=[20,50,100,1000,5000,20000], epochs=5, nodes=35, hdnlayrs=2):
+    """
+    Training samples per second, batches fed with feed_dict (loadFromFile) vs.
+    the tf.data pipeline, for the batch sizes of grid_search_SW. Only the
+    training steps are timed, not loading of the data set or graph setup.
+    """
+    all_data   = loadFromFile(0, filename, shuffle_rows=True, reuse_buffer=True)
+    train_data = all_data.return_all_data()
+    train_size = all_data.number_of_train_data()
+    input_vars = train_data.shape[1] - 1
+    print "Batch size | feed_dict [samples/s] | tf.data [samples/s] | Speedup"
+    for batchSize in mb_sizes:
+        if batchSize > train_size:
+            continue
+        speeds = []
+        for input_pipeline in [False, True]:
+            tf.reset_default_graph()
+            x = tf.placeholder('float', shape=(None, input_vars), name="x")
+            y = tf.placeholder('float', shape=(None, 1),          name="y")
+            if input_pipeline:
+                iterator, x_batch, y_batch, batches_per_epoch = make_input_pipeline(x, y, batchSize, train_size)
+            else:
+                x_batch, y_batch  = x, y
+                batches_per_epoch = int(np.ceil(train_size / float(batchSize))) # Same batches as the pipeline
+            prediction = nns.model(x_batch, activation_function="sigmoid", nNodes=nodes, hiddenLayers=hdnlayrs,
+                                   inputs=input_vars, outputs=1)[0]
+            optimizer  = tf.train.AdamOptimizer(learning_rate=0.001).minimize(tf.nn.l2_loss(prediction-y_batch))
+            with tf.Session() as sess:
+                sess.run(tf.global_variables_initializer())
+                if input_pipeline:
+                    sess.run(iterator.initializer, feed_dict={x: train_data[:,1:], y: train_data[:,0:1]})
+                    sess.run(optimizer) # Fill the prefetch buffer
+                t0 = timer()
+                for step in range(epochs*batches_per_epoch):
+                    if input_pipeline:
+                        sess.run(optimizer)
+                    else:
+                        xTrain, yTrain, _ = all_data(batchSize, shuffle=True)
+                        sess.run(optimizer, feed_dict={x: xTrain, y: yTrain})
+                t_train = timer() - t0
+            speeds.append(epochs*train_size / t_train)
+        print "%10d | %21.0f | %19.0f | %7.2f" %(batchSize, speeds[0], speeds[1], speeds[1]/speeds[0])
+
 def example_Stillinger_Weber():
     # Get filename of traindata and number of epochs from command line
     global filename, saveFlag, loadPath
@@ -334,6 +414,8 @@ if __name__ == '__main__':
         save_dir = example_Stillinger_Weber()
     if False:
         grid_search_SW()
+    if False:
+        benchmark_input_pipeline("SW_train_manyneigh_24000.txt")
 
     # Example 3: SiC (Silicon Carbide)
     # Potential: Vashista